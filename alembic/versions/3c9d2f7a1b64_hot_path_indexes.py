@@ -0,0 +1,75 @@
+"""hot path indexes
+
+Revision ID: 3c9d2f7a1b64
+Revises: 52be7bb26ee4
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3c9d2f7a1b64"
+down_revision: Union[str, None] = "52be7bb26ee4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Индексы, объявленные в models.py: create_all добавляет их только в новые
+# таблицы, существующим базам они приходят этой миграцией
+INDEXES = {
+    "ix_visits_doctor_id_date": "visits (doctor_id, date DESC)",
+    "ix_visits_patient_id_date": "visits (patient_id, date DESC)",
+    "ix_visits_date_id": "visits (date, id)",
+    "ix_visit_medicines_medicine_id": "visit_medicines (medicine_id)",
+    "ix_patients_name": "patients (last_name text_pattern_ops, first_name text_pattern_ops)",
+    "ix_visits_diagnosis_trgm": "visits USING gin (diagnosis gin_trgm_ops)",
+    "ix_medicines_side_effects_trgm": "medicines USING gin (side_effects gin_trgm_ops)",
+}
+
+
+def _drop_invalid_indexes():
+    # Прерванный CREATE INDEX CONCURRENTLY оставляет индекс INVALID, и
+    # IF NOT EXISTS его бы пропустил — такие удаляем и строим заново
+    names = ", ".join(f"'{name}'" for name in INDEXES)
+    invalid = op.get_bind().exec_driver_sql(
+        "SELECT c.relname FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+        f"WHERE NOT i.indisvalid AND c.relname IN ({names})"
+    ).scalars().all()
+    for name in invalid:
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        # SQLite (разработка): без pg_trgm и классов операторов Postgres
+        for name, definition in INDEXES.items():
+            if "USING gin" in definition:
+                continue
+            definition = definition.replace(" text_pattern_ops", "")
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # CONCURRENTLY не блокирует запись в таблицу, но не работает в транзакции
+    with op.get_context().autocommit_block():
+        _drop_invalid_indexes()
+        for name, definition in INDEXES.items():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+
+
+def downgrade() -> None:
+    # Индексы из предыдущих изменений (лента, поиск) остаются: они объявлены
+    # в models.py и без миграции
+    new_indexes = ("ix_visits_doctor_id_date", "ix_visits_patient_id_date")
+    if op.get_bind().dialect.name != "postgresql":
+        for name in new_indexes:
+            op.execute(f"DROP INDEX IF EXISTS {name}")
+        return
+
+    with op.get_context().autocommit_block():
+        for name in new_indexes:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
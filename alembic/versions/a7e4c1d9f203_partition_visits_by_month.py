@@ -0,0 +1,185 @@
+"""partition visits by month
+
+Revision ID: a7e4c1d9f203
+Revises: 3c9d2f7a1b64
+Create Date: 2026-10-18 14:00:00.000000
+
+visit_medicines.visit_date добавляется всегда. Помесячное секционирование
+visits и visit_medicines — только по явному запросу (Postgres 15+):
+
+    alembic -x partition_visits=1 upgrade head
+
+Переписывает обе таблицы под эксклюзивной блокировкой — запускать в окно
+обслуживания. Дальше секции наперёд создаёт `flask ensure-partitions`.
+
+Проверка на Postgres: TEST_POSTGRES_URL=<пустая база> pytest -k partition_migration
+"""
+
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from partitions import (
+    PARTITIONED_TABLES,
+    VISIT_PARTITION_MONTHS_AHEAD,
+    create_month_partitions,
+    is_partitioned,
+    month_starts,
+    next_month,
+)
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a7e4c1d9f203"
+down_revision: Union[str, None] = "3c9d2f7a1b64"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Ограничения и индексы, которые пересоздаются вместе с таблицами. В
+# секционированной схеме уникальные ключи обязаны включать ключ секции
+PARTITIONED_CONSTRAINTS = [
+    "ALTER TABLE visits ADD CONSTRAINT visits_pkey PRIMARY KEY (id, date)",
+    "ALTER TABLE visit_medicines ADD CONSTRAINT visit_medicines_pkey "
+    "PRIMARY KEY (id, visit_date)",
+    "ALTER TABLE visit_medicines ADD CONSTRAINT unique_visit_medicine "
+    "UNIQUE (visit_id, medicine_id, visit_date)",
+    # ON UPDATE CASCADE переносит назначения вслед за визитом при смене даты
+    "ALTER TABLE visit_medicines ADD CONSTRAINT visit_medicines_visit_id_fkey "
+    "FOREIGN KEY (visit_id, visit_date) REFERENCES visits (id, date) "
+    "ON DELETE CASCADE ON UPDATE CASCADE",
+]
+
+PLAIN_CONSTRAINTS = [
+    "ALTER TABLE visits ADD CONSTRAINT visits_pkey PRIMARY KEY (id)",
+    "ALTER TABLE visit_medicines ADD CONSTRAINT visit_medicines_pkey PRIMARY KEY (id)",
+    "ALTER TABLE visit_medicines ADD CONSTRAINT unique_visit_medicine "
+    "UNIQUE (visit_id, medicine_id)",
+    "ALTER TABLE visit_medicines ADD CONSTRAINT visit_medicines_visit_id_fkey "
+    "FOREIGN KEY (visit_id) REFERENCES visits (id) ON DELETE CASCADE",
+]
+
+COMMON_CONSTRAINTS = [
+    "ALTER TABLE visits ADD CONSTRAINT visits_patient_id_fkey "
+    "FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE",
+    "ALTER TABLE visits ADD CONSTRAINT visits_doctor_id_fkey "
+    "FOREIGN KEY (doctor_id) REFERENCES doctors (id) ON DELETE CASCADE",
+    "ALTER TABLE visit_medicines ADD CONSTRAINT visit_medicines_medicine_id_fkey "
+    "FOREIGN KEY (medicine_id) REFERENCES medicines (id) ON DELETE CASCADE",
+    "CREATE INDEX ix_visits_date_id ON visits (date, id)",
+    "CREATE INDEX ix_visits_doctor_id_date ON visits (doctor_id, date DESC)",
+    "CREATE INDEX ix_visits_patient_id_date ON visits (patient_id, date DESC)",
+    "CREATE INDEX ix_visit_medicines_medicine_id ON visit_medicines (medicine_id)",
+]
+
+TRGM_INDEX = (
+    "CREATE INDEX ix_visits_diagnosis_trgm ON visits USING gin (diagnosis gin_trgm_ops)"
+)
+
+
+def _partitioning_requested():
+    value = context.get_x_argument(as_dictionary=True).get("partition_visits", "")
+    return value.lower() in ("1", "true", "yes")
+
+
+def _add_visit_date():
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        op.execute(
+            "ALTER TABLE visit_medicines ADD COLUMN IF NOT EXISTS visit_date TIMESTAMP"
+        )
+        op.execute(
+            "UPDATE visit_medicines vm SET visit_date = v.date FROM visits v "
+            "WHERE v.id = vm.visit_id AND vm.visit_date IS NULL"
+        )
+        op.execute("ALTER TABLE visit_medicines ALTER COLUMN visit_date SET NOT NULL")
+        return
+
+    # SQLite (разработка): NOT NULL задним числом не добавить, проверяет модель
+    columns = {c["name"] for c in sa.inspect(bind).get_columns("visit_medicines")}
+    if "visit_date" not in columns:
+        op.execute("ALTER TABLE visit_medicines ADD COLUMN visit_date DATETIME")
+    op.execute(
+        "UPDATE visit_medicines SET visit_date = "
+        "(SELECT date FROM visits WHERE visits.id = visit_medicines.visit_id) "
+        "WHERE visit_date IS NULL"
+    )
+
+
+def _rebuild_tables(partitioned):
+    """Пересоздаёт visits и visit_medicines с данными: секционированными или обычными."""
+    bind = op.get_bind()
+    op.execute("LOCK TABLE visits, visit_medicines IN ACCESS EXCLUSIVE MODE")
+    for table in PARTITIONED_TABLES:
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+
+    for table, column in PARTITIONED_TABLES.items():
+        partition_by = f" PARTITION BY RANGE ({column})" if partitioned else ""
+        op.execute(
+            f"CREATE TABLE {table} (LIKE {table}_old INCLUDING DEFAULTS){partition_by}"
+        )
+
+    if partitioned:
+        # DEFAULT принимает даты за пределами созданных секций, чтобы запись
+        # визита никогда не падала из-за отсутствующей секции
+        for table in PARTITIONED_TABLES:
+            op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        today = datetime.utcnow().date()
+        first = bind.execute(sa.text("SELECT min(date) FROM visits_old")).scalar() or today
+        last = today
+        for _ in range(VISIT_PARTITION_MONTHS_AHEAD):
+            last = next_month(last.replace(day=1))
+        create_month_partitions(bind, month_starts(first, last))
+
+    for table in PARTITIONED_TABLES:
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_old")
+        # Последовательность id принадлежит старой таблице и удалилась бы с ней
+        sequence = bind.execute(
+            sa.text(f"SELECT pg_get_serial_sequence('{table}_old', 'id')")
+        ).scalar()
+        if sequence:
+            op.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+
+    op.execute("DROP TABLE visit_medicines_old")
+    op.execute("DROP TABLE visits_old")
+
+    for statement in (PARTITIONED_CONSTRAINTS if partitioned else PLAIN_CONSTRAINTS):
+        op.execute(statement)
+    for statement in COMMON_CONSTRAINTS:
+        op.execute(statement)
+    has_trgm = bind.execute(
+        sa.text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    ).first()
+    if has_trgm:
+        op.execute(TRGM_INDEX)
+    op.execute("ANALYZE visits")
+    op.execute("ANALYZE visit_medicines")
+
+
+def upgrade() -> None:
+    _add_visit_date()
+    if not _partitioning_requested():
+        return
+
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        print("⚠️ Секционирование визитов доступно только в Postgres, пропущено")
+        return
+    # До 15-й версии перенос строки между секциями при UPDATE срабатывал как
+    # DELETE и каскадно удалял бы назначения визита
+    if bind.dialect.server_version_info < (15,):
+        raise RuntimeError("Секционирование визитов требует Postgres 15 или новее")
+    if not is_partitioned(bind):
+        _rebuild_tables(partitioned=True)
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if is_partitioned(bind):
+        _rebuild_tables(partitioned=False)
+    if bind.dialect.name == "postgresql":
+        op.execute("ALTER TABLE visit_medicines DROP COLUMN IF EXISTS visit_date")
+    else:
+        op.execute("ALTER TABLE visit_medicines DROP COLUMN visit_date")
@@ -0,0 +1,64 @@
+"""patient name lookup without case
+
+Revision ID: d3f81b6c2e47
+Revises: a7e4c1d9f203
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d3f81b6c2e47"
+down_revision: Union[str, None] = "a7e4c1d9f203"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Подбор пациента сравнивает lower(фамилия) и lower(имя) с запросом, индекс
+# по исходным столбцам ему больше не подходит
+NEW_INDEX = (
+    "ix_patients_name_lower",
+    "patients (lower(last_name) text_pattern_ops, lower(first_name) text_pattern_ops)",
+)
+OLD_INDEX = (
+    "ix_patients_name",
+    "patients (last_name text_pattern_ops, first_name text_pattern_ops)",
+)
+
+
+def _swap(create, drop):
+    name, definition = create
+    if op.get_bind().dialect.name != "postgresql":
+        # SQLite (разработка): индекс по функции приложения unicode_lower
+        # создаёт ensure_search_indexes при старте, здесь её нет
+        op.execute(f"DROP INDEX IF EXISTS {drop[0]}")
+        return
+
+    # CONCURRENTLY не блокирует запись в таблицу, но не работает в транзакции
+    with op.get_context().autocommit_block():
+        # Прерванный CREATE INDEX CONCURRENTLY оставляет индекс INVALID
+        invalid = op.get_bind().exec_driver_sql(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            f"WHERE NOT i.indisvalid AND c.relname = '{name}'"
+        ).first()
+        if invalid:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {drop[0]}")
+
+
+def upgrade() -> None:
+    _swap(NEW_INDEX, OLD_INDEX)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        name, definition = OLD_INDEX
+        definition = definition.replace(" text_pattern_ops", "")
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+        return
+    _swap(OLD_INDEX, NEW_INDEX)
@@ -1,4 +1,17 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import (
+    Flask,
+    render_template,
+    request,
+    redirect,
+    url_for,
+    flash,
+    jsonify,
+    session,
+    make_response,
+    json,
+    stream_with_context,
+)
+from markupsafe import Markup
 from flask_login import (
     LoginManager,
     login_user,
@@ -7,7 +20,7 @@ from flask_login import (
     current_user,
 )
 
-from sqlalchemy import text
+from sqlalchemy import text, or_, and_, func, insert
 from models import (
     db,
     Admin,
@@ -16,11 +29,60 @@ from models import (
     Medicine,
     Visit,
     VisitMedicine,
+    Account,
+    VisitDailyStat,
+    DiagnosisPatientStat,
     User,
-    populate_db,
+    get_counters,
+    visit_list_version,
+    reconcile_counters,
+    ensure_counters,
+    rebuild_visit_stats,
+    ensure_visit_stats,
+    diagnosis_key,
+    ensure_search_indexes,
+    sync_accounts,
+    principals_version,
+)
+from auth import (
+    load_principal,
+    remember_principal,
+    forget_principal,
+    revoke_principal,
+    principal_key,
+    hash_password,
+    password_pool,
+    PasswordPoolBusy,
+)
+from pagination import encode_cursor, decode_cursor, clamp_limit
+from visit_details import (
+    get_visit_detail,
+    get_visit_details,
+    can_view,
+    render_visit_detail,
+    visit_details_version,
+)
+from refdata import get_medicines, get_medicine_ids, get_doctors, refdata_version
+from search import (
+    search_patients,
+    lookup_patients,
+    get_suggestions,
+    PATIENT_LOOKUP_LIMIT,
+    SEARCH_PAGE_SIZE,
+    SEARCH_MAX_PAGE_SIZE,
 )
+from importer import import_stream, detect_format, IMPORT_SPECS, IMPORT_FORMATS
+from exporter import iter_export_bytes, parse_export_filters, EXPORT_FORMATS
+from datagen import populate_db, generate_dataset, scale_sizes, SCALES
+from partitions import ensure_visit_partitions, VISIT_PARTITION_MONTHS_AHEAD
+from replica import init_replica, read_only, REPLICA_BIND
+from dbpool import engine_options, instrument_engine, pool_stats
+from metrics import init_metrics, metrics_allowed, render_metrics
+from querybudget import init_query_budget, query_budget
 from datetime import datetime
 from dotenv import load_dotenv
+import click
+import io
 import os
 import time
 import traceback
@@ -41,22 +103,38 @@ if not database_url:
 
 app.config["SQLALCHEMY_DATABASE_URI"] = database_url
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+# Размер пула, pre-ping и таймауты — из окружения (см. dbpool.py)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_url)
+
+# Реплика только для чтения (необязательно): её читают GET-запросы
+database_read_url = os.getenv("DATABASE_READ_URL")
+if database_read_url:
+    app.config["SQLALCHEMY_BINDS"] = {
+        REPLICA_BIND: {"url": database_read_url, **engine_options(database_read_url)}
+    }
 
 # Инициализируем базу данных
 db.init_app(app)
+init_replica(app, db)
+init_metrics(app)
+init_query_budget(app)
+with app.app_context():
+    for _bind_key, _engine in db.engines.items():
+        instrument_engine(_bind_key or "primary", _engine)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
 
+# Размер страницы ленты визитов на панели администратора
+VISIT_FEED_PAGE_SIZE = 50
+VISIT_FEED_MAX_PAGE_SIZE = 200
+
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get(user_id)
+    # Принципал берётся из подписанной сессии, в БД идём только после истечения TTL
+    return load_principal(user_id, User, User.get, principals_version)
 
 
 def wait_for_db():
@@ -91,10 +169,15 @@ def initialize_database():
                     f"🔄 Creating database tables (attempt {attempt + 1}/{max_retries})..."
                 )
                 db.create_all()
+                ensure_search_indexes()
+                ensure_visit_partitions()
                 print("✅ Database tables created successfully!")
 
                 print("🔄 Populating database with initial data...")
                 populate_db()
+                sync_accounts()
+                ensure_counters()
+                ensure_visit_stats()
                 print("✅ Database populated successfully!")
                 return True
 
@@ -110,12 +193,147 @@ def initialize_database():
                 return False
 
 
+# Версия шаблонов и кода: меняется при деплое, чтобы сбросить старые ETag
+APP_VERSION = os.getenv("APP_VERSION", "1")
+
+
+def conditional_response(version, build, last_modified=None):
+    """Ответ с ETag/Last-Modified и 304 Not Modified при совпадении версии.
+
+    version — кортеж значений, однозначно описывающих содержимое ответа
+    (счётчики изменений, max(created_at)); build() строит полный ответ и
+    вызывается только если клиенту нужно новое содержимое.
+    """
+    etag = hashlib.sha1(
+        repr((APP_VERSION, current_user.get_id(), version)).encode("utf-8")
+    ).hexdigest()
+    if last_modified is not None:
+        last_modified = last_modified.replace(microsecond=0)
+
+    # Непоказанные flash-сообщения есть только в полном ответе
+    not_modified = not session.get("_flashes") and (
+        request.if_none_match.contains(etag)
+        if request.if_none_match
+        else last_modified is not None
+        and request.if_modified_since is not None
+        and request.if_modified_since.replace(tzinfo=None) >= last_modified
+    )
+
+    response = app.response_class(status=304) if not_modified else make_response(build())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Кешировать только в браузере и всегда перепроверять
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+    return response
+
+
+@app.cli.command("reconcile-stats")
+def reconcile_stats_command():
+    """Пересчитывает счётчики и агрегаты визитов с нуля."""
+    totals = reconcile_counters()
+    for name, value in totals.items():
+        print(f"✅ {name}: {value}")
+
+    for table, rows in rebuild_visit_stats().items():
+        print(f"✅ {table}: {rows} rows")
+
+
+@app.cli.command("ensure-partitions")
+@click.option("--months-ahead", default=VISIT_PARTITION_MONTHS_AHEAD, show_default=True)
+def ensure_partitions_command(months_ahead):
+    """Создаёт месячные секции визитов наперёд (запускать из cron)."""
+    created = ensure_visit_partitions(months_ahead)
+    for name in created:
+        print(f"✅ {name}")
+    if not created:
+        print("✅ Новых секций не требуется")
+
+
+@app.cli.command("import-data")
+@click.argument("entity", type=click.Choice(sorted(IMPORT_SPECS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(IMPORT_FORMATS), default=None)
+def import_data_command(entity, path, fmt):
+    """Массовая загрузка пациентов, врачей или лекарств из CSV/NDJSON."""
+    fmt = fmt or detect_format(path)
+    with open(path, encoding="utf-8-sig", newline="") as stream:
+        report = import_stream(entity, stream, fmt, offline=True)
+
+    print(f"✅ {entity}: добавлено {report['inserted']} из {report['processed']}")
+    if report["conflicts"] or report["failed"]:
+        print(f"⚠️ Конфликтов: {report['conflicts']}, ошибок: {report['failed']}")
+        for error in report["errors"]:
+            print(f"   строка {error['row']}: {error['error']}")
+    if report.get("fatal"):
+        print(f"❌ {report['fatal']}")
+
+
+@app.cli.command("export-visits")
+# Только в файл: при импорте app в stdout печатается ход инициализации БД
+@click.argument("path", type=click.Path(dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(EXPORT_FORMATS), default="csv")
+@click.option("--gzip", "compress", is_flag=True, help="Сжимать на лету")
+@click.option("--date-from", default=None, help="ГГГГ-ММ-ДД")
+@click.option("--date-to", default=None, help="ГГГГ-ММ-ДД, включительно")
+@click.option("--doctor-id", default=None, type=int)
+def export_visits_command(path, fmt, compress, date_from, date_to, doctor_id):
+    """Выгрузка визитов с пациентами, врачами и лекарствами в CSV/NDJSON."""
+    filters = parse_export_filters(date_from, date_to, doctor_id)
+    written = 0
+    with open(path, "wb") as f:
+        for chunk in iter_export_bytes(fmt, compress, **filters):
+            f.write(chunk)
+            written += len(chunk)
+    print(f"✅ Выгрузка записана в {path} ({written} байт)")
+
+
+@app.cli.command("generate-data")
+@click.option("--scale", type=click.Choice(list(SCALES)), default="small", show_default=True)
+@click.option("--doctors", type=int, default=None, help="Вместо размера из --scale")
+@click.option("--patients", type=int, default=None)
+@click.option("--visits", type=int, default=None)
+@click.option("--medicines", type=int, default=None)
+@click.option("--seed", default=42, show_default=True)
+@click.option("--prefix", default="gen", show_default=True, help="Префикс логинов")
+@click.option("--end", default=None, help="ГГГГ-ММ-ДД, граница периода визитов")
+@click.option("--days", default=730, show_default=True, help="Длина периода визитов")
+def generate_data_command(scale, doctors, patients, visits, medicines, seed, prefix, end, days):
+    """Синтетический набор данных; одинаковые параметры дают одинаковые строки."""
+    sizes = scale_sizes(
+        scale, doctors=doctors, patients=patients, visits=visits, medicines=medicines
+    )
+    print(f"🔄 Генерируем {sizes}")
+    started = time.perf_counter()
+    written = generate_dataset(
+        seed=seed,
+        prefix=prefix,
+        days=days,
+        end=datetime.strptime(end, "%Y-%m-%d") if end else None,
+        **sizes,
+    )
+    for table, rows in written.items():
+        print(f"✅ {table}: {rows}")
+    print(f"✅ Готово за {time.perf_counter() - started:.1f} с")
+
+
 @app.route("/health")
 def health_check():
     return jsonify({"status": "ok"}), 200
 
 
 # izmenenia
+@app.route("/metrics")
+def metrics():
+    # Порт web опубликован наружу мимо nginx, поэтому доступ проверяется здесь
+    if not metrics_allowed():
+        return jsonify({"error": "Доступ запрещен"}), 403
+    body, content_type = render_metrics()
+    return app.response_class(body, content_type=content_type)
+
+
 @app.route("/health/db")
 def health_db():
     try:
@@ -156,9 +374,15 @@ def login():
         login_name = request.form["login"]
         password = request.form["password"]
 
-        user = User.authenticate(login_name, password)
+        try:
+            user = User.authenticate(login_name, password)
+        except PasswordPoolBusy:
+            flash("Сервер перегружен, повторите попытку через несколько секунд", "error")
+            return render_template("login.html"), 503
+
         if user:
             login_user(user)
+            remember_principal(user, version=principals_version())
             flash("Вход выполнен успешно!", "success")
             return redirect(url_for("index"))
         else:
@@ -171,6 +395,7 @@ def login():
 @login_required
 def logout():
     logout_user()
+    forget_principal()
     flash("Вы вышли из системы", "info")
     return redirect(url_for("login"))
 
@@ -184,36 +409,23 @@ def admin_dashboard():
         return redirect(url_for("index"))
 
     try:
-        # Исправленный запрос с явным выбором полей
-        visits = (
-            db.session.query(
-                Visit.id,
-                Visit.date,
-                Visit.location,
-                Visit.diagnosis,
-                Patient.first_name.label("patient_first_name"),
-                Patient.last_name.label("patient_last_name"),
-                Doctor.first_name.label("doctor_first_name"),
-                Doctor.last_name.label("doctor_last_name"),
-                Doctor.middle_name.label("doctor_middle_name"),
+        # Счётчики и версии данных — одной строкой запроса; они же дают ETag
+        counters = get_counters(with_versions=True)
+
+        def render():
+            # Первая страница ленты визитов, остальные подгружаются через /admin/visits/feed
+            visits, next_cursor = get_visit_feed_page(limit=VISIT_FEED_PAGE_SIZE)
+            return render_template(
+                "admin/dashboard.html",
+                visits=visits,
+                next_cursor=next_cursor,
+                total_visits=counters["visits"],
+                total_patients=counters["patients"],
+                total_doctors=counters["doctors"],
             )
-            .join(Patient, Visit.patient_id == Patient.id)
-            .join(Doctor, Visit.doctor_id == Doctor.id)
-            .order_by(Visit.date.desc())
-            .all()
-        )
 
-        # Статистика
-        total_visits = Visit.query.count()
-        total_patients = Patient.query.count()
-        total_doctors = Doctor.query.count()
-
-        return render_template(
-            "admin/dashboard.html",
-            visits=visits,
-            total_visits=total_visits,
-            total_patients=total_patients,
-            total_doctors=total_doctors,
+        return conditional_response(
+            ("admin_dashboard", *sorted(counters.items())), render
         )
 
     except Exception as e:
@@ -221,70 +433,312 @@ def admin_dashboard():
         return render_template("admin/dashboard.html", visits=[])
 
 
-@app.route("/admin/visits/<int:visit_id>")
+def get_visit_feed_page(cursor=None, limit=VISIT_FEED_PAGE_SIZE):
+    """Страница ленты визитов для админа (keyset по Visit.date, Visit.id).
+
+    Возвращает (visits, next_cursor); next_cursor равен None на последней странице.
+    """
+    query = (
+        db.session.query(
+            Visit.id,
+            Visit.date,
+            Visit.location,
+            Visit.diagnosis,
+            Patient.first_name.label("patient_first_name"),
+            Patient.last_name.label("patient_last_name"),
+            Doctor.first_name.label("doctor_first_name"),
+            Doctor.last_name.label("doctor_last_name"),
+            Doctor.middle_name.label("doctor_middle_name"),
+        )
+        .join(Patient, Visit.patient_id == Patient.id)
+        .join(Doctor, Visit.doctor_id == Doctor.id)
+    )
+
+    if cursor:
+        date_str, id_str = decode_cursor(cursor, 2)
+        after_date = datetime.fromisoformat(date_str)
+        after_id = int(id_str)
+        query = query.filter(
+            # Явная верхняя граница по дате: отсекает секции новее курсора
+            Visit.date <= after_date,
+            or_(
+                Visit.date < after_date,
+                and_(Visit.date == after_date, Visit.id < after_id),
+            )
+        )
+
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+    rows = query.order_by(Visit.date.desc(), Visit.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.date.isoformat(), last.id)
+
+    return rows, next_cursor
+
+
+@app.route("/admin/visits/feed")
 @login_required
-def admin_visit_detail(visit_id):
+def admin_visit_feed():
     if current_user.role != "admin":
         return jsonify({"error": "Доступ запрещен"}), 403
 
     try:
-        # Получаем детали визита
-        visit_data = (
-            db.session.query(Visit, Patient, Doctor)
-            .join(Patient, Visit.patient_id == Patient.id)
-            .join(Doctor, Visit.doctor_id == Doctor.id)
-            .filter(Visit.id == visit_id)
-            .first()
+        limit = clamp_limit(
+            request.args.get("limit", type=int),
+            VISIT_FEED_PAGE_SIZE,
+            VISIT_FEED_MAX_PAGE_SIZE,
         )
+        visits, next_cursor = get_visit_feed_page(request.args.get("cursor"), limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(
+        {
+            "visits": [
+                {
+                    "id": visit.id,
+                    "date": visit.date.isoformat(),
+                    "date_display": visit.date.strftime("%d.%m.%Y %H:%M"),
+                    "location": visit.location,
+                    "diagnosis": visit.diagnosis,
+                    "patient_first_name": visit.patient_first_name,
+                    "patient_last_name": visit.patient_last_name,
+                    "doctor_first_name": visit.doctor_first_name,
+                    "doctor_middle_name": visit.doctor_middle_name,
+                    "doctor_last_name": visit.doctor_last_name,
+                }
+                for visit in visits
+            ],
+            "next_cursor": next_cursor,
+        }
+    )
 
-        if not visit_data:
+
+def visit_detail_response(visit_id):
+    """Карточка визита из общей read-модели с фильтрацией полей по роли."""
+    try:
+        detail = get_visit_detail(visit_id)
+        if detail is None or not can_view(detail, current_user):
             return jsonify({"error": "Визит не найден"}), 404
 
-        visit, patient, doctor = visit_data
+        return conditional_response(
+            ("visit_detail", visit_id, visit_details_version()),
+            lambda: app.response_class(
+                render_visit_detail(detail, current_user.role),
+                mimetype="application/json",
+            ),
+        )
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Сколько визитов можно запросить одним batch-запросом
+VISIT_BATCH_MAX_SIZE = 100
+
+
+def parse_visit_ids():
+    """id визитов из ?ids=1,2,3 или из JSON {"ids": [...]}, без повторов."""
+    if request.method == "POST":
+        raw_ids = (request.get_json(silent=True) or {}).get("ids") or []
+    else:
+        raw_ids = [part for part in request.args.get("ids", "").split(",") if part]
+
+    visit_ids = list(dict.fromkeys(int(visit_id) for visit_id in raw_ids))
+    if not visit_ids:
+        raise ValueError("Не указаны id визитов")
+    if len(visit_ids) > VISIT_BATCH_MAX_SIZE:
+        raise ValueError(f"Не больше {VISIT_BATCH_MAX_SIZE} визитов за запрос")
+    return visit_ids
+
+
+def visit_batch_response():
+    """Несколько карточек визитов за один HTTP-запрос и фиксированное число SQL.
+
+    Недоступные пользователю визиты не отличаются от несуществующих и
+    попадают в "missing".
+    """
+    try:
+        visit_ids = parse_visit_ids()
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        details = get_visit_details(visit_ids)
+        bodies, missing = [], []
+        for visit_id in visit_ids:
+            detail = details.get(visit_id)
+            if detail is None or not can_view(detail, current_user):
+                missing.append(visit_id)
+            else:
+                bodies.append(render_visit_detail(detail, current_user.role))
 
-        # Получаем назначенные лекарства
-        medicines = (
-            db.session.query(VisitMedicine, Medicine)
-            .join(Medicine, VisitMedicine.medicine_id == Medicine.id)
-            .filter(VisitMedicine.visit_id == visit_id)
-            .all()
+        # Карточки уже сериализованы и закешированы — склеиваем готовый JSON
+        body = '{"missing":%s,"visits":[%s]}' % (
+            json.dumps(missing),
+            ",".join(bodies),
         )
+        return app.response_class(body, mimetype="application/json")
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/admin/visits/batch", methods=["GET", "POST"])
+@login_required
+@read_only
+@query_budget(4)
+def admin_visit_batch():
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    return visit_batch_response()
+
+
+@app.route("/admin/visits/<int:visit_id>")
+@login_required
+@query_budget(4)
+def admin_visit_detail(visit_id):
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    return visit_detail_response(visit_id)
+
+
+@app.route("/admin/metrics/auth")
+@login_required
+def admin_auth_metrics():
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    # Загрузка пула проверки паролей: очередь, отказы, время ожидания
+    return jsonify(password_pool.stats())
+
+
+# Статистика по агрегатам visit_daily_stats / diagnosis_patient_stats
+@app.route("/admin/stats/visits-by-date", methods=["POST"])
+@login_required
+@read_only
+def admin_stats_visits_by_date():
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        day = datetime.strptime(data.get("date", ""), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify({"error": "Неверный формат даты"}), 400
+
+    visit_count = (
+        db.session.query(func.coalesce(func.sum(VisitDailyStat.visit_count), 0))
+        .filter(VisitDailyStat.day == day)
+        .scalar()
+    )
+    return jsonify({"date": day.isoformat(), "visit_count": int(visit_count)})
+
+
+@app.route("/admin/stats/patients-by-diagnosis", methods=["POST"])
+@login_required
+@read_only
+def admin_stats_patients_by_diagnosis():
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    data = request.get_json(silent=True) or {}
+    key = diagnosis_key(data.get("diagnosis"))
+    if not key:
+        return jsonify({"error": "Введите диагноз"}), 400
+
+    patient_count = DiagnosisPatientStat.query.filter(
+        DiagnosisPatientStat.diagnosis_key == key,
+        DiagnosisPatientStat.visit_count > 0,
+    ).count()
+    return jsonify({"diagnosis": data["diagnosis"], "patient_count": patient_count})
+
+
+@app.route("/admin/stats/medicine-side-effects", methods=["POST"])
+@login_required
+@read_only
+def admin_stats_medicine_side_effects():
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    data = request.get_json(silent=True) or {}
+    name = (data.get("medicine_name") or "").strip()
+    if not name:
+        return jsonify({"error": "Введите название лекарства"}), 400
+
+    # Точное совпадение идёт по уникальному индексу, без учёта регистра — запасной путь
+    medicine = Medicine.query.filter_by(name=name).first()
+    if not medicine:
+        medicine = Medicine.query.filter(
+            func.lower(Medicine.name) == name.lower()
+        ).first()
+    if not medicine:
+        return jsonify({"error": "Лекарство не найдено"}), 404
+
+    return jsonify(
+        {"medicine_name": medicine.name, "side_effects": medicine.side_effects}
+    )
 
-        result = {
-            "id": visit.id,
-            "patient_id": visit.patient_id,
-            "doctor_id": visit.doctor_id,
-            "date": visit.date.isoformat() if visit.date else None,
-            "location": visit.location,
-            "symptoms": visit.symptoms,
-            "diagnosis": visit.diagnosis,
-            "prescriptions": visit.prescriptions,
-            "patient_first_name": patient.first_name,
-            "patient_last_name": patient.last_name,
-            "date_of_birth": (
-                patient.date_of_birth.isoformat() if patient.date_of_birth else None
+
+@app.route("/admin/search-patients", methods=["POST"])
+@login_required
+@read_only
+def admin_search_patients():
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    data = request.get_json(silent=True) or {}
+    limit = data.get("limit")
+    try:
+        patients, next_cursor = search_patients(
+            data.get("search_type"),
+            data.get("search_query"),
+            cursor=data.get("cursor"),
+            limit=clamp_limit(
+                int(limit) if limit is not None else None,
+                SEARCH_PAGE_SIZE,
+                SEARCH_MAX_PAGE_SIZE,
             ),
-            "gender": patient.gender,
-            "address": patient.address,
-            "doctor_first_name": doctor.first_name,
-            "doctor_last_name": doctor.last_name,
-            "position": doctor.position,
-            "medicines": [
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(
+        {
+            "patients": [
                 {
-                    "name": medicine.name,
-                    "description": medicine.description,
-                    "side_effects": medicine.side_effects,
-                    "usage_method": medicine.usage_method,
-                    "doctor_instructions": visit_medicine.doctor_instructions,
+                    "id": patient.id,
+                    "first_name": patient.first_name,
+                    "last_name": patient.last_name,
+                    "date_of_birth": (
+                        patient.date_of_birth.isoformat()
+                        if patient.date_of_birth
+                        else None
+                    ),
+                    "gender": patient.gender,
+                    "address": patient.address,
                 }
-                for visit_medicine, medicine in medicines
+                for patient in patients
             ],
+            "next_cursor": next_cursor,
         }
+    )
 
-        return jsonify(result)
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+@app.route("/admin/search-suggestions", methods=["POST"])
+@login_required
+def admin_search_suggestions():
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    data = request.get_json(silent=True) or {}
+    suggestions = get_suggestions(data.get("search_type"), data.get("search_query"))
+    return jsonify([{"suggestion": suggestion} for suggestion in suggestions])
 
 
 @app.route("/admin/add-doctor", methods=["GET", "POST"])
@@ -303,9 +757,9 @@ def admin_add_doctor():
             login_name = request.form["login"]
             password = request.form["password"]
 
-            # Проверяем, существует ли уже такой логин
-            existing_doctor = Doctor.query.filter_by(login=login_name).first()
-            if existing_doctor:
+            # Логин должен быть уникален среди всех ролей
+            existing_account = Account.query.filter_by(login=login_name).first()
+            if existing_account:
                 flash("Логин уже существует", "error")
                 return redirect(url_for("admin_add_doctor"))
 
@@ -316,7 +770,7 @@ def admin_add_doctor():
                 last_name=last_name,
                 position=position,
                 login=login_name,
-                password_hash=hashlib.sha256(password.encode()).hexdigest(),
+                password_hash=password_pool.run(hash_password, password),
             )
 
             db.session.add(new_doctor)
@@ -349,9 +803,9 @@ def admin_add_patient():
             login_name = request.form["login"]
             password = request.form["password"]
 
-            # Проверяем, существует ли уже такой логин
-            existing_patient = Patient.query.filter_by(login=login_name).first()
-            if existing_patient:
+            # Логин должен быть уникален среди всех ролей
+            existing_account = Account.query.filter_by(login=login_name).first()
+            if existing_account:
                 flash("Логин уже существует", "error")
                 return redirect(url_for("admin_add_patient"))
 
@@ -363,7 +817,7 @@ def admin_add_patient():
                 date_of_birth=date_of_birth,
                 address=address,
                 login=login_name,
-                password_hash=hashlib.sha256(password.encode()).hexdigest(),
+                password_hash=password_pool.run(hash_password, password),
             )
 
             db.session.add(new_patient)
@@ -379,6 +833,73 @@ def admin_add_patient():
     return render_template("admin/add_patient.html")
 
 
+@app.route("/admin/import/<entity>", methods=["POST"])
+@login_required
+@query_budget(None, n_plus_one=False)
+def admin_import(entity):
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+    if entity not in IMPORT_SPECS:
+        return jsonify({"error": "Неизвестный тип данных"}), 404
+
+    # Файл из формы (multipart) или тело запроса целиком; читается потоком
+    upload = request.files.get("file")
+    raw = upload.stream if upload else request.stream
+    fmt = request.args.get("format") or detect_format(
+        upload.filename if upload else None, request.content_type
+    )
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({"error": "Неизвестный формат"}), 400
+
+    stream = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    try:
+        report = import_stream(entity, stream, fmt)
+    finally:
+        stream.detach()
+    return jsonify(report)
+
+
+@app.route("/admin/metrics/db-pool")
+@login_required
+def admin_db_pool_metrics():
+    # Счётчики у каждого воркера gunicorn свои — в ответе pid воркера
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+    return jsonify({"pid": os.getpid(), "pools": pool_stats()})
+
+
+@app.route("/admin/export/visits")
+@login_required
+def admin_export_visits():
+    if current_user.role != "admin":
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "Неизвестный формат"}), 400
+    compress = request.args.get("compress") == "gzip"
+    try:
+        filters = parse_export_filters(
+            request.args.get("date_from"),
+            request.args.get("date_to"),
+            request.args.get("doctor_id"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filename = f"visits.{fmt}" + (".gz" if compress else "")
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    # Генератор читает курсор по мере отправки: весь результат в памяти не лежит
+    response = app.response_class(
+        stream_with_context(iter_export_bytes(fmt, compress, **filters)),
+        mimetype="application/gzip" if compress else mimetype,
+    )
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    # nginx не должен копить ответ целиком перед отправкой клиенту
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @app.route("/admin/add-medicine", methods=["GET", "POST"])
 @login_required
 def admin_add_medicine():
@@ -419,35 +940,103 @@ def admin_add_medicine():
 # Doctor routes
 @app.route("/doctor/dashboard")
 @login_required
+@query_budget(4)
 def doctor_dashboard():
     if current_user.role != "doctor":
         flash("Доступ запрещен", "error")
         return redirect(url_for("index"))
 
     try:
-        # Исправленный запрос с явным выбором полей
-        visits = (
-            db.session.query(
-                Visit.id,
-                Visit.date,
-                Visit.location,
-                Visit.diagnosis,
-                Patient.first_name.label("patient_first_name"),
-                Patient.last_name.label("patient_last_name"),
+        # Дешёвая проверка версии вместо полного запроса и рендера
+        version = visit_list_version(Visit.doctor_id == current_user.id)
+
+        def render():
+            # Исправленный запрос с явным выбором полей
+            visits = (
+                db.session.query(
+                    Visit.id,
+                    Visit.date,
+                    Visit.location,
+                    Visit.diagnosis,
+                    Patient.first_name.label("patient_first_name"),
+                    Patient.last_name.label("patient_last_name"),
+                )
+                .join(Patient, Visit.patient_id == Patient.id)
+                .filter(Visit.doctor_id == current_user.id)
+                .order_by(Visit.date.desc())
+                .all()
             )
-            .join(Patient, Visit.patient_id == Patient.id)
-            .filter(Visit.doctor_id == current_user.id)
-            .order_by(Visit.date.desc())
-            .all()
-        )
+            return render_template("doctor/dashboard.html", visits=visits)
 
-        return render_template("doctor/dashboard.html", visits=visits)
+        return conditional_response(
+            ("doctor_dashboard", *version), render, last_modified=version.last_created
+        )
 
     except Exception as e:
         flash(f"Ошибка: {str(e)}", "error")
         return render_template("doctor/dashboard.html", visits=[])
 
 
+def parse_prescribed_medicines(medicine_ids, instructions):
+    """[(medicine_id, инструкция)] из формы визита, id проверяются по справочнику."""
+    known_ids = get_medicine_ids()
+    prescribed = {}
+    for medicine_id, instruction in zip(medicine_ids, instructions):
+        if not medicine_id:
+            continue
+        medicine_id = int(medicine_id)
+        if medicine_id not in known_ids:
+            raise ValueError(f"Лекарство с id {medicine_id} не найдено")
+        if medicine_id in prescribed:
+            raise ValueError("Лекарство назначено в визите дважды")
+        prescribed[medicine_id] = instruction
+    return list(prescribed.items())
+
+
+def create_visit(medicines=(), **fields):
+    """Визит и его назначения в одной транзакции.
+
+    Визит вставляется через ORM (события маппера ведут счётчики и агрегаты),
+    назначения — одним пакетным INSERT вместо объекта и запроса на каждое.
+    """
+    visit = Visit(**fields)
+    db.session.add(visit)
+    db.session.flush()  # INSERT ... RETURNING id
+
+    if medicines:
+        db.session.execute(
+            insert(VisitMedicine),
+            [
+                {
+                    "visit_id": visit.id,
+                    "visit_date": visit.date,
+                    "medicine_id": medicine_id,
+                    "doctor_instructions": instruction,
+                }
+                for medicine_id, instruction in medicines
+            ],
+        )
+
+    db.session.commit()
+    return visit
+
+
+# (версия справочника, готовый HTML <option>) — фрагмент рендерится один раз
+# на поколение справочника лекарств в каждом воркере
+_medicine_options = {"entry": (None, None)}
+
+
+def medicine_options_html():
+    version = refdata_version()
+    cached_version, html = _medicine_options["entry"]
+    if html is None or version is None or cached_version != version:
+        html = Markup(
+            render_template("doctor/_medicine_options.html", medicines=get_medicines())
+        )
+        _medicine_options["entry"] = (version, html)
+    return html
+
+
 @app.route("/doctor/add-visit", methods=["GET", "POST"])
 @login_required
 def doctor_add_visit():
@@ -457,41 +1046,21 @@ def doctor_add_visit():
 
     if request.method == "POST":
         try:
-            patient_id = request.form["patient_id"]
-            date = datetime.strptime(request.form["date"], "%Y-%m-%dT%H:%M")
-            location = request.form["location"]
-            symptoms = request.form["symptoms"]
-            diagnosis = request.form["diagnosis"]
-            prescriptions = request.form["prescriptions"]
-            medicines = request.form.getlist("medicines[]")
-            instructions = request.form.getlist("instructions[]")
-
-            # Создаем визит
-            new_visit = Visit(
-                patient_id=patient_id,
+            medicines = parse_prescribed_medicines(
+                request.form.getlist("medicines[]"),
+                request.form.getlist("instructions[]"),
+            )
+            create_visit(
                 doctor_id=current_user.id,
-                date=date,
-                location=location,
-                symptoms=symptoms,
-                diagnosis=diagnosis,
-                prescriptions=prescriptions,
+                patient_id=int(request.form["patient_id"]),
+                date=datetime.strptime(request.form["date"], "%Y-%m-%dT%H:%M"),
+                location=request.form["location"],
+                symptoms=request.form["symptoms"],
+                diagnosis=request.form["diagnosis"],
+                prescriptions=request.form["prescriptions"],
+                medicines=medicines,
             )
 
-            db.session.add(new_visit)
-            db.session.flush()  # Получаем ID нового визита
-
-            # Добавляем лекарства
-            for medicine_id, instruction in zip(medicines, instructions):
-                if medicine_id:
-                    visit_medicine = VisitMedicine(
-                        visit_id=new_visit.id,
-                        medicine_id=medicine_id,
-                        doctor_instructions=instruction,
-                    )
-                    db.session.add(visit_medicine)
-
-            db.session.commit()
-
             flash("Визит успешно добавлен", "success")
             return redirect(url_for("doctor_add_visit"))
 
@@ -499,163 +1068,120 @@ def doctor_add_visit():
             db.session.rollback()
             flash(f"Ошибка: {str(e)}", "error")
 
-    # Получаем пациентов и лекарства для формы
-    patients = Patient.query.order_by(Patient.last_name, Patient.first_name).all()
-    medicines = Medicine.query.order_by(Medicine.name).all()
-
+    # Пациент выбирается через /doctor/patients/lookup, список целиком не грузим
     return render_template(
-        "doctor/add_visit.html", patients=patients, medicines=medicines
+        "doctor/add_visit.html", medicine_options=medicine_options_html()
     )
 
 
-# Doctor visit details
-@app.route("/doctor/visits/<int:visit_id>")
+@app.route("/doctor/patients/lookup")
 @login_required
-def doctor_visit_detail(visit_id):
+def doctor_patient_lookup():
     if current_user.role != "doctor":
         return jsonify({"error": "Доступ запрещен"}), 403
 
-    try:
-        visit_data = (
-            db.session.query(Visit, Patient, Doctor)
-            .join(Patient, Visit.patient_id == Patient.id)
-            .join(Doctor, Visit.doctor_id == Doctor.id)
-            .filter(Visit.id == visit_id, Visit.doctor_id == current_user.id)
-            .first()
-        )
+    limit = clamp_limit(
+        request.args.get("limit", type=int),
+        PATIENT_LOOKUP_LIMIT,
+        PATIENT_LOOKUP_LIMIT,
+    )
+    patients = lookup_patients(request.args.get("q", ""), limit)
+    return jsonify(
+        [
+            {
+                "id": patient.id,
+                "last_name": patient.last_name,
+                "first_name": patient.first_name,
+                "date_of_birth": (
+                    patient.date_of_birth.isoformat()
+                    if patient.date_of_birth
+                    else None
+                ),
+            }
+            for patient in patients
+        ]
+    )
 
-        if not visit_data:
-            return jsonify({"error": "Визит не найден"}), 404
 
-        visit, patient, doctor = visit_data
+# Doctor visit details
+@app.route("/doctor/visits/<int:visit_id>")
+@login_required
+@query_budget(4)
+def doctor_visit_detail(visit_id):
+    if current_user.role != "doctor":
+        return jsonify({"error": "Доступ запрещен"}), 403
 
-        medicines = (
-            db.session.query(VisitMedicine, Medicine)
-            .join(Medicine, VisitMedicine.medicine_id == Medicine.id)
-            .filter(VisitMedicine.visit_id == visit_id)
-            .all()
-        )
+    return visit_detail_response(visit_id)
 
-        result = {
-            "id": visit.id,
-            "date": visit.date.isoformat() if visit.date else None,
-            "location": visit.location,
-            "symptoms": visit.symptoms,
-            "diagnosis": visit.diagnosis,
-            "prescriptions": visit.prescriptions,
-            "patient_first_name": patient.first_name,
-            "patient_last_name": patient.last_name,
-            "date_of_birth": (
-                patient.date_of_birth.isoformat() if patient.date_of_birth else None
-            ),
-            "gender": patient.gender,
-            "address": patient.address,
-            "doctor_first_name": doctor.first_name,
-            "doctor_last_name": doctor.last_name,
-            "position": doctor.position,
-            "medicines": [
-                {
-                    "name": medicine.name,
-                    "description": medicine.description,
-                    "side_effects": medicine.side_effects,
-                    "usage_method": medicine.usage_method,
-                    "doctor_instructions": visit_medicine.doctor_instructions,
-                }
-                for visit_medicine, medicine in medicines
-            ],
-        }
 
-        return jsonify(result)
+@app.route("/doctor/visits/batch", methods=["GET", "POST"])
+@login_required
+@read_only
+@query_budget(4)
+def doctor_visit_batch():
+    if current_user.role != "doctor":
+        return jsonify({"error": "Доступ запрещен"}), 403
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return visit_batch_response()
 
 
 # Patient visit details
 @app.route("/patient/visits/<int:visit_id>")
 @login_required
+@query_budget(4)
 def patient_visit_detail(visit_id):
     if current_user.role != "patient":
         return jsonify({"error": "Доступ запрещен"}), 403
 
-    try:
-        visit_data = (
-            db.session.query(Visit, Patient, Doctor)
-            .join(Patient, Visit.patient_id == Patient.id)
-            .join(Doctor, Visit.doctor_id == Doctor.id)
-            .filter(Visit.id == visit_id, Visit.patient_id == current_user.id)
-            .first()
-        )
+    return visit_detail_response(visit_id)
 
-        if not visit_data:
-            return jsonify({"error": "Визит не найден"}), 404
-
-        visit, patient, doctor = visit_data
-
-        medicines = (
-            db.session.query(VisitMedicine, Medicine)
-            .join(Medicine, VisitMedicine.medicine_id == Medicine.id)
-            .filter(VisitMedicine.visit_id == visit_id)
-            .all()
-        )
-
-        result = {
-            "id": visit.id,
-            "date": visit.date.isoformat() if visit.date else None,
-            "location": visit.location,
-            "symptoms": visit.symptoms,
-            "diagnosis": visit.diagnosis,
-            "prescriptions": visit.prescriptions,
-            "patient_first_name": patient.first_name,
-            "patient_last_name": patient.last_name,
-            "doctor_first_name": doctor.first_name,
-            "doctor_last_name": doctor.last_name,
-            "position": doctor.position,
-            "medicines": [
-                {
-                    "name": medicine.name,
-                    "description": medicine.description,
-                    "side_effects": medicine.side_effects,
-                    "usage_method": medicine.usage_method,
-                    "doctor_instructions": visit_medicine.doctor_instructions,
-                }
-                for visit_medicine, medicine in medicines
-            ],
-        }
 
-        return jsonify(result)
+@app.route("/patient/visits/batch", methods=["GET", "POST"])
+@login_required
+@read_only
+@query_budget(4)
+def patient_visit_batch():
+    if current_user.role != "patient":
+        return jsonify({"error": "Доступ запрещен"}), 403
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return visit_batch_response()
 
 
 # Patient routes
 @app.route("/patient/dashboard")
 @login_required
+@query_budget(4)
 def patient_dashboard():
     if current_user.role != "patient":
         flash("Доступ запрещен", "error")
         return redirect(url_for("index"))
 
     try:
-        # Исправленный запрос с явным выбором полей
-        visits = (
-            db.session.query(
-                Visit.id,
-                Visit.date,
-                Visit.location,
-                Visit.diagnosis,
-                Doctor.first_name.label("doctor_first_name"),
-                Doctor.last_name.label("doctor_last_name"),
-                Doctor.position,
+        # Дешёвая проверка версии вместо полного запроса и рендера
+        version = visit_list_version(Visit.patient_id == current_user.id)
+
+        def render():
+            # Исправленный запрос с явным выбором полей
+            visits = (
+                db.session.query(
+                    Visit.id,
+                    Visit.date,
+                    Visit.location,
+                    Visit.diagnosis,
+                    Doctor.first_name.label("doctor_first_name"),
+                    Doctor.last_name.label("doctor_last_name"),
+                    Doctor.position,
+                )
+                .join(Doctor, Visit.doctor_id == Doctor.id)
+                .filter(Visit.patient_id == current_user.id)
+                .order_by(Visit.date.desc())
+                .all()
             )
-            .join(Doctor, Visit.doctor_id == Doctor.id)
-            .filter(Visit.patient_id == current_user.id)
-            .order_by(Visit.date.desc())
-            .all()
-        )
+            return render_template("patient/dashboard.html", visits=visits)
 
-        return render_template("patient/dashboard.html", visits=visits)
+        return conditional_response(
+            ("patient_dashboard", *version), render, last_modified=version.last_created
+        )
 
     except Exception as e:
         flash(f"Ошибка: {str(e)}", "error")
@@ -670,8 +1196,8 @@ def admin_doctors_list():
         flash("Доступ запрещен", "error")
         return redirect(url_for("index"))
 
-    # Простой запрос без join
-    doctors = Doctor.query.order_by(Doctor.last_name, Doctor.first_name).all()
+    # Справочник из общего для воркеров снимка, без запроса к БД
+    doctors = get_doctors()
     return render_template("admin/doctors_list.html", doctors=doctors)
 
 
@@ -694,8 +1220,8 @@ def admin_medicines_list():
         flash("Доступ запрещен", "error")
         return redirect(url_for("index"))
 
-    # Простой запрос без join
-    medicines = Medicine.query.order_by(Medicine.name).all()
+    # Справочник из общего для воркеров снимка, без запроса к БД
+    medicines = get_medicines()
     return render_template("admin/medicines_list.html", medicines=medicines)
 
 
@@ -711,6 +1237,7 @@ def admin_delete_doctor(doctor_id):
         if doctor:
             db.session.delete(doctor)
             db.session.commit()
+            revoke_principal(principal_key("doctor", doctor_id))
             flash("Врач успешно удален", "success")
         else:
             flash("Врач не найден", "error")
@@ -733,6 +1260,7 @@ def admin_delete_patient(patient_id):
         if patient:
             db.session.delete(patient)
             db.session.commit()
+            revoke_principal(principal_key("patient", patient_id))
             flash("Пациент успешно удален", "success")
         else:
             flash("Пациент не найден", "error")
@@ -0,0 +1,292 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import session
+
+from cache import TTLCache
+
+# ---------- ПРИНЦИПАЛ В СЕССИИ ----------
+
+# Сколько секунд принципал из подписанной сессии считается актуальным без
+# обращения к БД: верхняя граница времени с последней проверки в БД.
+PRINCIPAL_TTL = int(os.getenv("PRINCIPAL_TTL", "60"))
+PRINCIPAL_SESSION_KEY = "principal"
+
+# Отзыв (удаление врача или пациента) увеличивает общую версию принципалов в
+# БД; воркер сверяет её не чаще раза в интервал, и принципалы, проверенные при
+# старой версии, перепроверяются через БД
+PRINCIPAL_VERSION_CHECK_INTERVAL = 1.0
+
+# Повторная проверка принципала после истечения TTL: сначала LRU процесса,
+# и только при промахе — запрос в БД. Значение — (user, когда проверен, версия)
+principal_cache = TTLCache(maxsize=10000, ttl=PRINCIPAL_TTL)
+
+# Принципалы, отозванные в этом воркере: действуют сразу, не дожидаясь
+# сверки версии
+revoked_principals = TTLCache(maxsize=10000, ttl=max(PRINCIPAL_TTL * 2, 600))
+
+_principal_version_lock = threading.Lock()
+_principal_version = {"value": None, "checked_at": 0.0}
+
+
+def principal_key(role, user_id):
+    """Ключ принципала в формате User.get_id(): "doctor_5"."""
+    return f"{role}_{user_id}"
+
+
+def _current_principal_version(load_version):
+    now = time.monotonic()
+    if now - _principal_version["checked_at"] >= PRINCIPAL_VERSION_CHECK_INTERVAL:
+        with _principal_version_lock:
+            if now - _principal_version["checked_at"] >= PRINCIPAL_VERSION_CHECK_INTERVAL:
+                _principal_version["value"] = load_version()
+                _principal_version["checked_at"] = now
+    return _principal_version["value"]
+
+
+def remember_principal(user, checked_at=None, version=None):
+    """Кладёт принципал (роль, id, логин) в подписанную сессию.
+
+    checked_at — когда принципал последний раз сверялся с БД (по умолчанию
+    сейчас); срок жизни в сессии отсчитывается от него, а не от запроса.
+    """
+    if checked_at is None:
+        checked_at = time.time()
+        version = _principal_version["value"] if version is None else version
+        principal_cache.set(user.get_id(), (user, checked_at, version))
+    session[PRINCIPAL_SESSION_KEY] = {
+        "key": user.get_id(),
+        "id": user.id,
+        "login": user.login,
+        "role": user.role,
+        "ts": checked_at,
+        "v": version,
+    }
+
+
+def forget_principal():
+    session.pop(PRINCIPAL_SESSION_KEY, None)
+
+
+def revoke_principal(key):
+    """Отзывает принципал: следующий запрос с ним получит анонимного пользователя.
+
+    Остальные воркеры узнают об отзыве по версии принципалов в БД, которую
+    увеличивает само удаление записи (см. models.py).
+    """
+    principal_cache.pop(key)
+    revoked_principals.set(key, True)
+    _principal_version["checked_at"] = 0.0
+
+
+def load_principal(key, user_class, loader, load_version):
+    """Восстанавливает пользователя для Flask-Login без запроса к БД, если возможно.
+
+    loader(key) — медленный путь через БД (User.get); load_version() —
+    текущая версия принципалов в БД.
+    """
+    if key in revoked_principals:
+        forget_principal()
+        return None
+
+    version = _current_principal_version(load_version)
+    principal = session.get(PRINCIPAL_SESSION_KEY)
+    if (
+        principal
+        and principal.get("key") == key
+        and principal.get("v") == version
+        and time.time() - principal.get("ts", 0) < PRINCIPAL_TTL
+    ):
+        return user_class(principal["id"], principal["login"], principal["role"])
+
+    cached = principal_cache.get(key)
+    if cached is not None and cached[2] == version:
+        user, checked_at, _ = cached
+        remember_principal(user, checked_at, version)
+        return user
+
+    user = loader(key)
+    if user is None:
+        principal_cache.pop(key)
+        forget_principal()
+        return None
+
+    remember_principal(user, version=version)
+    return user
+
+
+# ---------- ХЕШИРОВАНИЕ ПАРОЛЕЙ ----------
+
+# scrypt — memory-hard KDF из стандартной библиотеки.
+# Формат хеша: scrypt$<n>$<r>$<p>$<salt base64>$<hash base64>
+SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2**14)))
+SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+SCRYPT_SALT_BYTES = 16
+SCRYPT_KEY_BYTES = 32
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * n * r,
+        dklen=SCRYPT_KEY_BYTES,
+    )
+
+
+def hash_password(password):
+    """Хеш пароля с текущими параметрами scrypt и случайной солью."""
+    salt = os.urandom(SCRYPT_SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+
+
+def verify_password(password, stored_hash):
+    """Проверяет пароль. Возвращает (совпал ли, нужно ли перехешировать).
+
+    Старые хеши (sha256 без соли) и хеши с устаревшими параметрами scrypt
+    помечаются для обновления при следующем успешном входе.
+    """
+    if not stored_hash:
+        return False, False
+
+    if stored_hash.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, key = stored_hash.split("$")
+            n, r, p = int(n), int(r), int(p)
+            expected = base64.b64decode(key)
+            actual = _scrypt(password, base64.b64decode(salt), n, r, p)
+        except (ValueError, binascii.Error):
+            return False, False
+        ok = hmac.compare_digest(actual, expected)
+        return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+    legacy = hashlib.sha256(password.encode("utf-8")).hexdigest()
+    ok = hmac.compare_digest(legacy, stored_hash)
+    return ok, ok
+
+
+# Хеш для выравнивания времени ответа, когда логин не найден
+_DUMMY_HASH = None
+
+
+def dummy_password_hash():
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None:
+        _DUMMY_HASH = hash_password(os.urandom(16).hex())
+    return _DUMMY_HASH
+
+
+# ---------- ПУЛ ПРОВЕРКИ ПАРОЛЕЙ ----------
+
+
+class PasswordPoolBusy(Exception):
+    """Очередь на проверку паролей переполнена."""
+
+
+class PasswordPoolTimeout(PasswordPoolBusy):
+    """Проверка пароля не дождалась результата за timeout секунд.
+
+    Тоже перегрузка, а не неверный пароль: вход нужно повторить позже.
+    """
+
+
+class PasswordWorkerPool:
+    """Ограниченный пул потоков для scrypt.
+
+    Не больше max_workers вычислений KDF одновременно на процесс и не больше
+    max_queue ожидающих задач — остальные попытки входа сразу отклоняются,
+    а не занимают потоки gthread и память (128 * n * r байт на вычисление).
+    hashlib.scrypt отпускает GIL, поэтому остальные запросы воркера идут дальше.
+    """
+
+    def __init__(self, max_workers, max_queue, timeout):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "max_queue_depth": 0,
+            "wait_seconds_total": 0.0,
+            "run_seconds_total": 0.0,
+        }
+
+    def run(self, fn, *args):
+        """Выполняет fn(*args) в пуле и ждёт результат."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise PasswordPoolBusy("Слишком много одновременных попыток входа")
+
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+            self._stats["submitted"] += 1
+            queued = self._pending - self._running
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], queued)
+
+        def task():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                self._stats["wait_seconds_total"] += started_at - submitted_at
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self._stats["completed"] += 1
+                    self._stats["run_seconds_total"] += time.perf_counter() - started_at
+                self._slots.release()
+
+        future = self._executor.submit(task)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Задача доработает сама и освободит слот
+            with self._lock:
+                self._stats["timed_out"] += 1
+            raise PasswordPoolTimeout("Проверка пароля не уложилась в таймаут") from None
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queue_depth": self._pending - self._running,
+            }
+
+
+password_pool = PasswordWorkerPool(
+    max_workers=int(os.getenv("PASSWORD_WORKERS", "2")),
+    max_queue=int(os.getenv("PASSWORD_QUEUE", "16")),
+    timeout=float(os.getenv("PASSWORD_TIMEOUT", "10")),
+)
@@ -0,0 +1,380 @@
+"""Нагрузочный прогон HTTP: p50/p95/p99 и запросов в секунду по операциям.
+
+Набор данных заданного масштаба генерируется datagen.py (если его ещё нет в
+БД), затем N виртуальных врачей в параллельных потоках выполняют смесь
+операций: вход, кабинет, карточка визита, добавление визита.
+
+    python benchmarks/http_load.py --scale tiny --duration 20
+    python benchmarks/http_load.py --scale small --output results/1.4.json
+    python benchmarks/http_load.py --compare results/1.3.json results/1.4.json
+
+По умолчанию запросы идут в приложение в этом же процессе (WSGI, без сети).
+С --target http://127.0.0.1:5000 — в запущенный gunicorn; DATABASE_URL у
+прогона и у сервера должен быть один, иначе данные сгенерируются не туда.
+Без DATABASE_URL используется временная SQLite-база.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="http-load-"), "bench.db"
+    )
+
+from sqlalchemy import func, select  # noqa: E402
+
+from app import app  # noqa: E402
+from datagen import DATAGEN_PASSWORD, SCALES, generate_dataset, scale_sizes  # noqa: E402
+from models import db, Account, Medicine, Visit  # noqa: E402
+
+DEFAULT_MIX = "login=5,dashboard=35,visit_detail=50,add_visit=10"
+DATASET_PREFIX = "gen"
+
+# Доля ухудшения p95/p99 или падения rps, при которой --compare сигналит
+DEFAULT_THRESHOLD = 10.0
+
+
+# ---------- КЛИЕНТЫ ----------
+
+
+class InProcessClient:
+    """Запросы прямо в WSGI-приложение, cookies — у тестового клиента."""
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+
+class HttpClient:
+    """Запросы по сети в запущенный сервер (gunicorn)."""
+
+    def __init__(self, base_url):
+        import requests
+
+        self.session = requests.Session()
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, data=None):
+        response = self.session.request(
+            method, self.base_url + path, data=data, allow_redirects=False, timeout=60
+        )
+        return response.status_code
+
+
+# ---------- ОПЕРАЦИИ ----------
+
+
+class VirtualDoctor:
+    def __init__(self, client, login, visit_ids, patient_ids, medicine_ids, rng):
+        self.client = client
+        self.login_name = login
+        self.visit_ids = visit_ids
+        self.patient_ids = patient_ids
+        self.medicine_ids = medicine_ids
+        self.rng = rng
+
+    def login(self):
+        status = self.client.request(
+            "POST", "/login", {"login": self.login_name, "password": DATAGEN_PASSWORD}
+        )
+        return status == 302
+
+    def dashboard(self):
+        return self.client.request("GET", "/doctor/dashboard") == 200
+
+    def visit_detail(self):
+        if not self.visit_ids:
+            return self.dashboard()
+        visit_id = self.rng.choice(self.visit_ids)
+        return self.client.request("GET", f"/doctor/visits/{visit_id}") == 200
+
+    def add_visit(self):
+        medicines = self.rng.sample(self.medicine_ids, min(2, len(self.medicine_ids)))
+        data = {
+            "patient_id": str(self.rng.randrange(*self.patient_ids)),
+            "date": datetime.utcnow().strftime("%Y-%m-%dT%H:%M"),
+            "location": "Office 101",
+            "symptoms": "Load test",
+            "diagnosis": "Acute respiratory infection",
+            "prescriptions": "",
+            "medicines[]": [str(m) for m in medicines],
+            "instructions[]": ["Twice a day"] * len(medicines),
+        }
+        return self.client.request("POST", "/doctor/add-visit", data) == 302
+
+
+OPERATIONS = ("login", "dashboard", "visit_detail", "add_visit")
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"неизвестная операция: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ---------- ДАННЫЕ ----------
+
+
+def ensure_dataset(args):
+    """Генерирует набор, если в БД ещё нет сгенерированных врачей."""
+    with app.app_context():
+        existing = db.session.execute(
+            select(func.count()).select_from(Account).where(
+                Account.role == "doctor", Account.login.like(f"{DATASET_PREFIX}_doctor%")
+            )
+        ).scalar()
+        if existing and not args.reseed:
+            print(f"✅ Используем готовый набор: {existing} врачей")
+            return
+        sizes = scale_sizes(
+            args.scale, **{field: getattr(args, field) for field in SCALES[args.scale]}
+        )
+        print(f"🔄 Генерируем набор: {sizes}")
+        started = time.perf_counter()
+        written = generate_dataset(seed=args.seed, prefix=DATASET_PREFIX, **sizes)
+        print(f"✅ Записано {written} за {time.perf_counter() - started:.1f} с")
+
+
+def dataset_summary():
+    with app.app_context():
+        return {
+            name: db.session.execute(select(func.count()).select_from(table)).scalar()
+            for name, table in (
+                ("visits", Visit.__table__),
+                ("medicines", Medicine.__table__),
+                ("accounts", Account.__table__),
+            )
+        }
+
+
+def build_users(args, make_client):
+    rng = random.Random(args.seed)
+    with app.app_context():
+        doctors = db.session.execute(
+            select(Account.login, Account.user_id).where(
+                Account.role == "doctor", Account.login.like(f"{DATASET_PREFIX}_doctor%")
+            ).order_by(Account.user_id)
+        ).all()
+        patient_range = db.session.execute(
+            select(func.min(Account.user_id), func.max(Account.user_id)).where(
+                Account.role == "patient", Account.login.like(f"{DATASET_PREFIX}_patient%")
+            )
+        ).one()
+        medicine_ids = list(db.session.execute(select(Medicine.id)).scalars())
+        users = []
+        for login, doctor_id in rng.sample(doctors, min(args.users, len(doctors))):
+            visit_ids = list(db.session.execute(
+                select(Visit.id).where(Visit.doctor_id == doctor_id)
+                .order_by(Visit.date.desc()).limit(200)
+            ).scalars())
+            users.append(VirtualDoctor(
+                make_client(), login, visit_ids,
+                (patient_range[0], patient_range[1] + 1), medicine_ids,
+                random.Random(rng.random()),
+            ))
+    return users
+
+
+# ---------- ПРОГОН ----------
+
+
+def run_user(user, mix, warmup_until, deadline, samples, errors):
+    names, weights = list(mix), list(mix.values())
+    if not user.login():
+        errors.append(f"{user.login_name}: вход не удался")
+        return
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            return
+        name = user.rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            ok = getattr(user, name)()
+        except Exception as e:
+            ok = False
+            errors.append(f"{name}: {e}")
+        if started >= warmup_until:
+            samples.append((name, time.perf_counter() - started, ok))
+
+
+def percentile(ordered, q):
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))]
+
+
+def summarize(samples, duration):
+    groups = {}
+    for name, latency, ok in samples:
+        groups.setdefault(name, []).append((latency, ok))
+    groups["total"] = [(latency, ok) for _, latency, ok in samples]
+
+    report = {}
+    for name, items in groups.items():
+        latencies = sorted(latency for latency, _ in items)
+        report[name] = {
+            "requests": len(items),
+            "errors": sum(1 for _, ok in items if not ok),
+            "rps": round(len(items) / duration, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    print(f"{'операция':<14}{'запросов':>10}{'ошибок':>8}{'rps':>9}"
+          f"{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}")
+    for name, row in report.items():
+        print(f"{name:<14}{row['requests']:>10}{row['errors']:>8}{row['rps']:>9}"
+              f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}")
+
+
+def run(args):
+    ensure_dataset(args)
+    if args.target == "inprocess":
+        make_client = InProcessClient
+    else:
+        def make_client():
+            return HttpClient(args.target)
+
+    users = build_users(args, make_client)
+    if not users:
+        sys.exit("❌ В базе нет сгенерированных врачей")
+
+    samples, errors = [], []
+    started = time.perf_counter()
+    warmup_until = started + args.warmup
+    deadline = warmup_until + args.duration
+    threads = [
+        threading.Thread(
+            target=run_user, args=(user, args.mix, warmup_until, deadline, samples, errors)
+        )
+        for user in users
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if not samples:
+        sys.exit(f"❌ Нет ни одного замера. {errors[:1]}")
+    report = summarize(samples, args.duration)
+    result = {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "target": args.target,
+            "database": _backend(),
+            "users": len(users),
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": args.mix,
+            "seed": args.seed,
+            "dataset": dataset_summary(),
+            "python": platform.python_version(),
+        },
+        "endpoints": report,
+    }
+    print_report(report)
+    if errors:
+        print(f"⚠️ Ошибок клиента: {len(errors)}, первая: {errors[0]}")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результат записан в {args.output}")
+
+
+def _backend():
+    with app.app_context():
+        return db.engine.url.get_backend_name()
+
+
+# ---------- СРАВНЕНИЕ ----------
+
+
+def compare(base_path, new_path, threshold):
+    """Печатает разницу двух прогонов; True, если есть ухудшение выше порога."""
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)["endpoints"]
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)["endpoints"]
+
+    regressed = False
+    print(f"{'операция':<14}{'метрика':<9}{'было':>10}{'стало':>10}{'Δ %':>9}")
+    for name in [n for n in base if n in new]:
+        for metric, worse_if_higher in (("rps", False), ("p50_ms", True),
+                                        ("p95_ms", True), ("p99_ms", True)):
+            old_value, new_value = base[name][metric], new[name][metric]
+            change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+            worse = change > threshold if worse_if_higher else change < -threshold
+            regressed |= worse
+            mark = " ⚠️" if worse else ""
+            print(f"{name:<14}{metric:<9}{old_value:>10}{new_value:>10}{change:>+9.1f}{mark}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"),
+                        help="сравнить два JSON-результата вместо прогона")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="порог ухудшения для --compare, %%")
+    parser.add_argument("--target", default="inprocess",
+                        help="inprocess или URL сервера, например http://127.0.0.1:5000")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="tiny")
+    for field in ("doctors", "patients", "visits", "medicines"):
+        parser.add_argument(f"--{field}", type=int, default=None,
+                            help=f"переопределить число {field} в масштабе")
+    parser.add_argument("--reseed", action="store_true",
+                        help="сгенерировать набор, даже если он уже есть")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=8, help="параллельных врачей")
+    parser.add_argument("--duration", type=float, default=30, help="секунд замера")
+    parser.add_argument("--warmup", type=float, default=3, help="секунд прогрева без замера")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"веса операций, по умолчанию {DEFAULT_MIX}")
+    parser.add_argument("--output", help="куда записать JSON с результатом")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
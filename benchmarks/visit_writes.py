@@ -0,0 +1,172 @@
+"""Пропускная способность записи визитов: коммитов в секунду при N врачах.
+
+Каждый поток — отдельный врач со своей сессией; визит с назначенными
+лекарствами записывается так же, как в doctor_add_visit.
+
+    DATABASE_URL=postgresql://... python benchmarks/visit_writes.py --doctors 8
+    python benchmarks/visit_writes.py --mode orm   # прежний путь для сравнения
+
+Без DATABASE_URL используется временная SQLite-база (в SQLite запись
+сериализуется, цифры годятся только для сравнения режимов между собой).
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="visit-writes-"), "bench.db"
+    )
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, create_visit  # noqa: E402
+from models import (  # noqa: E402
+    db,
+    Doctor,
+    Patient,
+    Medicine,
+    Visit,
+    VisitMedicine,
+    reconcile_counters,
+    rebuild_visit_stats,
+)
+
+BENCH_DIAGNOSIS = "benchmark-visit"
+
+
+def create_visit_orm(medicines=(), **fields):
+    """Прежний путь: flush визита и отдельный ORM-объект на каждое лекарство."""
+    visit = Visit(**fields)
+    db.session.add(visit)
+    db.session.flush()
+    for medicine_id, instruction in medicines:
+        db.session.add(
+            VisitMedicine(
+                visit_id=visit.id,
+                medicine_id=medicine_id,
+                doctor_instructions=instruction,
+            )
+        )
+    db.session.commit()
+    return visit
+
+
+WRITERS = {"bulk": create_visit, "orm": create_visit_orm}
+
+
+def run_doctor(writer, doctor_id, patient_ids, medicine_ids, args, offset, latencies, errors):
+    with app.app_context():
+        start = datetime(2040, 1, 1) + timedelta(days=offset)
+        for i in range(args.visits):
+            medicines = [
+                (medicine_ids[(i + k) % len(medicine_ids)], f"инструкция {k}")
+                for k in range(args.medicines)
+            ]
+            started = time.perf_counter()
+            try:
+                writer(
+                    doctor_id=doctor_id,
+                    patient_id=patient_ids[i % len(patient_ids)],
+                    date=start + timedelta(minutes=i),
+                    location="Кабинет 1",
+                    symptoms="",
+                    diagnosis=BENCH_DIAGNOSIS,
+                    prescriptions="",
+                    medicines=medicines,
+                )
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                db.session.rollback()
+                errors.append(str(e))
+        db.session.remove()
+
+
+def cleanup():
+    with app.app_context():
+        Visit.query.filter_by(diagnosis=BENCH_DIAGNOSIS).delete(synchronize_session=False)
+        db.session.commit()
+        # Массовое удаление идёт мимо событий маппера — пересчитываем агрегаты
+        reconcile_counters()
+        rebuild_visit_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=sorted(WRITERS), default="bulk")
+    parser.add_argument("--doctors", type=int, default=4, help="параллельных врачей")
+    parser.add_argument("--visits", type=int, default=100, help="визитов на врача")
+    parser.add_argument("--medicines", type=int, default=3, help="лекарств в визите")
+    args = parser.parse_args()
+
+    with app.app_context():
+        doctor_ids = [d.id for d in Doctor.query.order_by(Doctor.id).limit(args.doctors)]
+        patient_ids = [p.id for p in Patient.query.order_by(Patient.id).limit(100)]
+        medicine_ids = [m.id for m in Medicine.query.order_by(Medicine.id)]
+    if not (doctor_ids and patient_ids and len(medicine_ids) >= args.medicines):
+        sys.exit("❌ В базе не хватает врачей, пациентов или лекарств")
+
+    writer = WRITERS[args.mode]
+    latencies, errors = [], []
+
+    # Число обращений к БД (round-trip) за прогон
+    statements = [0]
+
+    def count_statement(*_):
+        statements[0] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count_statement)
+    threads = [
+        threading.Thread(
+            target=run_doctor,
+            args=(
+                writer,
+                doctor_ids[n % len(doctor_ids)],
+                patient_ids,
+                medicine_ids,
+                args,
+                n,
+                latencies,
+                errors,
+            ),
+        )
+        for n in range(args.doctors)
+    ]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    event.remove(engine, "before_cursor_execute", count_statement)
+
+    try:
+        commits = len(latencies)
+        print(f"📊 Режим {args.mode}: {args.doctors} врачей × {args.visits} визитов, "
+              f"{args.medicines} лекарств в визите")
+        print(f"✅ Коммитов: {commits}, ошибок: {len(errors)}, за {elapsed:.2f} с")
+        print(f"🚀 {commits / elapsed:.1f} коммитов/с, "
+              f"{statements[0] / max(commits, 1):.1f} SQL-запросов на визит")
+        if latencies:
+            ordered = sorted(latencies)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            print(f"⏱️  задержка: медиана {statistics.median(ordered) * 1000:.1f} мс, "
+                  f"p95 {p95 * 1000:.1f} мс")
+        if errors:
+            print(f"⚠️ Первая ошибка: {errors[0]}")
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
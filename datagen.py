@@ -0,0 +1,452 @@
+import csv
+import io
+import math
+import os
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select, text
+
+from auth import hash_password
+from models import (
+    db,
+    Account,
+    Admin,
+    Doctor,
+    Patient,
+    Medicine,
+    Visit,
+    VisitMedicine,
+    bump_counter,
+    data_version_name,
+    reconcile_counters,
+    rebuild_visit_stats,
+)
+from partitions import create_month_partitions, is_partitioned, month_starts
+from refdata import invalidate_refdata
+
+# Синтетические данные для демо и нагрузочных тестов: один и тот же seed и end
+# дают одни и те же строки. Запись пачками с заранее известными id, без
+# ORM-объектов: в Postgres через COPY, в остальных БД — executemany. Счётчики
+# и агрегаты пересчитываются один раз в конце.
+
+# Пароль всех сгенерированных врачей и пациентов (хеш считается один раз)
+DATAGEN_PASSWORD = "datagen123"
+
+# Строк в одной пачке (одна транзакция)
+DATAGEN_CHUNK_SIZE = int(os.getenv("DATAGEN_CHUNK_SIZE", 10_000))
+
+# Последний день визитов по умолчанию: фиксирован, чтобы набор не зависел от
+# дня запуска
+DATAGEN_END = datetime(2026, 1, 1)
+
+# Масштаб набора, которым populate_db заполняет пустую базу
+DEMO_DATA_SCALE = os.getenv("DEMO_DATA_SCALE", "tiny")
+
+SCALES = {
+    "tiny": {"doctors": 10, "patients": 200, "visits": 1_000, "medicines": 30},
+    "small": {"doctors": 100, "patients": 10_000, "visits": 100_000, "medicines": 200},
+    "medium": {"doctors": 1_000, "patients": 100_000, "visits": 1_000_000, "medicines": 500},
+    "large": {"doctors": 10_000, "patients": 1_000_000, "visits": 10_000_000, "medicines": 1_000},
+}
+
+# Перекос частот: индекс берётся как int(n * random() ** skew), чем больше
+# skew, тем сильнее выбор смещён к первым id. Пациенты с хроникой ходят часто,
+# большинство — раз-два; нагрузка на врачей неравномерна слабее
+PATIENT_SKEW = 2.0
+DOCTOR_SKEW = 1.5
+MEDICINE_SKEW = 2.5
+# Диагнозы — закон Ципфа: вес i-го диагноза 1 / (i + 1) ** DIAGNOSIS_ZIPF
+DIAGNOSIS_ZIPF = 1.1
+
+# Визиты по дням недели (пн..вс), часам приёма и сезону: пик в январе,
+# провал летом; поток растёт к концу периода на VISIT_GROWTH
+WEEKDAY_WEIGHTS = (1.25, 1.1, 1.0, 1.0, 0.95, 0.4, 0.1)
+HOUR_WEIGHTS = {8: 1.2, 9: 1.5, 10: 1.5, 11: 1.3, 12: 1.0, 13: 0.6,
+                14: 0.9, 15: 1.0, 16: 0.9, 17: 0.8, 18: 0.5, 19: 0.3}
+SEASON_AMPLITUDE = 0.35
+VISIT_GROWTH = 0.5
+
+FIRST_NAMES = (
+    "Ivan", "Petr", "Anna", "Maria", "Sergey", "Olga", "Dmitry", "Elena",
+    "Alexey", "Natalia", "Mikhail", "Irina", "Andrey", "Tatiana", "Pavel", "Yulia",
+)
+MIDDLE_NAMES = ("Ivanovich", "Petrovich", "Sergeevna", "Andreevna", "Mikhailovich", "Pavlovna")
+LAST_NAMES = (
+    "Ivanov", "Petrov", "Sidorov", "Smirnov", "Kuznetsov", "Popov", "Vasiliev",
+    "Sokolov", "Mikhailov", "Novikov", "Fedorov", "Morozov", "Volkov", "Alekseev",
+    "Lebedev", "Semenov", "Egorov", "Pavlov", "Kozlov", "Stepanov",
+)
+POSITIONS = (
+    "Therapist", "Surgeon", "Cardiologist", "Neurologist", "Ophthalmologist",
+    "Otolaryngologist", "Endocrinologist", "Gastroenterologist", "Urologist",
+    "Dermatologist", "Psychiatrist", "Traumatologist",
+)
+# От частых к редким
+DIAGNOSES = (
+    "Acute respiratory infection", "Hypertension", "Acute pharyngitis", "Bronchitis",
+    "Osteochondrosis", "Gastritis", "Type 2 diabetes", "Allergic dermatitis",
+    "Cystitis", "Migraine", "Angina", "Otitis media", "Anxiety disorder",
+    "Ligament sprain", "Pneumonia", "Glaucoma", "Cerebral circulatory disorder",
+    "Acute appendicitis", "Ovarian dysfunction", "Fibroadenoma",
+)
+# (название, описание, побочные эффекты, способ применения), от частых к редким
+MEDICINES = (
+    ("Paracetamol", "Painkiller and fever reducer",
+     "Nausea, abdominal pain, allergic reactions", "1 tablet 3-4 times a day after meals"),
+    ("Ibuprofen", "Non-steroidal anti-inflammatory drug",
+     "Headache, dizziness, nausea, heartburn", "1 tablet 3 times a day during meals"),
+    ("Amlodipine", "Lowers blood pressure",
+     "Headache, leg swelling, dizziness", "1 tablet once a day"),
+    ("Loratadine", "Antiallergic drug",
+     "Headache, drowsiness, dry mouth", "1 tablet once a day"),
+    ("Amoxicillin", "Broad-spectrum antibiotic",
+     "Nausea, diarrhea, allergic reactions", "1 tablet 3 times a day for 7-10 days"),
+    ("Omeprazole", "Reduces stomach acid",
+     "Nausea, constipation, headache", "1 capsule once a day in the morning on empty stomach"),
+    ("Metformin", "Antidiabetic drug",
+     "Nausea, diarrhea, metallic taste", "1 tablet 2-3 times a day with meals"),
+    ("Aspirin", "Painkiller, fever reducer, anti-inflammatory",
+     "Stomach irritation, bleeding", "1 tablet 2-3 times a day after meals"),
+    ("Enalapril", "Lowers blood pressure",
+     "Dizziness, cough, fatigue", "1 tablet 1-2 times a day"),
+    ("Atorvastatin", "Reduces cholesterol",
+     "Headache, muscle pain, nausea", "1 tablet once a day in the evening"),
+    ("Cetirizine", "Antiallergic drug",
+     "Drowsiness, dry mouth, fatigue", "1 tablet once a day"),
+    ("Diclofenac", "Non-steroidal anti-inflammatory drug",
+     "Stomach pain, nausea, dizziness", "1 tablet 2-3 times a day after meals"),
+    ("Salbutamol", "Bronchodilator",
+     "Rapid heartbeat, tremor, headache", "Inhale 1-2 puffs as needed"),
+    ("Fluoxetine", "Antidepressant",
+     "Nausea, insomnia, headache", "1 capsule once a day in the morning"),
+    ("Warfarin", "Anticoagulant",
+     "Bleeding, bruising", "1 tablet once a day under INR monitoring"),
+)
+INSTRUCTIONS = (
+    "Twice a day after meals",
+    "Once a day in the morning",
+    "Take if temperature exceeds 38 degrees",
+    "Three times a day for 7 days",
+    "As needed, no more than 4 times a day",
+)
+
+
+def scale_sizes(scale, **overrides):
+    """Размеры набора по имени масштаба; не-None значения overrides их заменяют."""
+    sizes = dict(SCALES[scale])
+    sizes.update({name: value for name, value in overrides.items() if value is not None})
+    return sizes
+
+
+def _skewed(rng, first, count, skew):
+    return first + int(count * rng.random() ** skew)
+
+
+def _cumulative(weights):
+    total, cumulative = 0.0, []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def _day_weight(day, position):
+    season = 1 + SEASON_AMPLITUDE * math.cos(2 * math.pi * (day.timetuple().tm_yday - 15) / 365)
+    return WEEKDAY_WEIGHTS[day.weekday()] * season * (1 + VISIT_GROWTH * position)
+
+
+def _visits_per_day(visits, start, days):
+    """Число визитов на каждый день: пропорционально весу дня, в сумме ровно visits.
+
+    Остаток после округления вниз раздаётся дням с наибольшей дробной частью,
+    поэтому распределение не зависит от генератора случайных чисел.
+    """
+    weights = [_day_weight(start + timedelta(days=i), i / max(days - 1, 1)) for i in range(days)]
+    total = sum(weights)
+    exact = [visits * weight / total for weight in weights]
+    counts = [int(value) for value in exact]
+    by_remainder = sorted(range(days), key=lambda i: counts[i] - exact[i])
+    for i in by_remainder[: visits - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+def _next_id(connection, model):
+    return (connection.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _chunks(rows, size=DATAGEN_CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _copy(connection, table, chunk):
+    """COPY ... FROM STDIN одной пачки: на порядок быстрее executemany."""
+    columns = list(chunk[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chunk:
+        writer.writerow(["\\N" if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def _insert(table, rows):
+    written = 0
+    for chunk in _chunks(rows):
+        with db.engine.begin() as connection:
+            if connection.dialect.driver == "psycopg2":
+                _copy(connection, table, chunk)
+            else:
+                connection.execute(table.insert(), chunk)
+        written += len(chunk)
+    return written
+
+
+def _doctor_rows(rng, first_id, count, prefix, password_hash, now):
+    for doctor_id in range(first_id, first_id + count):
+        yield {
+            "id": doctor_id,
+            "first_name": rng.choice(FIRST_NAMES),
+            "middle_name": rng.choice(MIDDLE_NAMES),
+            "last_name": rng.choice(LAST_NAMES),
+            "position": rng.choice(POSITIONS),
+            "login": f"{prefix}_doctor{doctor_id}",
+            "phone": f"+70{doctor_id:09d}",
+            "room": str(100 + doctor_id % 400),
+            "password_hash": password_hash,
+            "created_at": now,
+        }
+
+
+def _patient_rows(rng, first_id, count, prefix, password_hash, now):
+    for patient_id in range(first_id, first_id + count):
+        yield {
+            "id": patient_id,
+            "first_name": rng.choice(FIRST_NAMES),
+            "last_name": rng.choice(LAST_NAMES),
+            "gender": rng.choice(("M", "F")),
+            "date_of_birth": date(1940, 1, 1) + timedelta(days=rng.randrange(27_000)),
+            "address": f"{rng.randrange(1, 300)} Lenin St, Apt {rng.randrange(1, 200)}",
+            "phone": None,
+            "login": f"{prefix}_patient{patient_id}",
+            "password_hash": password_hash,
+            "created_at": now,
+        }
+
+
+def _medicine_rows(first_id, count, prefix, taken, now):
+    for medicine_id in range(first_id, first_id + count):
+        name, description, side_effects, usage_method = MEDICINES[
+            (medicine_id - first_id) % len(MEDICINES)
+        ]
+        if name in taken:
+            name = f"{name} ({prefix}-{medicine_id})"
+        taken.add(name)
+        yield {
+            "id": medicine_id,
+            "name": name,
+            "description": description,
+            "side_effects": side_effects,
+            "usage_method": usage_method,
+            "created_at": now,
+        }
+
+
+def _account_rows(role, first_id, count, prefix):
+    for user_id in range(first_id, first_id + count):
+        yield {"login": f"{prefix}_{role}{user_id}", "role": role, "user_id": user_id}
+
+
+def _visit_rows(rng, first_id, counts, start, doctor_ids, patient_ids, now):
+    """Визиты по дням в хронологическом порядке: id растут вместе с датой."""
+    hours, hour_weights = list(HOUR_WEIGHTS), _cumulative(HOUR_WEIGHTS.values())
+    diagnosis_weights = _cumulative(1 / (i + 1) ** DIAGNOSIS_ZIPF for i in range(len(DIAGNOSES)))
+    doctors = (doctor_ids[0], doctor_ids[1] - doctor_ids[0])
+    patients = (patient_ids[0], patient_ids[1] - patient_ids[0])
+    visit_id = first_id
+    for offset, count in enumerate(counts):
+        if not count:
+            continue
+        day = start + timedelta(days=offset)
+        # Приём в рабочее время с шагом 15 минут
+        times = sorted(
+            (hour, 15 * rng.randrange(4))
+            for hour in rng.choices(hours, cum_weights=hour_weights, k=count)
+        )
+        diagnoses = rng.choices(DIAGNOSES, cum_weights=diagnosis_weights, k=count)
+        for (hour, minute), diagnosis in zip(times, diagnoses):
+            yield {
+                "id": visit_id,
+                "patient_id": _skewed(rng, *patients, PATIENT_SKEW),
+                "doctor_id": _skewed(rng, *doctors, DOCTOR_SKEW),
+                "date": day.replace(hour=hour, minute=minute),
+                "location": f"Office {rng.randrange(100, 500)}",
+                "symptoms": "Synthetic symptoms",
+                "diagnosis": diagnosis,
+                "prescriptions": "",
+                "created_at": now,
+            }
+            visit_id += 1
+
+
+def _visit_medicine_rows(rng, visits, medicine_ids, per_visit):
+    first, count = medicine_ids[0], medicine_ids[1] - medicine_ids[0]
+    for visit in visits:
+        chosen = set()
+        for _ in range(min(rng.randint(0, per_visit * 2), count)):
+            medicine_id = _skewed(rng, first, count, MEDICINE_SKEW)
+            while medicine_id in chosen:
+                medicine_id = first + (medicine_id - first + 1) % count
+            chosen.add(medicine_id)
+            yield {
+                "visit_id": visit["id"],
+                "visit_date": visit["date"],
+                "medicine_id": medicine_id,
+                "doctor_instructions": rng.choice(INSTRUCTIONS),
+                "created_at": visit["created_at"],
+            }
+
+
+def generate_dataset(doctors, patients, visits, medicines, seed=42, prefix="gen",
+                     medicines_per_visit=1, days=730, end=None, attach_existing=False):
+    """Дописывает в БД синтетический набор и возвращает число строк по таблицам.
+
+    Логины — <prefix>_doctor<id>, <prefix>_patient<id>, пароль DATAGEN_PASSWORD.
+    Визиты распределены по days дням до end (по умолчанию DATAGEN_END).
+    attach_existing=True отдаёт визиты и уже существующим врачам и пациентам.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    end = (end or DATAGEN_END).replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    password_hash = hash_password(DATAGEN_PASSWORD)
+
+    with db.engine.connect() as connection:
+        first = {model: _next_id(connection, model) for model in (Doctor, Patient, Medicine, Visit)}
+        lowest = {
+            model: connection.execute(select(func.min(model.id))).scalar() or first[model]
+            for model in (Doctor, Patient)
+        } if attach_existing else first
+        taken = set(connection.execute(
+            select(Medicine.name).where(Medicine.name.in_([m[0] for m in MEDICINES]))
+        ).scalars())
+    doctor_ids = (lowest[Doctor], first[Doctor] + doctors)
+    patient_ids = (lowest[Patient], first[Patient] + patients)
+    medicine_ids = (first[Medicine], first[Medicine] + medicines)
+
+    written = {
+        "doctors": _insert(
+            Doctor.__table__,
+            _doctor_rows(rng, first[Doctor], doctors, prefix, password_hash, now),
+        ),
+        "patients": _insert(
+            Patient.__table__,
+            _patient_rows(rng, first[Patient], patients, prefix, password_hash, now),
+        ),
+        "medicines": _insert(
+            Medicine.__table__, _medicine_rows(first[Medicine], medicines, prefix, taken, now)
+        ),
+    }
+    _insert(Account.__table__, _account_rows("doctor", first[Doctor], doctors, prefix))
+    _insert(Account.__table__, _account_rows("patient", first[Patient], patients, prefix))
+
+    written["visits"] = written["visit_medicines"] = 0
+    if doctor_ids[1] > doctor_ids[0] and patient_ids[1] > patient_ids[0] and visits:
+        with db.engine.begin() as connection:
+            if is_partitioned(connection):
+                create_month_partitions(connection, month_starts(start, end))
+        counts = _visits_per_day(visits, start, days)
+        rows = _visit_rows(rng, first[Visit], counts, start, doctor_ids, patient_ids, now)
+        for chunk in _chunks(rows):
+            written["visits"] += _insert(Visit.__table__, chunk)
+            if medicines:
+                written["visit_medicines"] += _insert(
+                    VisitMedicine.__table__,
+                    _visit_medicine_rows(rng, chunk, medicine_ids, medicines_per_visit),
+                )
+
+    finish_bulk_load()
+    return written
+
+
+def finish_bulk_load():
+    """То, что при записи через ORM делают события маппера, — один раз на загрузку."""
+    if db.engine.dialect.name == "postgresql":
+        # id заданы явно — последовательности догоняют max(id)
+        with db.engine.begin() as connection:
+            for table in ("doctors", "patients", "medicines", "visits", "visit_medicines"):
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"COALESCE((SELECT max(id) FROM {table}), 0) + 1, false)"
+                ))
+    reconcile_counters()
+    rebuild_visit_stats()
+    with db.engine.begin() as connection:
+        for name in ("visits", "medicines", "visit_details"):
+            bump_counter(connection, data_version_name(name), 1)
+    invalidate_refdata()
+
+
+def populate_db():
+    """Заполняет пустую базу: учётки со страницы входа и набор DEMO_DATA_SCALE.
+
+    admin / admin123, belov / doctor123, ivanov / password123; больше всего
+    визитов у belov и ivanov (первые id при перекосе частот).
+    """
+    try:
+        if not Admin.query.first():
+            db.session.add(Admin(login="admin", password_hash=hash_password("admin123")))
+            db.session.commit()
+            print("✅ Admins added")
+
+        if Doctor.query.first() or Patient.query.first():
+            return
+
+        db.session.add_all([
+            Doctor(
+                first_name="Alexander",
+                middle_name="Sergeevich",
+                last_name="Belov",
+                position="Therapist",
+                login="belov",
+                phone="89897650467",
+                room="101",
+                password_hash=hash_password("doctor123"),
+            ),
+            Patient(
+                first_name="Ivan",
+                last_name="Ivanov",
+                gender="M",
+                date_of_birth=date(1985, 3, 15),
+                address="10 Lenin St, Apt 5",
+                login="ivanov",
+                password_hash=hash_password("password123"),
+            ),
+        ])
+        db.session.commit()
+        print("✅ Demo doctor and patient added")
+
+        written = generate_dataset(
+            **scale_sizes(DEMO_DATA_SCALE), prefix="demo", attach_existing=True
+        )
+        print(f"✅ Synthetic data added: {written}")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error populating database: {e}")
+        raise
@@ -0,0 +1,170 @@
+import os
+import shlex
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+# Профиль пула соединений из окружения. Каждый поток gunicorn держит не
+# больше одного соединения на engine, поэтому по умолчанию размер пула
+# равен числу потоков воркера; overflow покрывает короткие engine.begin()
+# внутри запроса (индексы, секции) и стриминговую выгрузку.
+DEFAULT_POOL_SIZE = 5
+
+# Ожидание соединения дольше этого (с) считается медленным
+DB_POOL_SLOW_CHECKOUT = float(os.getenv("DB_POOL_SLOW_CHECKOUT", 0.05))
+
+
+def _env_flag(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def gunicorn_threads():
+    """--threads воркера gunicorn (GUNICORN_THREADS, GUNICORN_CMD_ARGS, argv) или None."""
+    if os.getenv("GUNICORN_THREADS"):
+        return int(os.environ["GUNICORN_THREADS"])
+    sources = [shlex.split(os.getenv("GUNICORN_CMD_ARGS", ""))]
+    if "gunicorn" in os.path.basename(sys.argv[0]):
+        sources.append(sys.argv[1:])
+    for args in sources:
+        for i, arg in enumerate(args):
+            if arg.startswith("--threads="):
+                return int(arg.split("=", 1)[1])
+            if arg == "--threads" and i + 1 < len(args):
+                return int(args[i + 1])
+    return None
+
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS для основной БД и реплики.
+
+    DB_POOL_PRE_PING=0 убирает SELECT 1 перед каждой выдачей соединения:
+    после обрыва SQLAlchemy сама помечает пул недействительным, и соединения
+    пересоздаются — ошибку получает только запрос, попавший на обрыв.
+    """
+    options = {
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 300)),
+        "pool_pre_ping": _env_flag("DB_POOL_PRE_PING", True),
+    }
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite живёт в одном соединении (StaticPool)
+        return options
+
+    pool_size = int(os.getenv("DB_POOL_SIZE") or gunicorn_threads() or DEFAULT_POOL_SIZE)
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW") or pool_size),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+    )
+    return options
+
+
+class PoolMetrics:
+    """Счётчики пула одного engine в этом процессе."""
+
+    FIELDS = (
+        "checkouts",
+        "connects",
+        "invalidations",
+        "soft_invalidations",
+        "timeouts",
+        "slow_checkouts",
+        "wait_seconds_total",
+        "wait_seconds_max",
+        "checked_out_peak",
+        "overflow_peak",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, field, amount=1):
+        with self._lock:
+            self.values[field] += amount
+
+    def record_wait(self, seconds, pool):
+        with self._lock:
+            values = self.values
+            values["wait_seconds_total"] += seconds
+            values["wait_seconds_max"] = max(values["wait_seconds_max"], seconds)
+            if seconds >= DB_POOL_SLOW_CHECKOUT:
+                values["slow_checkouts"] += 1
+            values["checked_out_peak"] = max(values["checked_out_peak"], pool.checkedout())
+            values["overflow_peak"] = max(values["overflow_peak"], pool.overflow())
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool, который замеряет ожидание свободного соединения."""
+
+    metrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            if self.metrics is not None:
+                self.metrics.add("timeouts")
+            raise
+        if self.metrics is not None:
+            self.metrics.record_wait(time.perf_counter() - started, self)
+        return connection
+
+    def recreate(self):
+        # dispose() пересоздаёт пул — счётчики переходят в новый
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+# bind ("primary", "replica") -> (engine, PoolMetrics)
+_pools = {}
+
+
+def instrument_engine(name, engine):
+    """Подключает счётчики к пулу engine (один раз на engine)."""
+    if name in _pools and _pools[name][0] is engine:
+        return _pools[name][1]
+    metrics = PoolMetrics()
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.metrics = metrics
+    # События пула на engine переживают пересоздание пула
+    event.listen(engine, "checkout", lambda *args: metrics.add("checkouts"))
+    event.listen(engine, "connect", lambda *args: metrics.add("connects"))
+    event.listen(engine, "invalidate", lambda *args: metrics.add("invalidations"))
+    event.listen(engine, "soft_invalidate", lambda *args: metrics.add("soft_invalidations"))
+    _pools[name] = (engine, metrics)
+    return metrics
+
+
+def pool_stats():
+    """Состояние и счётчики пулов этого процесса (для /admin/metrics/db-pool)."""
+    stats = {}
+    for name, (engine, metrics) in _pools.items():
+        pool = engine.pool
+        entry = {"pool_class": type(pool).__name__, **metrics.snapshot()}
+        if isinstance(pool, QueuePool):
+            entry.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=max(pool.overflow(), 0),
+                max_overflow=pool._max_overflow,
+                timeout=pool.timeout(),
+            )
+        stats[name] = entry
+    return stats
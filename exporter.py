@@ -0,0 +1,176 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, select
+
+from models import db, Visit, Patient, Doctor, Medicine, VisitMedicine
+
+# Сколько строк результата забирать из курсора за раз
+EXPORT_FETCH_SIZE = 1000
+
+# Примерный размер куска ответа: мелкие куски дороже передавать, крупные —
+# держать в памяти
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = ("csv", "ndjson")
+
+EXPORT_FIELDS = (
+    "id",
+    "date",
+    "location",
+    "symptoms",
+    "diagnosis",
+    "prescriptions",
+    "patient_id",
+    "patient_first_name",
+    "patient_last_name",
+    "patient_date_of_birth",
+    "patient_gender",
+    "doctor_id",
+    "doctor_first_name",
+    "doctor_middle_name",
+    "doctor_last_name",
+    "doctor_position",
+    "medicines",
+)
+
+
+def parse_export_filters(date_from=None, date_to=None, doctor_id=None):
+    """Фильтры выгрузки из строк запроса; ValueError при неверном формате."""
+    filters = {}
+    try:
+        if date_from:
+            filters["date_from"] = datetime.strptime(date_from, "%Y-%m-%d")
+        if date_to:
+            # Включительно: до начала следующего дня
+            filters["date_to"] = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
+    except ValueError:
+        raise ValueError("Неверный формат даты, ожидается ГГГГ-ММ-ДД") from None
+    if doctor_id:
+        filters["doctor_id"] = int(doctor_id)
+    return filters
+
+
+def _export_query(date_from=None, date_to=None, doctor_id=None):
+    query = (
+        select(
+            Visit.id,
+            Visit.date,
+            Visit.location,
+            Visit.symptoms,
+            Visit.diagnosis,
+            Visit.prescriptions,
+            Visit.patient_id,
+            Patient.first_name.label("patient_first_name"),
+            Patient.last_name.label("patient_last_name"),
+            Patient.date_of_birth.label("patient_date_of_birth"),
+            Patient.gender.label("patient_gender"),
+            Visit.doctor_id,
+            Doctor.first_name.label("doctor_first_name"),
+            Doctor.middle_name.label("doctor_middle_name"),
+            Doctor.last_name.label("doctor_last_name"),
+            Doctor.position.label("doctor_position"),
+            Medicine.name.label("medicine_name"),
+            VisitMedicine.doctor_instructions,
+        )
+        .join(Patient, Visit.patient_id == Patient.id)
+        .join(Doctor, Visit.doctor_id == Doctor.id)
+        # Равенство дат даёт Postgres соединять секции попарно (один месяц)
+        .outerjoin(
+            VisitMedicine,
+            and_(VisitMedicine.visit_id == Visit.id, VisitMedicine.visit_date == Visit.date),
+        )
+        .outerjoin(Medicine, VisitMedicine.medicine_id == Medicine.id)
+        # Строки одного визита идут подряд — их можно склеить без буфера
+        .order_by(Visit.id, VisitMedicine.id)
+    )
+    if date_from is not None:
+        query = query.where(Visit.date >= date_from)
+    if date_to is not None:
+        query = query.where(Visit.date < date_to)
+    if doctor_id is not None:
+        query = query.where(Visit.doctor_id == doctor_id)
+    return query
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def iter_visits(**filters):
+    """Визиты с пациентом, врачом и списком лекарств — по одному, потоком.
+
+    Результат читается из курсора кусками по EXPORT_FETCH_SIZE (в Postgres —
+    серверный курсор), поэтому память не зависит от объёма выгрузки.
+    """
+    result = db.session.execute(
+        _export_query(**filters),
+        execution_options={"yield_per": EXPORT_FETCH_SIZE, "stream_results": True},
+    )
+    current = None
+    for row in result:
+        if current is None or current["id"] != row.id:
+            if current is not None:
+                yield current
+            current = {
+                field: _isoformat(getattr(row, field))
+                for field in EXPORT_FIELDS
+                if field != "medicines"
+            }
+            current["medicines"] = []
+        if row.medicine_name is not None:
+            current["medicines"].append(
+                {"name": row.medicine_name, "instructions": row.doctor_instructions}
+            )
+    if current is not None:
+        yield current
+
+
+def _format_medicines(medicines):
+    return "; ".join(
+        f"{m['name']} ({m['instructions']})" if m["instructions"] else m["name"]
+        for m in medicines
+    )
+
+
+def iter_export_text(fmt="csv", **filters):
+    """Текст выгрузки кусками примерно по EXPORT_CHUNK_SIZE."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(EXPORT_FIELDS)
+
+    for visit in iter_visits(**filters):
+        if writer:
+            visit["medicines"] = _format_medicines(visit["medicines"])
+            writer.writerow([visit[field] for field in EXPORT_FIELDS])
+        else:
+            buffer.write(json.dumps(visit, ensure_ascii=False))
+            buffer.write("\n")
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_export_bytes(fmt="csv", compress=False, **filters):
+    """Байты выгрузки в UTF-8, при compress=True — gzip на лету."""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31 — формат gzip
+    for chunk in iter_export_text(fmt, **filters):
+        data = chunk.encode("utf-8")
+        if compressor:
+            data = compressor.compress(data)
+            if not data:
+                continue
+        yield data
+    if compressor:
+        yield compressor.flush()
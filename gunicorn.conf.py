@@ -0,0 +1,23 @@
+import os
+import shutil
+
+# gunicorn читает этот файл из рабочего каталога сам; параметры командной
+# строки в Dockerfile его перекрывают.
+
+# Метрики Prometheus от всех воркеров складываются через общий каталог.
+# Переменная задаётся до загрузки приложения в воркерах
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+
+def on_starting(server):
+    # Файлы прошлого запуска дали бы счётчики от мёртвых процессов
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Живые gauge (запросы в обработке) умершего воркера больше не учитываются
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
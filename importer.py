@@ -0,0 +1,474 @@
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from sqlalchemy import Date, DateTime, String, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from auth import hash_password, password_pool, PasswordPoolBusy
+from models import (
+    db,
+    Account,
+    Doctor,
+    Patient,
+    Medicine,
+    bump_counter,
+    data_version_name,
+)
+from refdata import invalidate_refdata
+
+# Строк в одной транзакции: ошибка БД откатывает только свою пачку
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+
+# Сколько ошибок и конфликтов возвращать в отчёте (счётчики — всегда полные)
+IMPORT_MAX_REPORTED = 1000
+
+# Свой пул для хешей только у импорта из командной строки (flask import-data)
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", os.cpu_count() or 2))
+
+# Импорт через веб хеширует пароли в общем пуле проверки паролей и не больше
+# стольких за запрос, чтобы уложиться в таймаут gunicorn
+IMPORT_WEB_MAX_PASSWORDS = int(os.getenv("IMPORT_WEB_MAX_PASSWORDS", 200))
+
+IMPORT_FORMATS = ("csv", "ndjson")
+
+
+class ImportSpec:
+    """Что и как загружается в таблицу model.
+
+    key — поле, по которому строка находится после вставки (логин, название);
+    role — роль для реестра accounts; counter — имя в stat_counters;
+    unique_checks — {поле: столбец}, занятость которых проверяется заранее.
+    """
+
+    def __init__(self, model, key, role=None, counter=None, version=None,
+                 unique_checks=None):
+        self.model = model
+        self.table = model.__table__
+        self.key = key
+        self.role = role
+        self.counter = counter
+        self.version = version
+        self.unique_checks = unique_checks or {}
+        self.has_password = "password_hash" in self.table.c
+        self.columns = [
+            column for column in self.table.c
+            if column.name not in ("id", "created_at")
+        ]
+        self.required = [
+            column.name for column in self.columns
+            if not column.nullable and column.name != "password_hash"
+        ]
+
+
+IMPORT_SPECS = {
+    "patients": ImportSpec(
+        Patient,
+        key="login",
+        role="patient",
+        counter="patients",
+        unique_checks={"login": Account.__table__.c.login},
+    ),
+    "doctors": ImportSpec(
+        Doctor,
+        key="login",
+        role="doctor",
+        counter="doctors",
+        unique_checks={
+            "login": Account.__table__.c.login,
+            "phone": Doctor.__table__.c.phone,
+        },
+    ),
+    "medicines": ImportSpec(
+        Medicine,
+        key="name",
+        version="medicines",
+        unique_checks={"name": Medicine.__table__.c.name},
+    ),
+}
+
+
+# ---------- ЧТЕНИЕ ПОТОКА ----------
+
+
+def iter_records(stream, fmt):
+    """(номер строки, dict) из текстового потока CSV или NDJSON, по одной строке.
+
+    Ошибка разбора строки NDJSON отдаётся как (номер, ValueError).
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for number, record in enumerate(reader, start=1):
+            yield number, record
+        return
+
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("ожидается JSON-объект")
+        except ValueError as e:
+            yield number, ValueError(f"Некорректный JSON: {e}")
+            continue
+        yield number, record
+
+
+def detect_format(filename=None, content_type=None, default="csv"):
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or ""):
+        return "ndjson"
+    if name.endswith(".csv") or "csv" in (content_type or ""):
+        return "csv"
+    return default
+
+
+# ---------- ПРОВЕРКА СТРОК ----------
+
+
+def _clean(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = str(value)
+    value = value.strip()
+    return value or None
+
+
+def validate_record(spec, record):
+    """Строка для вставки или ValueError с понятным сообщением."""
+    row = {}
+    for column in spec.columns:
+        if column.name == "password_hash":
+            continue
+        value = _clean(record.get(column.name))
+        if value is None:
+            if column.name in spec.required:
+                raise ValueError(f"Не заполнено поле {column.name}")
+            row[column.name] = None
+            continue
+        if isinstance(column.type, Date):
+            try:
+                value = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"{column.name}: ожидается дата ГГГГ-ММ-ДД") from None
+        elif isinstance(column.type, DateTime):
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"{column.name}: ожидается дата и время") from None
+        elif isinstance(column.type, String) and column.type.length:
+            if len(value) > column.type.length:
+                raise ValueError(
+                    f"{column.name}: длиннее {column.type.length} символов"
+                )
+        row[column.name] = value
+
+    if spec.has_password:
+        # Готовый хеш (перенос из другой системы) или пароль, который захешируем
+        password_hash = _clean(record.get("password_hash"))
+        password = record.get("password")
+        if password_hash:
+            row["password_hash"] = password_hash
+        elif password:
+            row["password_hash"] = None
+            row["_password"] = str(password)
+        else:
+            raise ValueError("Не заполнено поле password")
+
+    row["created_at"] = datetime.utcnow()
+    return row
+
+
+# ---------- ЗАПИСЬ ПАЧКИ ----------
+
+
+def _existing_values(connection, column, values):
+    if not values:
+        return set()
+    return set(
+        connection.execute(select(column).where(column.in_(values))).scalars()
+    )
+
+
+def _stage_columns(spec):
+    return [column.name for column in spec.columns] + ["created_at"]
+
+
+def _insert_postgres(connection, spec, rows):
+    """COPY в временную таблицу и INSERT ... SELECT с пропуском конфликтов."""
+    columns = _stage_columns(spec)
+    column_list = ", ".join(columns)
+    stage = f"import_stage_{spec.table.name}"
+    connection.execute(text(
+        f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS "
+        f"SELECT 0 AS row_number, {column_list} FROM {spec.table.name} WITH NO DATA"
+    ))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for number, row in rows:
+        writer.writerow(
+            [number] + ["" if row[name] is None else row[name] for name in columns]
+        )
+    buffer.seek(0)
+
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        # Пустое поле без кавычек в CSV-режиме COPY — это NULL
+        cursor.copy_expert(
+            f"COPY {stage} (row_number, {column_list}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+    result = connection.execute(text(
+        f"INSERT INTO {spec.table.name} ({column_list}) "
+        f"SELECT {column_list} FROM {stage} ORDER BY row_number "
+        f"ON CONFLICT DO NOTHING RETURNING id, {spec.key}"
+    ))
+    return {key: row_id for row_id, key in result}
+
+
+def _insert_executemany(connection, spec, rows):
+    """executemany; вставленные строки — из RETURNING.
+
+    Без RETURNING конфликты не пропускаются: пачка либо вставлена целиком,
+    либо откатывается ошибкой, и id можно найти по ключу.
+    """
+    values = [{name: row[name] for name in _stage_columns(spec)} for _, row in rows]
+    key_column = spec.table.c[spec.key]
+    if connection.dialect.insert_executemany_returning:
+        if connection.dialect.name == "sqlite":
+            statement = sqlite.insert(spec.table).on_conflict_do_nothing()
+        else:
+            statement = spec.table.insert()
+        result = connection.execute(
+            statement.returning(spec.table.c.id, key_column), values
+        )
+        return {key: row_id for row_id, key in result}
+
+    connection.execute(spec.table.insert(), values)
+    keys = [row[spec.key] for _, row in rows]
+    found = connection.execute(
+        select(spec.table.c.id, key_column).where(key_column.in_(keys))
+    )
+    return {key: row_id for row_id, key in found}
+
+
+def _register_accounts(connection, spec, inserted):
+    """Записи accounts для вставленных строк; возвращает логины, занятые другой ролью.
+
+    Такие строки удаляются из таблицы роли: логин без записи в accounts
+    нарушил бы уникальность логина между ролями.
+    """
+    accounts = Account.__table__
+    rows = [
+        {"login": login, "role": spec.role, "user_id": user_id}
+        for login, user_id in inserted.items()
+    ]
+    if connection.dialect.name == "postgresql":
+        statement = postgresql.insert(accounts).on_conflict_do_nothing()
+    elif connection.dialect.name == "sqlite":
+        statement = sqlite.insert(accounts).on_conflict_do_nothing()
+    else:
+        statement = accounts.insert()
+    connection.execute(statement, rows)
+
+    owners = connection.execute(
+        select(accounts.c.login, accounts.c.role, accounts.c.user_id)
+        .where(accounts.c.login.in_(list(inserted)))
+    )
+    taken = {
+        login for login, role, user_id in owners
+        if (role, user_id) != (spec.role, inserted[login])
+    }
+    if taken:
+        connection.execute(
+            spec.table.delete().where(
+                spec.table.c.id.in_([inserted[login] for login in taken])
+            )
+        )
+    return taken
+
+
+def _register_inserted(connection, spec, inserted):
+    """То, что при вставке через ORM делают события маппера.
+
+    Убирает из inserted строки, логин которых занят другой ролью.
+    """
+    if spec.role and inserted:
+        for login in _register_accounts(connection, spec, inserted):
+            del inserted[login]
+
+    if spec.counter and inserted:
+        bump_counter(connection, spec.counter, len(inserted))
+    if spec.version and inserted:
+        bump_counter(connection, data_version_name(spec.version), 1)
+
+
+class ImportJob:
+    """Потоковая загрузка одной сущности с отчётом по строкам."""
+
+    def __init__(self, entity, batch_size=IMPORT_BATCH_SIZE, offline=False):
+        if entity not in IMPORT_SPECS:
+            raise ValueError(f"Неизвестный тип данных: {entity}")
+        self.entity = entity
+        self.spec = IMPORT_SPECS[entity]
+        self.batch_size = batch_size
+        # offline — импорт из командной строки: свой пул хешей и без лимита паролей
+        self.offline = offline
+        self.hasher = None
+        self.hashed = 0
+        self.report = {
+            "entity": entity,
+            "processed": 0,
+            "inserted": 0,
+            "failed": 0,
+            "conflicts": 0,
+            "errors": [],
+        }
+
+    def _reject(self, number, message, conflict=False):
+        self.report["conflicts" if conflict else "failed"] += 1
+        if len(self.report["errors"]) < IMPORT_MAX_REPORTED:
+            self.report["errors"].append(
+                {"row": number, "error": message, "conflict": conflict}
+            )
+
+    def run(self, stream, fmt="csv"):
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат: {fmt}")
+
+        if self.offline:
+            with ThreadPoolExecutor(
+                max_workers=IMPORT_HASH_WORKERS, thread_name_prefix="import-hash"
+            ) as self.hasher:
+                self._read(stream, fmt)
+        else:
+            self._read(stream, fmt)
+        return self.report
+
+    def _read(self, stream, fmt):
+        batch = []
+        try:
+            for number, record in iter_records(stream, fmt):
+                self.report["processed"] += 1
+                if isinstance(record, Exception):
+                    self._reject(number, str(record))
+                    continue
+                try:
+                    batch.append((number, validate_record(self.spec, record)))
+                except ValueError as e:
+                    self._reject(number, str(e))
+                    continue
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+        except (csv.Error, UnicodeDecodeError) as e:
+            self.report["fatal"] = f"Файл не удалось дочитать: {e}"
+        if batch:
+            self._flush(batch)
+
+    def _hash_passwords(self, batch):
+        """Хеширует пароли открытым текстом; строки, которые не удалось, — в ошибки."""
+        pending = [row for _, row in batch if row["password_hash"] is None]
+        if self.offline:
+            hashes = self.hasher.map(hash_password, [row.pop("_password") for row in pending])
+            for row, password_hash in zip(pending, hashes):
+                row["password_hash"] = password_hash
+            return batch
+
+        accepted = []
+        for number, row in batch:
+            if row["password_hash"] is None:
+                if self.hashed >= IMPORT_WEB_MAX_PASSWORDS:
+                    self._reject(
+                        number,
+                        f"Больше {IMPORT_WEB_MAX_PASSWORDS} паролей за один запрос: "
+                        "передайте password_hash или загрузите файл через flask import-data",
+                    )
+                    continue
+                try:
+                    row["password_hash"] = password_pool.run(
+                        hash_password, row.pop("_password")
+                    )
+                except PasswordPoolBusy:
+                    self._reject(number, "Сервер занят проверкой паролей, повторите позже")
+                    continue
+                self.hashed += 1
+            accepted.append((number, row))
+        return accepted
+
+    def _drop_duplicates(self, batch):
+        """Повторы внутри пачки и значения, уже занятые в БД, уходят в конфликты."""
+        connection = db.session.connection()
+        taken = {
+            field: _existing_values(
+                connection, column, list({row[field] for _, row in batch if row[field]})
+            )
+            for field, column in self.spec.unique_checks.items()
+        }
+        accepted = []
+        for number, row in batch:
+            conflict = None
+            for field in self.spec.unique_checks:
+                value = row[field]
+                if value is not None and value in taken[field]:
+                    conflict = f"{field} «{value}» уже занят"
+                    break
+            if conflict:
+                self._reject(number, conflict, conflict=True)
+                continue
+            for field in self.spec.unique_checks:
+                if row[field] is not None:
+                    taken[field].add(row[field])
+            accepted.append((number, row))
+        return accepted
+
+    def _flush(self, batch):
+        try:
+            batch = self._drop_duplicates(batch)
+            if self.spec.has_password:
+                batch = self._hash_passwords(batch)
+            if not batch:
+                db.session.rollback()
+                return
+
+            connection = db.session.connection()
+            if connection.dialect.name == "postgresql":
+                inserted = _insert_postgres(connection, self.spec, batch)
+            else:
+                inserted = _insert_executemany(connection, self.spec, batch)
+
+            _register_inserted(connection, self.spec, inserted)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for number, _ in batch:
+                self._reject(number, f"Ошибка записи пачки: {e}")
+            return
+
+        if self.spec.model in (Doctor, Medicine):
+            invalidate_refdata()
+        self.report["inserted"] += len(inserted)
+        # Строка, вставке которой помешала параллельная запись или занятый
+        # другой ролью логин, — тоже конфликт
+        for number, row in batch:
+            if row[self.spec.key] not in inserted:
+                self._reject(
+                    number, f"{self.spec.key} «{row[self.spec.key]}» уже занят",
+                    conflict=True,
+                )
+
+
+def import_stream(entity, stream, fmt="csv", batch_size=IMPORT_BATCH_SIZE,
+                  offline=False):
+    """Загружает записи entity из текстового потока, возвращает отчёт."""
+    return ImportJob(entity, batch_size, offline).run(stream, fmt)
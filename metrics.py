@@ -0,0 +1,166 @@
+import hmac
+import os
+import time
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Метрики в формате Prometheus (/metrics). Под gunicorn каждый воркер пишет
+# значения в файлы PROMETHEUS_MULTIPROC_DIR (задаётся в gunicorn.conf.py),
+# а /metrics любого воркера складывает их по всем процессам.
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Доступ к /metrics: с METRICS_TOKEN — только с заголовком
+# "Authorization: Bearer <токен>", без него — только с этой же машины
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_LOCAL_ADDRS = ("127.0.0.1", "::1")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "Обработанные HTTP-запросы",
+    ["endpoint", "method", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки запроса (для потоковых — до конца отдачи)",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Запросы в обработке",
+    multiprocess_mode="livesum",
+)
+DB_QUERIES = Histogram(
+    "db_queries_per_request",
+    "SQL-запросов на один HTTP-запрос",
+    ["endpoint"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_TIME = Histogram(
+    "db_time_seconds_per_request",
+    "Суммарное время SQL-запросов за один HTTP-запрос",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+TEMPLATE_RENDER = Histogram(
+    "template_render_seconds",
+    "Время рендера шаблона",
+    ["template"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Сам /metrics в статистику запросов не попадает
+SKIP_ENDPOINTS = ("metrics", "static")
+
+
+def _endpoint():
+    # Имя view, а не путь: число значений метки не растёт от id в URL
+    return request.endpoint or "unmatched"
+
+
+def metrics_allowed():
+    """Можно ли текущему запросу читать /metrics."""
+    if METRICS_TOKEN:
+        given = request.headers.get("Authorization", "").encode()
+        return hmac.compare_digest(given, f"Bearer {METRICS_TOKEN}".encode())
+    return request.remote_addr in METRICS_LOCAL_ADDRS
+
+
+def render_metrics():
+    """(тело, content-type) для ответа /metrics."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# ---------- ВРЕМЯ SQL ----------
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    if has_request_context() and "metrics_started" in g:
+        g.metrics_db_queries += 1
+        g.metrics_db_time += time.perf_counter() - started
+
+
+@event.listens_for(Engine, "handle_error")
+def _query_failed(context):
+    # after_cursor_execute при ошибке не вызывается — снимаем отметку сами
+    connection = context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+# ---------- ЗАПРОСЫ И ШАБЛОНЫ ----------
+
+
+def _template_started(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault("metrics_templates", []).append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    if has_request_context() and g.get("metrics_templates"):
+        started = g.metrics_templates.pop()
+        TEMPLATE_RENDER.labels(template.name or "string").observe(
+            time.perf_counter() - started
+        )
+
+
+def init_metrics(app):
+    """Подключает сбор метрик запросов, SQL и шаблонов к приложению app."""
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def _start_request_metrics():
+        if _endpoint() in SKIP_ENDPOINTS:
+            return
+        g.metrics_started = time.perf_counter()
+        g.metrics_db_queries = 0
+        g.metrics_db_time = 0.0
+        IN_PROGRESS.inc()
+
+    @app.after_request
+    def _remember_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_request_metrics(exc):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        IN_PROGRESS.dec()
+        endpoint = _endpoint()
+        status = str(g.pop("metrics_status", 500))
+        REQUESTS.labels(endpoint, request.method, status).inc()
+        REQUEST_LATENCY.labels(endpoint, request.method, status).observe(
+            time.perf_counter() - started
+        )
+        DB_QUERIES.labels(endpoint).observe(g.pop("metrics_db_queries", 0))
+        DB_TIME.labels(endpoint).observe(g.pop("metrics_db_time", 0.0))
@@ -1,10 +1,24 @@
-import hashlib
-from datetime import datetime
+import os
+import random
+import sqlite3
+from datetime import date, datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from sqlalchemy import String, Integer, Text, Date, DateTime, ForeignKey
-
-db = SQLAlchemy()
+from auth import (
+    hash_password,
+    verify_password,
+    dummy_password_hash,
+    password_pool,
+    PasswordPoolBusy,
+)
+from sqlalchemy import String, Integer, BigInteger, Text, Date, DateTime, ForeignKey
+from sqlalchemy import cast
+from sqlalchemy import event, func, select, inspect, text, and_, literal, exists
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from replica import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class Admin(db.Model):
@@ -74,6 +88,16 @@ class Visit(db.Model):
     doctor = db.relationship("Doctor", backref="visits", lazy=True)
 
 
+# Индекс под keyset-пагинацию ленты визитов (ORDER BY date DESC, id DESC)
+db.Index("ix_visits_date_id", Visit.date, Visit.id)
+
+# Кабинеты врача и пациента: WHERE doctor_id/patient_id = ? ORDER BY date DESC.
+# visit_medicines.visit_id покрыт уникальным индексом (visit_id, medicine_id).
+# Для существующих баз — миграция alembic 3c9d2f7a1b64.
+db.Index("ix_visits_doctor_id_date", Visit.doctor_id, Visit.date.desc())
+db.Index("ix_visits_patient_id_date", Visit.patient_id, Visit.date.desc())
+
+
 class VisitMedicine(db.Model):
     __tablename__ = "visit_medicines"
     id = db.Column(db.Integer, primary_key=True)
@@ -84,6 +108,9 @@ class VisitMedicine(db.Model):
         db.Integer, db.ForeignKey("medicines.id", ondelete="CASCADE"), nullable=False
     )
     doctor_instructions = db.Column(db.Text)
+    # Копия visits.date: ключ секционирования, назначения лежат в секции
+    # месяца своего визита (см. partitions.py). Заполняется событием маппера
+    visit_date = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     visit = db.relationship("Visit", backref="visit_medicines", lazy=True)
@@ -94,6 +121,628 @@ class VisitMedicine(db.Model):
     )
 
 
+# Поиск пациентов по побочным эффектам идёт от лекарства к визитам
+db.Index("ix_visit_medicines_medicine_id", VisitMedicine.medicine_id)
+
+
+@event.listens_for(VisitMedicine, "before_insert")
+def _visit_medicine_date(mapper, connection, target):
+    if target.visit_date is None:
+        visits = Visit.__table__
+        target.visit_date = connection.scalar(
+            select(visits.c.date).where(visits.c.id == target.visit_id)
+        )
+
+
+@event.listens_for(Visit, "after_update")
+def _visit_medicines_follow_date(mapper, connection, target):
+    # В секционированной схеме это делает ON UPDATE CASCADE внешнего ключа
+    if inspect(target).attrs.date.history.has_changes():
+        table = VisitMedicine.__table__
+        connection.execute(
+            table.update()
+            .where(table.c.visit_id == target.id)
+            .values(visit_date=target.date)
+        )
+
+
+# ---------- ПОЛНОТЕКСТОВЫЕ ИНДЕКСЫ ДЛЯ ПОИСКА ----------
+
+# SQLite: внешние FTS5-таблицы с триграммным токенайзером (поиск подстроки)
+# поддерживаются триггерами в актуальном состоянии.
+SQLITE_SEARCH_INDEXES = {
+    "visits_fts": ("visits", "diagnosis"),
+    "medicines_fts": ("medicines", "side_effects"),
+}
+
+# Postgres: GIN-индексы pg_trgm, их использует ILIKE '%...%'
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_visits_diagnosis_trgm "
+    "ON visits USING gin (diagnosis gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_medicines_side_effects_trgm "
+    "ON medicines USING gin (side_effects gin_trgm_ops)",
+]
+
+
+# Подбор пациента в форме визита: префикс фамилии и имени без учёта
+# регистра, строки сравниваются в нижнем регистре. В Postgres text_pattern_ops
+# нужен, чтобы LIKE 'префикс%' шёл по индексу при любой локали БД; в SQLite
+# встроенный lower() не знает кириллицы, вместо него unicode_lower
+PATIENT_NAME_INDEX_DDL = {
+    "postgresql": "CREATE INDEX IF NOT EXISTS ix_patients_name_lower ON patients "
+    "(lower(last_name) text_pattern_ops, lower(first_name) text_pattern_ops)",
+    "sqlite": "CREATE INDEX IF NOT EXISTS ix_patients_name_lower ON patients "
+    "(unicode_lower(last_name), unicode_lower(first_name))",
+}
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_unicode_lower(dbapi_connection, connection_record):
+    # Детерминированная: её можно использовать в индексе. Функция есть только
+    # в соединениях приложения — внешним инструментам индекс не виден
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            "unicode_lower", 1, lambda value: value if value is None else value.lower(),
+            deterministic=True,
+        )
+
+
+def install_patient_name_index(connection):
+    statement = PATIENT_NAME_INDEX_DDL.get(connection.dialect.name)
+    if statement:
+        connection.execute(text(statement))
+
+
+@event.listens_for(Patient.__table__, "after_create")
+def _patient_name_index_after_create(target, connection, **kw):
+    install_patient_name_index(connection)
+
+
+def _sqlite_fts_ddl(fts_table, source_table, column):
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+        f"{column}, content='{source_table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {source_table} BEGIN "
+        f"INSERT INTO {fts_table}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {source_table} BEGIN "
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column} "
+        f"ON {source_table} BEGIN "
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {fts_table}(rowid, {column}) VALUES (new.id, new.{column}); END",
+    ]
+
+
+def install_sqlite_search_index(connection, source_table):
+    """Создаёт FTS5-индекс для таблицы и наполняет его, если он только что появился."""
+    for fts_table, (table_name, column) in SQLITE_SEARCH_INDEXES.items():
+        if table_name != source_table:
+            continue
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": fts_table},
+        ).first()
+        for statement in _sqlite_fts_ddl(fts_table, table_name, column):
+            connection.execute(text(statement))
+        if not exists:
+            connection.execute(
+                text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+            )
+
+
+def _search_index_after_create(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        install_sqlite_search_index(connection, target.name)
+
+
+def _search_index_before_drop(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        for fts_table, (table_name, _) in SQLITE_SEARCH_INDEXES.items():
+            if table_name == target.name:
+                connection.execute(text(f"DROP TABLE IF EXISTS {fts_table}"))
+
+
+for _table in (Visit.__table__, Medicine.__table__):
+    event.listen(_table, "after_create", _search_index_after_create)
+    event.listen(_table, "before_drop", _search_index_before_drop)
+
+
+def ensure_search_indexes():
+    """Создаёт поисковые индексы для уже существующих таблиц (идемпотентно)."""
+    engine = db.engine
+    with engine.begin() as connection:
+        install_patient_name_index(connection)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as connection:
+            for table_name, _ in SQLITE_SEARCH_INDEXES.values():
+                install_sqlite_search_index(connection, table_name)
+    elif engine.dialect.name == "postgresql":
+        try:
+            with engine.begin() as connection:
+                for statement in POSTGRES_SEARCH_DDL:
+                    connection.execute(text(statement))
+        except Exception as e:
+            # Без прав на CREATE EXTENSION поиск работает, но без индекса
+            print(f"⚠️ Search indexes were not created: {e}")
+
+
+class Account(db.Model):
+    """Единый реестр логинов всех ролей.
+
+    Первичный ключ по login гарантирует уникальность логина между админами,
+    врачами и пациентами и позволяет найти учётную запись одним запросом.
+    Строки поддерживаются событиями маппера Admin/Doctor/Patient.
+    """
+
+    __tablename__ = "accounts"
+    login = db.Column(db.String(50), primary_key=True)
+    role = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("role", "user_id", name="unique_account_user"),
+    )
+
+
+# Роль -> модель учётной записи
+ACCOUNT_MODELS = {
+    "admin": Admin,
+    "doctor": Doctor,
+    "patient": Patient,
+}
+
+
+def _account_listeners(role):
+    accounts = Account.__table__
+
+    def after_insert(mapper, connection, target):
+        connection.execute(
+            accounts.insert().values(login=target.login, role=role, user_id=target.id)
+        )
+
+    def after_update(mapper, connection, target):
+        if inspect(target).attrs.login.history.has_changes():
+            connection.execute(
+                accounts.update()
+                .where(accounts.c.role == role, accounts.c.user_id == target.id)
+                .values(login=target.login)
+            )
+
+    def after_delete(mapper, connection, target):
+        connection.execute(
+            accounts.delete().where(
+                accounts.c.role == role, accounts.c.user_id == target.id
+            )
+        )
+
+    return after_insert, after_update, after_delete
+
+
+for _role, _model in ACCOUNT_MODELS.items():
+    _after_insert, _after_update, _after_delete = _account_listeners(_role)
+    event.listen(_model, "after_insert", _after_insert)
+    event.listen(_model, "after_update", _after_update)
+    event.listen(_model, "after_delete", _after_delete)
+
+
+def sync_accounts():
+    """Дозаполняет accounts для записей, созданных до появления реестра.
+
+    Логины, уже занятые другой ролью, пропускаются и выводятся в лог.
+    """
+    accounts = Account.__table__
+    for role, model in ACCOUNT_MODELS.items():
+        missing = select(model.login, literal(role), model.id).where(
+            ~exists().where(accounts.c.login == model.login),
+            ~exists().where(
+                and_(accounts.c.role == role, accounts.c.user_id == model.id)
+            ),
+        )
+        db.session.execute(
+            accounts.insert().from_select(["login", "role", "user_id"], missing)
+        )
+
+        conflicts = (
+            db.session.query(model.login)
+            .join(Account, Account.login == model.login)
+            .filter(Account.role != role)
+            .all()
+        )
+        for (login,) in conflicts:
+            print(f"⚠️ Login {login!r} ({role}) conflicts with another role")
+    db.session.commit()
+
+
+def find_account(login):
+    """Роль, id и хеш пароля по логину — один запрос по первичному ключу accounts."""
+    return db.session.execute(
+        select(
+            Account.role,
+            Account.user_id,
+            Account.login,
+            func.coalesce(
+                Admin.password_hash, Doctor.password_hash, Patient.password_hash
+            ).label("password_hash"),
+        )
+        .select_from(Account)
+        .outerjoin(Admin, and_(Account.role == "admin", Admin.id == Account.user_id))
+        .outerjoin(Doctor, and_(Account.role == "doctor", Doctor.id == Account.user_id))
+        .outerjoin(
+            Patient, and_(Account.role == "patient", Patient.id == Account.user_id)
+        )
+        .where(Account.login == login)
+    ).first()
+
+
+class StatCounter(db.Model):
+    """Счётчики для панели администратора, обновляются инкрементально.
+
+    Каждый счётчик разбит на STAT_COUNTER_SHARDS строк ("visits", "visits#1",
+    ...): значение — их сумма, см. bump_counter.
+    """
+
+    __tablename__ = "stat_counters"
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class VisitDailyStat(db.Model):
+    """Число визитов за день в разрезе врача и диагноза."""
+
+    __tablename__ = "visit_daily_stats"
+    day = db.Column(db.Date, primary_key=True)
+    doctor_id = db.Column(
+        db.Integer, db.ForeignKey("doctors.id", ondelete="CASCADE"), primary_key=True
+    )
+    diagnosis_key = db.Column(db.String(255), primary_key=True)
+    visit_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DiagnosisPatientStat(db.Model):
+    """Сколько визитов с данным диагнозом было у пациента."""
+
+    __tablename__ = "diagnosis_patient_stats"
+    diagnosis_key = db.Column(db.String(255), primary_key=True)
+    patient_id = db.Column(
+        db.Integer, db.ForeignKey("patients.id", ondelete="CASCADE"), primary_key=True
+    )
+    visit_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+def diagnosis_key(diagnosis):
+    """Нормализованный ключ диагноза для агрегатов: регистр и пробелы не важны."""
+    return " ".join((diagnosis or "").lower().split())[:255]
+
+
+# ---------- ИНКРЕМЕНТАЛЬНЫЕ СЧЁТЧИКИ ----------
+
+
+def increment_row(connection, table, keys, column, delta):
+    """Атомарно прибавляет delta к table.column в строке с ключом keys (upsert)."""
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = (
+            insert(table)
+            .values(**keys, **{column: delta})
+            .on_conflict_do_update(
+                index_elements=list(keys),
+                set_={column: table.c[column] + delta},
+            )
+        )
+        connection.execute(stmt)
+        return
+
+    # Прочие СУБД: UPDATE, а если строки ещё нет — INSERT
+    condition = [table.c[key] == value for key, value in keys.items()]
+    result = connection.execute(
+        table.update().where(*condition).values({column: table.c[column] + delta})
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**keys, **{column: delta}))
+
+
+# Параллельные транзакции прибавляют к разным строкам одного счётчика и не
+# ждут блокировку одной строки до коммита
+STAT_COUNTER_SHARDS = int(os.getenv("STAT_COUNTER_SHARDS", 16))
+
+
+def counter_shard_names(name):
+    return [name] + [f"{name}#{shard}" for shard in range(1, STAT_COUNTER_SHARDS)]
+
+
+def counter_base_name(shard_name):
+    return shard_name.split("#", 1)[0]
+
+
+def bump_counter(connection, name, delta):
+    """Прибавляет delta к счётчику name в шарде этого соединения с БД.
+
+    Шард закреплён за соединением: в одной транзакции все изменения счётчика
+    идут в одну строку, и две транзакции не захватывают шарды в разном порядке.
+    """
+    shard = connection.info.setdefault("stat_counter_shard", random.randrange(STAT_COUNTER_SHARDS))
+    shard_name = f"{name}#{shard}" if shard else name
+    increment_row(connection, StatCounter.__table__, {"name": shard_name}, "value", delta)
+
+
+def _sum_counters(names):
+    """{имя: сумма по шардам} для счётчиков names одним запросом."""
+    totals = dict.fromkeys(names, 0)
+    shard_names = [shard for name in names for shard in counter_shard_names(name)]
+    rows = db.session.query(StatCounter.name, StatCounter.value).filter(
+        StatCounter.name.in_(shard_names)
+    )
+    for shard_name, value in rows:
+        totals[counter_base_name(shard_name)] += value
+    return totals
+
+
+# Какие модели учитываются в stat_counters и под каким именем
+COUNTED_MODELS = {
+    "visits": Visit,
+    "patients": Patient,
+    "doctors": Doctor,
+}
+
+
+def _counter_listener(name, delta):
+    def listener(mapper, connection, target):
+        bump_counter(connection, name, delta)
+
+    return listener
+
+
+for _name, _model in COUNTED_MODELS.items():
+    event.listen(_model, "after_insert", _counter_listener(_name, 1))
+    event.listen(_model, "after_delete", _counter_listener(_name, -1))
+
+
+def _apply_visit_stats(connection, visit_date, doctor_id, patient_id, diagnosis, delta):
+    if isinstance(visit_date, datetime):
+        visit_date = visit_date.date()
+    key = diagnosis_key(diagnosis)
+    increment_row(
+        connection,
+        VisitDailyStat.__table__,
+        {"day": visit_date, "doctor_id": doctor_id, "diagnosis_key": key},
+        "visit_count",
+        delta,
+    )
+    increment_row(
+        connection,
+        DiagnosisPatientStat.__table__,
+        {"diagnosis_key": key, "patient_id": patient_id},
+        "visit_count",
+        delta,
+    )
+
+
+_VISIT_STATS_FIELDS = ("date", "doctor_id", "patient_id", "diagnosis")
+
+
+@event.listens_for(Visit, "after_insert")
+def _visit_stats_after_insert(mapper, connection, target):
+    _apply_visit_stats(
+        connection,
+        target.date,
+        target.doctor_id,
+        target.patient_id,
+        target.diagnosis,
+        1,
+    )
+
+
+@event.listens_for(Visit, "after_delete")
+def _visit_stats_after_delete(mapper, connection, target):
+    _apply_visit_stats(
+        connection,
+        target.date,
+        target.doctor_id,
+        target.patient_id,
+        target.diagnosis,
+        -1,
+    )
+
+
+@event.listens_for(Visit, "after_update")
+def _visit_stats_after_update(mapper, connection, target):
+    state = inspect(target)
+    old_values, changed = [], False
+    for field in _VISIT_STATS_FIELDS:
+        history = state.attrs[field].history
+        if history.has_changes():
+            changed = True
+            old_values.append(history.deleted[0] if history.deleted else None)
+        else:
+            old_values.append(getattr(target, field))
+
+    if changed:
+        _apply_visit_stats(connection, *old_values, -1)
+        _apply_visit_stats(
+            connection, *(getattr(target, field) for field in _VISIT_STATS_FIELDS), 1
+        )
+
+
+# Версии данных: растут при любом изменении таблицы и служат для инвалидации
+# кешей в памяти процессов (хранятся в stat_counters под именем "rev:<name>")
+VERSIONED_MODELS = {
+    "visits": Visit,
+    "medicines": Medicine,
+}
+
+
+def data_version_name(name):
+    return f"rev:{name}"
+
+
+def _version_listener(name):
+    def listener(mapper, connection, target):
+        bump_counter(connection, data_version_name(name), 1)
+
+    return listener
+
+
+for _name, _model in VERSIONED_MODELS.items():
+    for _event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event_name, _version_listener(_name))
+
+
+# Версия карточки визита: меняется при правке или удалении любых данных, из
+# которых она собирается. Новые визиты (и лекарства, добавленные вместе с
+# ними) уже закешированные карточки не затрагивают.
+for _model in (Visit, VisitMedicine, Patient, Doctor, Medicine):
+    for _event_name in ("after_update", "after_delete"):
+        event.listen(_model, _event_name, _version_listener("visit_details"))
+
+
+# Версия принципалов: удаление учётной записи отзывает её сессии во всех
+# воркерах (см. auth.load_principal)
+for _model in (Admin, Doctor, Patient):
+    event.listen(_model, "after_delete", _version_listener("principals"))
+
+
+def principals_version():
+    return get_data_versions("principals")["principals"]
+
+
+def get_data_versions(*names):
+    """Текущие версии указанных таблиц одним запросом: {"visits": 12, ...}."""
+    totals = _sum_counters([data_version_name(name) for name in names])
+    return {name: totals[data_version_name(name)] for name in names}
+
+
+def get_counters(with_versions=False):
+    """Все счётчики одним запросом: {"visits": ..., "patients": ..., "doctors": ...}.
+
+    С with_versions=True в тот же словарь попадают версии данных ("rev:...").
+    """
+    names = list(COUNTED_MODELS)
+    if with_versions:
+        names += [
+            data_version_name(name)
+            for name in (*VERSIONED_MODELS, "visit_details")
+        ]
+    return _sum_counters(names)
+
+
+class VisitListVersion(tuple):
+    """(число визитов, последний created_at, версия карточек визитов)."""
+
+    @property
+    def last_created(self):
+        return self[1]
+
+
+def visit_list_version(*criteria):
+    """Версия списка визитов, отобранных criteria, — один агрегирующий запрос.
+
+    Меняется при добавлении и удалении визитов (count, max(created_at)) и при
+    правке данных, показываемых в списке (версия "visit_details").
+    """
+    details_version = (
+        select(cast(func.coalesce(func.sum(StatCounter.value), 0), BigInteger))
+        .where(StatCounter.name.in_(counter_shard_names(data_version_name("visit_details"))))
+        .scalar_subquery()
+    )
+    row = (
+        db.session.query(
+            func.count(Visit.id), func.max(Visit.created_at), details_version
+        )
+        .filter(*criteria)
+        .one()
+    )
+    return VisitListVersion(row)
+
+
+def reconcile_counters():
+    """Пересчитывает счётчики с нуля по реальным таблицам.
+
+    Нужен после массовых операций в обход ORM и каскадных удалений на уровне БД,
+    которые события маппера не видят.
+    """
+    totals = db.session.execute(
+        select(
+            *[
+                select(func.count()).select_from(model).scalar_subquery().label(name)
+                for name, model in COUNTED_MODELS.items()
+            ]
+        )
+    ).one()
+
+    shard_names = [shard for name in COUNTED_MODELS for shard in counter_shard_names(name)]
+    StatCounter.query.filter(StatCounter.name.in_(shard_names)).delete(
+        synchronize_session=False
+    )
+    db.session.add_all(
+        StatCounter(name=name, value=value) for name, value in totals._mapping.items()
+    )
+    db.session.commit()
+    return dict(totals._mapping)
+
+
+def ensure_counters():
+    """Заполняет stat_counters, если таблица ещё пустая."""
+    if not StatCounter.query.filter(StatCounter.name.in_(COUNTED_MODELS)).first():
+        reconcile_counters()
+
+
+def rebuild_visit_stats():
+    """Пересобирает агрегаты визитов (visit_daily_stats, diagnosis_patient_stats).
+
+    Группировка по исходному тексту диагноза выполняется в БД, а нормализация
+    ключа — в Python, так как lower() в SQLite не знает кириллицы.
+    """
+    daily, by_patient = {}, {}
+
+    day_column = func.date(Visit.date)
+    rows = db.session.query(
+        day_column, Visit.doctor_id, Visit.diagnosis, func.count()
+    ).group_by(day_column, Visit.doctor_id, Visit.diagnosis)
+    for day, doctor_id, diagnosis, count in rows:
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        key = (day, doctor_id, diagnosis_key(diagnosis))
+        daily[key] = daily.get(key, 0) + count
+
+    rows = db.session.query(
+        Visit.diagnosis, Visit.patient_id, func.count()
+    ).group_by(Visit.diagnosis, Visit.patient_id)
+    for diagnosis, patient_id, count in rows:
+        key = (diagnosis_key(diagnosis), patient_id)
+        by_patient[key] = by_patient.get(key, 0) + count
+
+    VisitDailyStat.query.delete(synchronize_session=False)
+    DiagnosisPatientStat.query.delete(synchronize_session=False)
+    if daily:
+        db.session.execute(
+            VisitDailyStat.__table__.insert(),
+            [
+                {"day": d, "doctor_id": doc, "diagnosis_key": k, "visit_count": c}
+                for (d, doc, k), c in daily.items()
+            ],
+        )
+    if by_patient:
+        db.session.execute(
+            DiagnosisPatientStat.__table__.insert(),
+            [
+                {"diagnosis_key": k, "patient_id": p, "visit_count": c}
+                for (k, p), c in by_patient.items()
+            ],
+        )
+    db.session.commit()
+    return {"visit_daily_stats": len(daily), "diagnosis_patient_stats": len(by_patient)}
+
+
+def ensure_visit_stats():
+    """Собирает агрегаты визитов, если они ещё не построены."""
+    if not VisitDailyStat.query.first() and Visit.query.first():
+        rebuild_visit_stats()
+
+
 class User(UserMixin):
     def __init__(self, id, login, role):
         self.id = id
@@ -130,709 +779,39 @@ class User(UserMixin):
             print(f"Error loading user: {e}")
             return None
 
+    @staticmethod
+    def _upgrade_password_hash(account, password):
+        """Перехеширует пароль текущим KDF после успешного входа."""
+        try:
+            model = ACCOUNT_MODELS[account.role]
+            new_hash = password_pool.run(hash_password, password)
+            model.query.filter_by(id=account.user_id).update(
+                {"password_hash": new_hash}, synchronize_session=False
+            )
+            db.session.commit()
+        except Exception as e:
+            # Вход не должен падать из-за неудачного обновления хеша
+            db.session.rollback()
+            print(f"Password hash upgrade failed: {e}")
+
     @staticmethod
     def authenticate(login, password):
         try:
-            entered_hash = hashlib.sha256(password.encode("utf-8")).hexdigest()
-
-            # Проверяем во всех таблицах
-            for role, model in [
-                ("admin", Admin),
-                ("doctor", Doctor),
-                ("patient", Patient),
-            ]:
-                user = model.query.filter_by(login=login).first()
-                if user and user.password_hash == entered_hash:
-                    return User(user.id, user.login, role)
-            return None
+            # Один запрос к реестру accounts вместо проверки трёх таблиц
+            account = find_account(login)
+
+            # KDF считается в ограниченном пуле; для несуществующего логина
+            # тоже, чтобы время ответа не выдавало наличие учётной записи
+            stored_hash = account.password_hash if account else dummy_password_hash()
+            ok, needs_upgrade = password_pool.run(verify_password, password, stored_hash)
+            if not (account and ok):
+                return None
+
+            if needs_upgrade:
+                User._upgrade_password_hash(account, password)
+            return User(account.user_id, account.login, account.role)
+        except PasswordPoolBusy:
+            raise
         except Exception as e:
             print(f"Authentication error: {e}")
             return None
-
-
-# ---------- ИНИЦИАЛИЗАЦИЯ И ЗАПОЛНЕНИЕ БД ----------
-
-
-def populate_db():
-    """Заполняет базу тестовыми данными, если таблицы пустые."""
-    try:
-        # Проверяем и добавляем администраторов
-        if not Admin.query.first():
-            admins = [
-                Admin(
-                    login="admin",
-                    password_hash=hashlib.sha256("admin123".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin2",
-                    password_hash=hashlib.sha256("admin456".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin3",
-                    password_hash=hashlib.sha256("admin789".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin4",
-                    password_hash=hashlib.sha256("admin000".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin5",
-                    password_hash=hashlib.sha256("admin111".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin6",
-                    password_hash=hashlib.sha256("admin222".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin7",
-                    password_hash=hashlib.sha256("admin333".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin8",
-                    password_hash=hashlib.sha256("admin444".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin9",
-                    password_hash=hashlib.sha256("admin555".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin10",
-                    password_hash=hashlib.sha256("admin666".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin11",
-                    password_hash=hashlib.sha256("admin777".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin12",
-                    password_hash=hashlib.sha256("admin888".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin13",
-                    password_hash=hashlib.sha256("admin999".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin14",
-                    password_hash=hashlib.sha256("admin001".encode()).hexdigest(),
-                ),
-                Admin(
-                    login="admin15",
-                    password_hash=hashlib.sha256("admin002".encode()).hexdigest(),
-                ),
-            ]
-            db.session.add_all(admins)
-            print("✅ Admins added")
-
-        # Проверяем и добавляем пациентов
-        if not Patient.query.first():
-            patients = [
-                Patient(
-                    first_name="Ivan",
-                    last_name="Ivanov",
-                    gender="M",
-                    date_of_birth=datetime(1985, 3, 15),
-                    address="10 Lenin St, Apt 5",
-                    login="ivanov",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Maria",
-                    last_name="Petrova",
-                    gender="F",
-                    date_of_birth=datetime(1990, 7, 22),
-                    address="25 Pushkin St, Apt 12",
-                    login="petrova",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Alexey",
-                    last_name="Sidorov",
-                    gender="M",
-                    date_of_birth=datetime(1978, 11, 3),
-                    address="7 Gagarin St, Apt 33",
-                    login="sidorov",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Elena",
-                    last_name="Kuznetsova",
-                    gender="F",
-                    date_of_birth=datetime(1982, 5, 18),
-                    address="15 Sovetskaya St, Apt 8",
-                    login="kuznetsova",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Dmitry",
-                    last_name="Popov",
-                    gender="M",
-                    date_of_birth=datetime(1995, 9, 30),
-                    address="3 Mira St, Apt 17",
-                    login="popov",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Olga",
-                    last_name="Vasilieva",
-                    gender="F",
-                    date_of_birth=datetime(1988, 12, 12),
-                    address="21 Sadovaya St, Apt 9",
-                    login="vasilieva",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Sergey",
-                    last_name="Smirnov",
-                    gender="M",
-                    date_of_birth=datetime(1975, 2, 28),
-                    address="45 Tsentralnaya St, Apt 22",
-                    login="smirnov",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Natalia",
-                    last_name="Novikova",
-                    gender="F",
-                    date_of_birth=datetime(1992, 6, 7),
-                    address="12 Lesnaya St, Apt 4",
-                    login="novikova",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Andrey",
-                    last_name="Fedorov",
-                    gender="M",
-                    date_of_birth=datetime(1980, 8, 14),
-                    address="8 Shkolnaya St, Apt 11",
-                    login="fedorov",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Tatyana",
-                    last_name="Morozova",
-                    gender="F",
-                    date_of_birth=datetime(1987, 1, 25),
-                    address="17 Zarechnaya St, Apt 6",
-                    login="morozova",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Pavel",
-                    last_name="Volkov",
-                    gender="M",
-                    date_of_birth=datetime(1993, 4, 9),
-                    address="5 Parkovaya St, Apt 14",
-                    login="volkov",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Yulia",
-                    last_name="Alekseeva",
-                    gender="F",
-                    date_of_birth=datetime(1984, 10, 17),
-                    address="11 Solnechnaya St, Apt 7",
-                    login="alekseeva",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Anton",
-                    last_name="Lebedev",
-                    gender="M",
-                    date_of_birth=datetime(1979, 7, 3),
-                    address="9 Naberezhnaya St, Apt 19",
-                    login="lebedev",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Irina",
-                    last_name="Semenova",
-                    gender="F",
-                    date_of_birth=datetime(1991, 3, 28),
-                    address="14 Yubileynaya St, Apt 10",
-                    login="semenova",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-                Patient(
-                    first_name="Maxim",
-                    last_name="Egorov",
-                    gender="M",
-                    date_of_birth=datetime(1986, 11, 11),
-                    address="6 Rabochaya St, Apt 13",
-                    login="egorov",
-                    password_hash=hashlib.sha256("password123".encode()).hexdigest(),
-                ),
-            ]
-            db.session.add_all(patients)
-            print("✅ Patients added")
-
-        # Проверяем и добавляем врачей
-        if not Doctor.query.first():
-            doctors = [
-                Doctor(
-                    first_name="Alexander",
-                    middle_name="Sergeevich",
-                    last_name="Belov",
-                    position="Therapist",
-                    login="belov",
-                    phone="89897650467",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Ekaterina",
-                    middle_name="Andreevna",
-                    last_name="Kozlova",
-                    position="Surgeon",
-                    login="kozlova",
-                    phone="89897650448",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Mikhail",
-                    middle_name="Petrovich",
-                    last_name="Orlov",
-                    position="Cardiologist",
-                    login="orlov",
-                    phone="+7-989-000-01-03",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Svetlana",
-                    middle_name="Valeryevna",
-                    last_name="Andreeva",
-                    position="Neurologist",
-                    login="andreeva",
-                    phone="+7-989-000-01-04",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Artem",
-                    middle_name="Olegovich",
-                    last_name="Makarov",
-                    position="Ophthalmologist",
-                    login="makarov",
-                    phone="+7-989-000-01-05",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Nadezhda",
-                    middle_name="Viktorovna",
-                    last_name="Zakharova",
-                    position="ENT Specialist",
-                    login="zakharova",
-                    phone="+7-989-000-01-06",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Vladimir",
-                    middle_name="Ivanovich",
-                    last_name="Sokolov",
-                    position="Endocrinologist",
-                    login="sokolov",
-                    phone="+7-989-000-01-07",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Oksana",
-                    middle_name="Nikolaevna",
-                    last_name="Pavlova",
-                    position="Gastroenterologist",
-                    login="pavlova",
-                    phone="+7-989-000-01-08",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Grigory",
-                    middle_name="Yaroslavovich",
-                    last_name="Stepanov",
-                    position="Urologist",
-                    login="stepanov",
-                    phone="+7-989-000-01-09",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Lyudmila",
-                    middle_name="Alekseevna",
-                    last_name="Nikolaeva",
-                    position="Gynecologist",
-                    login="nikolaeva",
-                    phone="+7-989-000-01-10",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Stanislav",
-                    middle_name="Denisovich",
-                    last_name="Ivanov",
-                    position="Pediatrician",
-                    login="ivanov_doc",
-                    phone="+7-989-000-01-11",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Victoria",
-                    middle_name="Evgenievna",
-                    last_name="Dmitrieva",
-                    position="Dermatologist",
-                    login="dmitrieva",
-                    phone="+7-989-000-01-12",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Roman",
-                    middle_name="Maximovich",
-                    last_name="Kuznetsov",
-                    position="Oncologist",
-                    login="kuznetsov_doc",
-                    phone="+7-989-000-01-13",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Anastasia",
-                    middle_name="Romanovna",
-                    last_name="Soloveva",
-                    position="Psychiatrist",
-                    login="soloveva",
-                    phone="+7-989-000-01-14",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-                Doctor(
-                    first_name="Konstantin",
-                    middle_name="Mikhailovich",
-                    last_name="Vasiliev",
-                    position="Traumatologist",
-                    login="vasiliev_doc",
-                    phone="+7-989-000-01-15",
-                    password_hash=hashlib.sha256("doctor123".encode()).hexdigest(),
-                ),
-            ]
-            db.session.add_all(doctors)
-            print("✅ Doctors added")
-
-        # Проверяем и добавляем лекарства
-        if not Medicine.query.first():
-            medicines = [
-                Medicine(
-                    name="Paracetamol",
-                    description="Painkiller and fever reducer",
-                    side_effects="Nausea, abdominal pain, allergic reactions",
-                    usage_method="1 tablet 3-4 times a day after meals",
-                ),
-                Medicine(
-                    name="Ibuprofen",
-                    description="Non-steroidal anti-inflammatory drug",
-                    side_effects="Headache, dizziness, nausea, heartburn",
-                    usage_method="1 tablet 3 times a day during meals",
-                ),
-                Medicine(
-                    name="Amoxicillin",
-                    description="Broad-spectrum antibiotic",
-                    side_effects="Nausea, diarrhea, allergic reactions",
-                    usage_method="1 tablet 3 times a day for 7-10 days",
-                ),
-                Medicine(
-                    name="Aspirin",
-                    description="Painkiller, fever reducer, anti-inflammatory",
-                    side_effects="Stomach irritation, bleeding",
-                    usage_method="1 tablet 2-3 times a day after meals",
-                ),
-                Medicine(
-                    name="Loratadine",
-                    description="Antiallergic drug",
-                    side_effects="Headache, drowsiness, dry mouth",
-                    usage_method="1 tablet once a day",
-                ),
-                Medicine(
-                    name="Omeprazole",
-                    description="Reduces stomach acid",
-                    side_effects="Nausea, constipation, headache",
-                    usage_method="1 capsule once a day in the morning on empty stomach",
-                ),
-                Medicine(
-                    name="Metformin",
-                    description="Antidiabetic drug",
-                    side_effects="Nausea, diarrhea, metallic taste",
-                    usage_method="1 tablet 2-3 times a day with meals",
-                ),
-                Medicine(
-                    name="Atorvastatin",
-                    description="Reduces cholesterol",
-                    side_effects="Headache, muscle pain, nausea",
-                    usage_method="1 tablet once a day in the evening",
-                ),
-                Medicine(
-                    name="Amlodipine",
-                    description="Lowers blood pressure",
-                    side_effects="Headache, leg swelling, dizziness",
-                    usage_method="1 tablet once a day",
-                ),
-                Medicine(
-                    name="Salbutamol",
-                    description="Bronchodilator",
-                    side_effects="Rapid heartbeat, tremor, headache",
-                    usage_method="Inhale 1-2 puffs as needed",
-                ),
-                Medicine(
-                    name="Cetirizine",
-                    description="Antiallergic drug",
-                    side_effects="Drowsiness, dry mouth, fatigue",
-                    usage_method="1 tablet once a day",
-                ),
-                Medicine(
-                    name="Diclofenac",
-                    description="Non-steroidal anti-inflammatory drug",
-                    side_effects="Stomach pain, nausea, dizziness",
-                    usage_method="1 tablet 2-3 times a day after meals",
-                ),
-                Medicine(
-                    name="Enalapril",
-                    description="Lowers blood pressure",
-                    side_effects="Dizziness, cough, fatigue",
-                    usage_method="1 tablet 1-2 times a day",
-                ),
-                Medicine(
-                    name="Fluoxetine",
-                    description="Antidepressant",
-                    side_effects="Nausea, insomnia, headache",
-                    usage_method="1 capsule once a day in the morning",
-                ),
-                Medicine(
-                    name="Warfarin",
-                    description="Anticoagulant",
-                    side_effects="Bleeding, bruising",
-                    usage_method="1 tablet once a day under INR monitoring",
-                ),
-            ]
-            db.session.add_all(medicines)
-            print("✅ Medicines added")
-
-        # Проверяем и добавляем визиты
-        if not Visit.query.first():
-            visits = [
-                Visit(
-                    patient_id=1,
-                    doctor_id=1,
-                    date=datetime(2024, 1, 15, 9, 0, 0),
-                    location="Office 101",
-                    symptoms="Headache, temperature 37.5",
-                    diagnosis="Acute respiratory infection",
-                    prescriptions="Bed rest, plenty of fluids",
-                ),
-                Visit(
-                    patient_id=2,
-                    doctor_id=2,
-                    date=datetime(2024, 1, 15, 10, 30, 0),
-                    location="Office 102",
-                    symptoms="Acute abdominal pain, nausea",
-                    diagnosis="Acute appendicitis",
-                    prescriptions="Immediate hospitalization",
-                ),
-                Visit(
-                    patient_id=3,
-                    doctor_id=3,
-                    date=datetime(2024, 1, 16, 11, 0, 0),
-                    location="Office 103",
-                    symptoms="Chest pain, shortness of breath",
-                    diagnosis="Angina",
-                    prescriptions="Limit physical activity",
-                ),
-                Visit(
-                    patient_id=4,
-                    doctor_id=4,
-                    date=datetime(2024, 1, 16, 14, 0, 0),
-                    location="Office 104",
-                    symptoms="Dizziness, numbness in arm",
-                    diagnosis="Cerebral circulatory disorder",
-                    prescriptions="Inpatient treatment",
-                ),
-                Visit(
-                    patient_id=5,
-                    doctor_id=5,
-                    date=datetime(2024, 1, 17, 9, 30, 0),
-                    location="Office 105",
-                    symptoms="Vision deterioration, eye pain",
-                    diagnosis="Glaucoma",
-                    prescriptions="Eye drops, IOP monitoring",
-                ),
-                Visit(
-                    patient_id=6,
-                    doctor_id=6,
-                    date=datetime(2024, 1, 17, 11, 15, 0),
-                    location="Office 106",
-                    symptoms="Sore throat, nasal congestion",
-                    diagnosis="Acute pharyngitis",
-                    prescriptions="Gargle, inhalation",
-                ),
-                Visit(
-                    patient_id=7,
-                    doctor_id=7,
-                    date=datetime(2024, 1, 18, 10, 0, 0),
-                    location="Office 107",
-                    symptoms="Thirst, frequent urination",
-                    diagnosis="Type 2 diabetes",
-                    prescriptions="Diet, hypoglycemic drugs",
-                ),
-                Visit(
-                    patient_id=8,
-                    doctor_id=8,
-                    date=datetime(2024, 1, 18, 15, 30, 0),
-                    location="Office 108",
-                    symptoms="Epigastric pain, heartburn",
-                    diagnosis="Gastritis",
-                    prescriptions="Diet, antacids",
-                ),
-                Visit(
-                    patient_id=9,
-                    doctor_id=9,
-                    date=datetime(2024, 1, 19, 9, 45, 0),
-                    location="Office 109",
-                    symptoms="Pain during urination",
-                    diagnosis="Cystitis",
-                    prescriptions="Antibiotics, plenty of fluids",
-                ),
-                Visit(
-                    patient_id=10,
-                    doctor_id=10,
-                    date=datetime(2024, 1, 19, 13, 20, 0),
-                    location="Office 110",
-                    symptoms="Menstrual cycle disorder",
-                    diagnosis="Ovarian dysfunction",
-                    prescriptions="Hormone therapy",
-                ),
-                Visit(
-                    patient_id=11,
-                    doctor_id=11,
-                    date=datetime(2024, 1, 20, 10, 10, 0),
-                    location="Office 111",
-                    symptoms="High fever, cough",
-                    diagnosis="Pneumonia",
-                    prescriptions="Antibiotics, bed rest",
-                ),
-                Visit(
-                    patient_id=12,
-                    doctor_id=12,
-                    date=datetime(2024, 1, 20, 14, 45, 0),
-                    location="Office 112",
-                    symptoms="Skin rash, itching",
-                    diagnosis="Allergic dermatitis",
-                    prescriptions="Antihistamines",
-                ),
-                Visit(
-                    patient_id=13,
-                    doctor_id=13,
-                    date=datetime(2024, 1, 21, 11, 30, 0),
-                    location="Office 113",
-                    symptoms="Breast lump",
-                    diagnosis="Fibroadenoma",
-                    prescriptions="Ultrasound, oncologist consultation",
-                ),
-                Visit(
-                    patient_id=14,
-                    doctor_id=14,
-                    date=datetime(2024, 1, 21, 16, 0, 0),
-                    location="Office 114",
-                    symptoms="Anxiety, insomnia",
-                    diagnosis="Anxiety disorder",
-                    prescriptions="Psychotherapy, sedatives",
-                ),
-                Visit(
-                    patient_id=15,
-                    doctor_id=15,
-                    date=datetime(2024, 1, 22, 9, 15, 0),
-                    location="Office 115",
-                    symptoms="Knee pain after injury",
-                    diagnosis="Ligament sprain",
-                    prescriptions="Rest, ice, elevation",
-                ),
-            ]
-            db.session.add_all(visits)
-            print("✅ Visits added")
-
-        # Проверяем и добавляем связи визитов с лекарствами
-        if not VisitMedicine.query.first():
-            visit_medicines = [
-                VisitMedicine(
-                    visit_id=1,
-                    medicine_id=1,
-                    doctor_instructions="Take if temperature exceeds 38 degrees",
-                ),
-                VisitMedicine(
-                    visit_id=1,
-                    medicine_id=2,
-                    doctor_instructions="Take for severe headache",
-                ),
-                VisitMedicine(
-                    visit_id=2,
-                    medicine_id=3,
-                    doctor_instructions="7-day course after surgery",
-                ),
-                VisitMedicine(
-                    visit_id=3,
-                    medicine_id=8,
-                    doctor_instructions="Take regularly, monitor cholesterol",
-                ),
-                VisitMedicine(
-                    visit_id=3,
-                    medicine_id=9,
-                    doctor_instructions="Take daily, monitor blood pressure",
-                ),
-                VisitMedicine(
-                    visit_id=4,
-                    medicine_id=13,
-                    doctor_instructions="Take morning and evening, monitor BP",
-                ),
-                VisitMedicine(
-                    visit_id=5,
-                    medicine_id=6,
-                    doctor_instructions="1 drop in each eye twice a day",
-                ),
-                VisitMedicine(
-                    visit_id=6,
-                    medicine_id=5,
-                    doctor_instructions="Take once a day for allergy",
-                ),
-                VisitMedicine(
-                    visit_id=7,
-                    medicine_id=7,
-                    doctor_instructions="Take twice a day with meals",
-                ),
-                VisitMedicine(
-                    visit_id=8,
-                    medicine_id=6,
-                    doctor_instructions="Take 30 minutes before meals",
-                ),
-                VisitMedicine(
-                    visit_id=9,
-                    medicine_id=3,
-                    doctor_instructions="5-day course, drink plenty of water",
-                ),
-                VisitMedicine(
-                    visit_id=10,
-                    medicine_id=14,
-                    doctor_instructions="Take in the morning, do not skip",
-                ),
-                VisitMedicine(
-                    visit_id=11,
-                    medicine_id=3,
-                    doctor_instructions="10-day course, do not stop early",
-                ),
-                VisitMedicine(
-                    visit_id=12,
-                    medicine_id=5,
-                    doctor_instructions="Take once a day until symptoms disappear",
-                ),
-                VisitMedicine(
-                    visit_id=13,
-                    medicine_id=15,
-                    doctor_instructions="Take at the same time daily, monitor INR",
-                ),
-            ]
-            db.session.add_all(visit_medicines)
-            print("✅ Visit medicines added")
-
-        # Фиксируем все изменения
-        db.session.commit()
-        print("✅ Database populated successfully!")
-
-    except Exception as e:
-        db.session.rollback()
-        print(f"❌ Error populating database: {e}")
-        raise
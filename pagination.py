@@ -0,0 +1,29 @@
+import base64
+import binascii
+
+
+def encode_cursor(*parts):
+    """Кодирует значения ключа пагинации в непрозрачную строку-курсор."""
+    raw = "|".join(str(part) for part in parts)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    """Раскодирует курсор обратно в список строк. ValueError при ошибке."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError("Некорректный курсор") from e
+
+    parts = raw.split("|")
+    if len(parts) != size:
+        raise ValueError("Некорректный курсор")
+    return parts
+
+
+def clamp_limit(value, default, maximum):
+    """Размер страницы из запроса, ограниченный диапазоном 1..maximum."""
+    if value is None:
+        return default
+    return min(max(value, 1), maximum)
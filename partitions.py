@@ -0,0 +1,110 @@
+import os
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from models import db
+
+# Помесячное секционирование visits и visit_medicines в Postgres (включается
+# миграцией alembic a7e4c1d9f203 с -x partition_visits=1). Назначения лежат в
+# секции того же месяца, что и визит: ключ — visit_medicines.visit_date.
+#
+# Лишние секции отсекаются только в запросах с границами по дате: выгрузка и
+# поиск с диапазоном, курсор ленты визитов. Кабинеты врача и пациента и первая
+# страница ленты дат не ограничивают и читают индекс каждой секции.
+PARTITIONED_TABLES = {
+    "visits": "date",
+    "visit_medicines": "visit_date",
+}
+
+# На сколько месяцев вперёд держать готовые секции
+VISIT_PARTITION_MONTHS_AHEAD = int(os.getenv("VISIT_PARTITION_MONTHS_AHEAD", 3))
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def month_starts(first, last):
+    """Первые числа месяцев от first до last включительно."""
+    month, last = month_start(first), month_start(last)
+    months = []
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def partition_name(table, month):
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def is_partitioned(connection, table="visits"):
+    if connection.dialect.name != "postgresql":
+        return False
+    return bool(connection.execute(
+        text(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"
+        ),
+        {"table": table},
+    ).first())
+
+
+def create_month_partitions(connection, months):
+    """Создаёт недостающие месячные секции обеих таблиц, возвращает их имена.
+
+    Месяц, строки которого уже попали в секцию DEFAULT, пропускается: Postgres
+    не даст создать секцию поверх них, а перенос строк каскадом удалил бы
+    назначения. Такие строки остаются в DEFAULT и просто хуже отсекаются.
+    """
+    created = []
+    for month in months:
+        bounds = {"lo": month, "hi": next_month(month)}
+        in_default = connection.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM visits_default "
+                "WHERE date >= :lo AND date < :hi)"
+            ),
+            bounds,
+        ).scalar()
+        if in_default:
+            print(f"⚠️ Визиты за {month:%Y-%m} уже в visits_default, секция не создана")
+            continue
+        for table, column in PARTITIONED_TABLES.items():
+            name = partition_name(table, month)
+            exists = connection.execute(
+                text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}
+            ).scalar()
+            if exists:
+                continue
+            connection.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{bounds['lo']}') TO ('{bounds['hi']}')"
+            ))
+            created.append(name)
+    return created
+
+
+def ensure_visit_partitions(months_ahead=VISIT_PARTITION_MONTHS_AHEAD, today=None):
+    """Секции на текущий месяц и months_ahead вперёд (идемпотентно).
+
+    Без секционирования (SQLite, Postgres без миграции) ничего не делает.
+    """
+    engine = db.engine
+    if engine.dialect.name != "postgresql":
+        return []
+    today = today or datetime.utcnow().date()
+    last = today
+    for _ in range(months_ahead):
+        last = next_month(month_start(last))
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return []
+        # Два процесса (воркеры, cron) не создают одну секцию одновременно
+        connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('visit_partitions'))"))
+        return create_month_partitions(connection, month_starts(today, last))
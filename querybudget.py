@@ -0,0 +1,89 @@
+import os
+from collections import Counter, defaultdict
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Бюджет SQL-запросов на HTTP-запрос и поиск N+1: один и тот же SQL,
+# выполненный за запрос со многими разными параметрами (обычно ленивая
+# загрузка в цикле). Повтор с теми же параметрами — не N+1, он считается
+# только в общий бюджет.
+# В тестах нарушение — исключение, в работе — предупреждение в лог.
+# QUERY_BUDGET_RAISE в конфиге приложения переопределяет поведение.
+QUERY_BUDGET_DEFAULT = int(os.getenv("QUERY_BUDGET_DEFAULT", 30))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def query_budget(max_queries=QUERY_BUDGET_DEFAULT, n_plus_one=True):
+    """Бюджет маршрута: не больше max_queries SQL за запрос.
+
+    max_queries=None снимает ограничение; n_plus_one=False отключает поиск
+    повторов (пакетная обработка, где одинаковые запросы идут по пачкам).
+    """
+
+    def decorator(view):
+        view.query_budget = (max_queries, n_plus_one)
+        return view
+
+    return decorator
+
+
+def _route_budget():
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, "query_budget", (QUERY_BUDGET_DEFAULT, True))
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "query_log" in g:
+        g.query_log[statement][repr(parameters)] += 1
+
+
+def check_query_budget(query_log, max_queries, n_plus_one):
+    """Список нарушений для запросов query_log.
+
+    query_log — {SQL: Counter({параметры: сколько раз})}.
+    """
+    problems = []
+    total = sum(sum(runs.values()) for runs in query_log.values())
+    if max_queries is not None and total > max_queries:
+        problems.append(f"{total} SQL-запросов при бюджете {max_queries}")
+    if n_plus_one:
+        repeated = sorted(
+            ((len(runs), statement) for statement, runs in query_log.items()),
+            key=lambda item: item[0],
+            reverse=True,
+        )
+        for distinct, statement in repeated:
+            if distinct < N_PLUS_ONE_THRESHOLD:
+                break
+            problems.append(f"N+1: {distinct}× {' '.join(statement.split())[:200]}")
+    return problems
+
+
+def init_query_budget(app):
+    @app.before_request
+    def _start_query_log():
+        g.query_log = defaultdict(Counter)
+
+    @app.after_request
+    def _enforce_query_budget(response):
+        query_log = g.pop("query_log", None)
+        if query_log is None or request.endpoint is None:
+            return response
+        max_queries, n_plus_one = _route_budget()
+        problems = check_query_budget(query_log, max_queries, n_plus_one)
+        if problems:
+            message = (
+                f"{request.method} {request.path} ({request.endpoint}): "
+                + "; ".join(problems)
+            )
+            if app.config.get("QUERY_BUDGET_RAISE", app.testing):
+                raise QueryBudgetExceeded(message)
+            print(f"⚠️ Бюджет запросов превышен — {message}")
+        return response
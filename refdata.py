@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import db, Doctor, Medicine
+
+# Снимок справочников (лекарства, врачи) общий для всех воркеров gunicorn
+# на хосте: JSON-файл в REFDATA_CACHE_DIR. Файл поколения хранит случайный
+# токен; запись в справочники меняет токен, и все воркеры перечитывают снимок.
+REFDATA_CACHE_DIR = os.environ.get("REFDATA_CACHE_DIR") or os.path.join(
+    tempfile.gettempdir(), "medical_clinic_refdata"
+)
+
+# Страховка от изменений в обход приложения (другой хост, ручной SQL):
+# снимок старше этого возраста строится заново
+REFDATA_MAX_AGE = float(os.environ.get("REFDATA_MAX_AGE", 300))
+
+MEDICINE_FIELDS = ("id", "name", "description", "side_effects", "usage_method", "created_at")
+DOCTOR_FIELDS = (
+    "id",
+    "first_name",
+    "middle_name",
+    "last_name",
+    "position",
+    "login",
+    "phone",
+    "created_at",
+)
+
+_lock = threading.Lock()
+# Разобранный снимок текущего поколения в памяти воркера
+_local = {
+    "generation": None,
+    "built_at": 0.0,
+    "medicines": [],
+    "medicine_ids": frozenset(),
+    "doctors": [],
+}
+
+
+def _namespace():
+    # Разные БД на одном хосте (тесты, несколько стендов) не делят снимок
+    return hashlib.sha1(str(db.engine.url).encode()).hexdigest()[:12]
+
+
+def _generation_path():
+    return os.path.join(REFDATA_CACHE_DIR, f"{_namespace()}.generation")
+
+
+def _snapshot_path(generation):
+    return os.path.join(REFDATA_CACHE_DIR, f"{_namespace()}-{generation}.json")
+
+
+def _write_atomic(path, data):
+    os.makedirs(REFDATA_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=REFDATA_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _save_snapshot(generation, snapshot):
+    path = _snapshot_path(generation)
+    try:
+        _write_atomic(path, json.dumps(snapshot, ensure_ascii=False))
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить снимок справочников: {e}")
+        return
+    # Поколение сменилось во время записи: invalidate_refdata файл уже не
+    # удалит, а читать его никто не будет
+    if _read_generation() != generation:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _read_generation():
+    try:
+        with open(_generation_path(), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _rows(model, fields, order_by):
+    columns = [getattr(model, field) for field in fields]
+    # Только основная БД: снимок с отстающей реплики прожил бы под новым
+    # поколением до REFDATA_MAX_AGE
+    rows = db.session.execute(
+        select(*columns).order_by(*order_by), bind_arguments={"bind": db.engine}
+    )
+    return [
+        {
+            field: value.isoformat() if isinstance(value, datetime) else value
+            for field, value in zip(fields, row)
+        }
+        for row in rows
+    ]
+
+
+def _load_snapshot():
+    return {
+        "built_at": time.time(),
+        "medicines": _rows(Medicine, MEDICINE_FIELDS, (Medicine.name,)),
+        "doctors": _rows(
+            Doctor, DOCTOR_FIELDS, (Doctor.last_name, Doctor.first_name, Doctor.id)
+        ),
+    }
+
+
+def _to_objects(items):
+    objects = []
+    for item in items:
+        if item.get("created_at"):
+            item["created_at"] = datetime.fromisoformat(item["created_at"])
+        objects.append(SimpleNamespace(**item))
+    return objects
+
+
+def _refresh():
+    generation = _read_generation()
+    if (
+        generation is not None
+        and generation == _local["generation"]
+        and time.time() - _local["built_at"] < REFDATA_MAX_AGE
+    ):
+        return
+
+    with _lock:
+        generation = _read_generation()
+        if generation is None:
+            generation = invalidate_refdata()
+
+        snapshot = None
+        if generation is not None:
+            try:
+                with open(_snapshot_path(generation), encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                snapshot = None
+        if snapshot is not None and time.time() - snapshot["built_at"] >= REFDATA_MAX_AGE:
+            snapshot = None
+
+        if snapshot is None:
+            # Поколение читаем до запроса к БД: если справочник изменится во
+            # время построения, токен сменится и этот снимок никто не прочтёт
+            snapshot = _load_snapshot()
+            if generation is not None and _read_generation() == generation:
+                _save_snapshot(generation, snapshot)
+
+        medicines = _to_objects(snapshot["medicines"])
+        _local.update(
+            generation=generation,
+            built_at=snapshot["built_at"],
+            medicines=medicines,
+            medicine_ids=frozenset(medicine.id for medicine in medicines),
+            doctors=_to_objects(snapshot["doctors"]),
+        )
+
+
+def refdata_version():
+    """Токен текущего поколения справочников (для ETag и ключей кеша)."""
+    _refresh()
+    return _local["generation"]
+
+
+def get_medicines():
+    """Лекарства по названию; в устойчивом состоянии без обращения к БД."""
+    _refresh()
+    return _local["medicines"]
+
+
+def get_medicine_ids():
+    """Множество id лекарств — проверка назначений без запроса к БД."""
+    _refresh()
+    return _local["medicine_ids"]
+
+
+def get_doctors():
+    """Врачи по фамилии и имени; в устойчивом состоянии без обращения к БД."""
+    _refresh()
+    return _local["doctors"]
+
+
+def invalidate_refdata():
+    """Новое поколение справочников для всех воркеров. Возвращает токен."""
+    old_generation = _read_generation()
+    generation = uuid.uuid4().hex
+    try:
+        _write_atomic(_generation_path(), generation)
+    except OSError as e:
+        print(f"⚠️ Не удалось обновить поколение справочников: {e}")
+        generation = None
+    if old_generation:
+        try:
+            os.unlink(_snapshot_path(old_generation))
+        except OSError:
+            pass
+    _local["generation"] = None
+    return generation
+
+
+# ---------- ИНВАЛИДАЦИЯ ПРИ ЗАПИСИ ----------
+
+
+def _mark_stale(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["stale_refdata"] = True
+
+
+for _model in (Medicine, Doctor):
+    for _event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event_name, _mark_stale)
+    # Таблица пересоздана (тесты, восстановление из дампа) — снимок не годится
+    for _event_name in ("after_create", "after_drop"):
+        event.listen(
+            _model.__table__, _event_name, lambda *args, **kw: invalidate_refdata()
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("stale_refdata", False):
+        invalidate_refdata()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("stale_refdata", None)
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+
+from flask import current_app, has_request_context, request, session
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# Чтение с реплики: GET/HEAD-запросы и маршруты с @read_only читают из
+# DATABASE_READ_URL (bind "replica"), запись и всё остальное идёт в основную
+# БД. После записи пользователь REPLICA_STICKY_SECONDS читает из основной БД,
+# чтобы увидеть свои изменения, пока они доезжают до реплики.
+REPLICA_BIND = "replica"
+READ_METHODS = ("GET", "HEAD")
+
+# Отставание реплики (с), после которого чтение уходит в основную БД
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 5))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 10))
+# Как часто проверять доступность и отставание реплики (на процесс)
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 5))
+
+STICKY_SESSION_KEY = "_db_primary_until"
+
+# Отставание считается нулевым, если всё полученное WAL уже применено:
+# иначе при простое основной БД pg_last_xact_replay_timestamp() «стареет»
+POSTGRES_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+_lock = threading.Lock()
+_state = {"checked_at": None, "healthy": False, "lag": None}
+_watched_engines = set()
+
+
+def get_replica_engine():
+    """Engine реплики или None, если DATABASE_READ_URL не задан."""
+    engine = current_app.extensions["sqlalchemy"].engines.get(REPLICA_BIND)
+    if engine is not None and id(engine) not in _watched_engines:
+        event.listen(engine, "handle_error", _replica_failed)
+        _watched_engines.add(id(engine))
+    return engine
+
+
+def _replica_failed(context):
+    # Обрыв соединения — реплика недоступна до следующей проверки
+    if context.is_disconnect:
+        _state.update(healthy=False, checked_at=time.monotonic())
+
+
+def _measure_lag(engine):
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            return float(connection.execute(text(POSTGRES_LAG_SQL)).scalar())
+        connection.execute(text("SELECT 1"))
+        return 0.0
+
+
+def replica_status(engine):
+    """{"healthy", "lag"} реплики; проверка не чаще раза в REPLICA_CHECK_INTERVAL."""
+    now = time.monotonic()
+    checked_at = _state["checked_at"]
+    if checked_at is None or now - checked_at >= REPLICA_CHECK_INTERVAL:
+        with _lock:
+            checked_at = _state["checked_at"]
+            if checked_at is None or now - checked_at >= REPLICA_CHECK_INTERVAL:
+                try:
+                    lag = _measure_lag(engine)
+                    _state.update(healthy=lag <= REPLICA_MAX_LAG, lag=lag)
+                except Exception as e:
+                    print(f"⚠️ Реплика недоступна, читаем из основной БД: {e}")
+                    _state.update(healthy=False, lag=None)
+                _state["checked_at"] = time.monotonic()
+    return {"healthy": _state["healthy"], "lag": _state["lag"]}
+
+
+def reset_replica_status():
+    _state.update(checked_at=None, healthy=False, lag=None)
+
+
+class RoutingSession(FlaskSession):
+    """Сессия, которая в режиме чтения отдаёт SELECT реплике.
+
+    Режим включается на запрос (session.info["read_replica"]); flush и
+    INSERT/UPDATE/DELETE всегда идут в основную БД.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and self.info.get("read_replica")
+            and not self._flushing
+            and not getattr(clause, "is_dml", False)
+        ):
+            engine = get_replica_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """Маршрут только читает, хотя принимает POST (например, список id в теле)."""
+    view.read_only = True
+    return view
+
+
+def _is_read_request():
+    if request.method in READ_METHODS:
+        return True
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, "read_only", False)
+
+
+def _use_replica():
+    if not _is_read_request():
+        return False
+    if session.get(STICKY_SESSION_KEY, 0) > time.time():
+        return False
+    engine = get_replica_engine()
+    return engine is not None and replica_status(engine)["healthy"]
+
+
+def init_replica(app, db):
+    """Маршрутизация чтения на реплику для запросов приложения app."""
+
+    @app.before_request
+    def _route_reads():
+        db.session.info["read_replica"] = _use_replica()
+        db.session.info["committed_writes"] = False
+
+    @app.after_request
+    def _stick_to_primary(response):
+        # Только после настоящей записи: POST без записи не лишает реплики
+        if (
+            db.session.info.get("committed_writes")
+            or db.session.info.get("pending_write")
+        ):
+            session[STICKY_SESSION_KEY] = time.time() + REPLICA_STICKY_SECONDS
+        return response
+
+    @app.teardown_request
+    def _reset_routing(exc):
+        db.session.info.pop("read_replica", None)
+        db.session.info.pop("committed_writes", None)
+
+
+# ---------- ЗАПИСЬ В ЗАПРОСЕ ----------
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_write(session, flush_context):
+    session.info["pending_write"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["pending_write"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_commit(session):
+    if session.info.pop("pending_write", False) and has_request_context():
+        session.info["committed_writes"] = True
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_write(session):
+    session.info.pop("pending_write", None)
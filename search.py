@@ -0,0 +1,291 @@
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, text, literal_column, func, and_
+
+from models import db, Patient, Visit, VisitMedicine, Medicine, get_data_versions
+from pagination import encode_cursor, decode_cursor
+
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 200
+
+# Триграммный индекс (FTS5 trigram, pg_trgm) работает с запросами от трёх символов
+MIN_INDEXED_QUERY = 3
+
+SEARCH_TYPES = ("visit_date", "diagnosis", "side_effects")
+
+
+def _escape_like(query):
+    return query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _like_pattern(query):
+    return f"%{_escape_like(query)}%"
+
+
+def _fts_phrase(query):
+    return '"' + query.replace('"', '""') + '"'
+
+
+def _text_match_ids(model, column, fts_table, query):
+    """Подзапрос id строк model, у которых column содержит query."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite" and len(query) >= MIN_INDEXED_QUERY:
+        return (
+            select(literal_column("rowid"))
+            .select_from(text(fts_table))
+            .where(text(f"{fts_table} MATCH :fts_query").bindparams(
+                fts_query=_fts_phrase(query)
+            ))
+        )
+    # Postgres: ILIKE использует GIN-индекс pg_trgm
+    return select(model.id).where(column.ilike(_like_pattern(query), escape="\\"))
+
+
+def _patient_ids_subquery(search_type, query):
+    if search_type == "visit_date":
+        try:
+            day = datetime.strptime(query, "%Y-%m-%d")
+        except ValueError as e:
+            raise ValueError("Неверный формат даты") from e
+        # Диапазон вместо date(visits.date) = ..., чтобы работал индекс по дате
+        return select(Visit.patient_id).where(
+            Visit.date >= day, Visit.date < day + timedelta(days=1)
+        )
+
+    if search_type == "diagnosis":
+        visit_ids = _text_match_ids(Visit, Visit.diagnosis, "visits_fts", query)
+        return select(Visit.patient_id).where(Visit.id.in_(visit_ids))
+
+    if search_type == "side_effects":
+        medicine_ids = _text_match_ids(
+            Medicine, Medicine.side_effects, "medicines_fts", query
+        )
+        visit_ids = select(VisitMedicine.visit_id).where(
+            VisitMedicine.medicine_id.in_(medicine_ids)
+        )
+        return select(Visit.patient_id).where(Visit.id.in_(visit_ids))
+
+    raise ValueError("Неизвестный тип поиска")
+
+
+def search_patients(search_type, query, cursor=None, limit=SEARCH_PAGE_SIZE):
+    """Страница пациентов, найденных по дате визита, диагнозу или побочным эффектам.
+
+    Пагинация keyset по Patient.id. Возвращает (patients, next_cursor).
+    """
+    query = (query or "").strip()
+    if not query:
+        raise ValueError("Введите запрос для поиска")
+
+    patients = Patient.query.filter(
+        Patient.id.in_(_patient_ids_subquery(search_type, query))
+    )
+    if cursor:
+        (after_id,) = decode_cursor(cursor, 1)
+        patients = patients.filter(Patient.id > int(after_id))
+
+    rows = patients.order_by(Patient.id).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+
+    return rows, next_cursor
+
+
+# ---------- ПОДБОР ПАЦИЕНТА ПО ФАМИЛИИ ----------
+
+PATIENT_LOOKUP_LIMIT = 20
+
+
+def _lowered(column):
+    """column в нижнем регистре — то же выражение, что в ix_patients_name_lower."""
+    if db.session.get_bind().dialect.name == "sqlite":
+        # Встроенный lower() в SQLite не знает кириллицы (см. models.py)
+        return func.unicode_lower(column)
+    return func.lower(column)
+
+
+def _name_prefix(column, prefix):
+    """Условие «column начинается с prefix» без учёта регистра; prefix — в нижнем."""
+    lowered = _lowered(column)
+    if db.session.get_bind().dialect.name == "sqlite":
+        # Диапазон в бинарном порядке строк эквивалентен префиксу и идёт по индексу
+        return and_(lowered >= prefix, lowered < prefix + "\uffff")
+    return lowered.like(f"{_escape_like(prefix)}%", escape="\\")
+
+
+def lookup_patients(query, limit=PATIENT_LOOKUP_LIMIT):
+    """Пациенты для typeahead: «Фам» или «Фамилия Им», не больше limit строк.
+
+    Регистр не важен; сам запрос не переписывается, поэтому «McDonald» и
+    «Петрова-Водкина» находятся как есть.
+    """
+    words = (query or "").lower().split()
+    if not words:
+        return []
+
+    conditions = [_name_prefix(Patient.last_name, words[0])]
+    if len(words) > 1:
+        conditions.append(_name_prefix(Patient.first_name, " ".join(words[1:])))
+
+    return db.session.execute(
+        select(
+            Patient.id, Patient.last_name, Patient.first_name, Patient.date_of_birth
+        )
+        .where(*conditions)
+        .order_by(_lowered(Patient.last_name), _lowered(Patient.first_name), Patient.id)
+        .limit(limit)
+    ).all()
+
+
+# ---------- ПОДСКАЗКИ ДЛЯ ПОИСКА ----------
+
+SUGGESTIONS_LIMIT = 10
+MIN_SUGGESTION_QUERY = 2
+
+# Как часто сверять версию данных с БД (секунды). Между проверками
+# подсказки отдаются только из памяти.
+SUGGESTIONS_VERSION_CHECK_INTERVAL = 1.0
+
+# Полная пересборка индекса диагнозов, чтобы убрать удалённые значения
+SUGGESTIONS_FULL_REBUILD_INTERVAL = 600.0
+
+
+def _normalize(value):
+    return " ".join(value.lower().split())
+
+
+class SuggestionIndex:
+    """Отсортированный массив ключей для поиска по префиксу в памяти процесса.
+
+    Ключи строятся от начала каждого слова термина, поэтому запрос «бронх»
+    находит и «Бронхит», и «Острый бронхит». Индекс пересобирается, когда
+    меняется версия таблицы-источника (см. models.get_data_versions).
+    """
+
+    def __init__(self, version_name, load_terms, load_new_terms=None):
+        self.version_name = version_name
+        self._load_terms = load_terms
+        # load_new_terms(state) -> (terms, state): дозагрузка только новых строк
+        self._load_new_terms = load_new_terms
+        self._lock = threading.Lock()
+        self._terms = set()
+        self._index = ([], [])
+        self._version = None
+        self._state = None
+        self._checked_at = 0.0
+        self._rebuilt_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+            self._checked_at = 0.0
+
+    def suggest(self, prefix, limit=SUGGESTIONS_LIMIT):
+        self._refresh()
+        key = _normalize(prefix)
+        keys, values = self._index
+
+        result, seen = [], set()
+        position = bisect.bisect_left(keys, key)
+        while position < len(keys) and keys[position].startswith(key):
+            value = values[position]
+            if value not in seen:
+                seen.add(value)
+                result.append(value)
+                if len(result) >= limit:
+                    break
+            position += 1
+        return result
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < SUGGESTIONS_VERSION_CHECK_INTERVAL:
+            return
+
+        with self._lock:
+            if now - self._checked_at < SUGGESTIONS_VERSION_CHECK_INTERVAL:
+                return
+            version = get_data_versions(self.version_name)[self.version_name]
+            self._checked_at = now
+            if version == self._version:
+                return
+
+            full_rebuild = (
+                self._version is None
+                or self._load_new_terms is None
+                or now - self._rebuilt_at >= SUGGESTIONS_FULL_REBUILD_INTERVAL
+            )
+            if full_rebuild:
+                self._terms, self._state = self._load_terms()
+                self._rebuilt_at = now
+            else:
+                new_terms, self._state = self._load_new_terms(self._state)
+                self._terms |= new_terms
+
+            self._build()
+            self._version = version
+
+    def _build(self):
+        pairs = []
+        for term in self._terms:
+            words = _normalize(term).split(" ")
+            for start in range(len(words)):
+                pairs.append((" ".join(words[start:]), term))
+        pairs.sort()
+        # Подмена одним присваиванием — читатели без блокировки видят
+        # либо старый, либо новый индекс целиком
+        self._index = ([k for k, _ in pairs], [v for _, v in pairs])
+
+
+def _diagnosis_terms(after_id=None):
+    query = db.session.query(Visit.diagnosis, func.max(Visit.id)).filter(
+        Visit.diagnosis.isnot(None)
+    )
+    if after_id is not None:
+        query = query.filter(Visit.id > after_id)
+    terms, max_id = set(), after_id
+    for diagnosis, last_id in query.group_by(Visit.diagnosis):
+        diagnosis = " ".join(diagnosis.split())
+        if diagnosis:
+            terms.add(diagnosis)
+        max_id = last_id if max_id is None else max(max_id, last_id)
+    return terms, max_id
+
+
+def _side_effect_terms():
+    terms = set()
+    for (side_effects,) in db.session.query(Medicine.side_effects).filter(
+        Medicine.side_effects.isnot(None)
+    ):
+        for effect in side_effects.split(","):
+            effect = " ".join(effect.split())
+            if effect:
+                terms.add(effect)
+    return terms, None
+
+
+# Индексы живут в памяти каждого воркера gunicorn
+suggestion_indexes = {
+    "diagnosis": SuggestionIndex(
+        "visits",
+        load_terms=_diagnosis_terms,
+        # Визиты почти только добавляются — дочитываем строки с id больше прежнего
+        load_new_terms=_diagnosis_terms,
+    ),
+    "side_effects": SuggestionIndex("medicines", load_terms=_side_effect_terms),
+}
+
+
+def get_suggestions(search_type, query, limit=SUGGESTIONS_LIMIT):
+    """Подсказки для строки поиска; для поиска по дате подсказок нет."""
+    query = (query or "").strip()
+    index = suggestion_indexes.get(search_type)
+    if index is None or len(query) < MIN_SUGGESTION_QUERY:
+        return []
+    return index.suggest(query, limit)
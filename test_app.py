@@ -1,9 +1,14 @@
 import os
+import tempfile
 import pytest
 from flask import session
 
 # Подменяем базу данных перед импортом приложения
 os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+# Облегчённые параметры scrypt, чтобы тесты не тратили время на KDF
+os.environ["PASSWORD_SCRYPT_N"] = "1024"
+# Снимок справочников — во временный каталог, а не в общий /tmp
+os.environ["REFDATA_CACHE_DIR"] = tempfile.mkdtemp(prefix="refdata-")
 
 from app import app, db, User  # noqa
 
@@ -150,3 +155,1311 @@ def test_logout(login_as_admin):
     response = login_as_admin.get("/logout", follow_redirects=True)
     html = response.data.decode()
     assert "Вы вышли из системы но нет аххаха" in html
+
+
+# ---------------------------
+#   VISIT FEED
+# ---------------------------
+
+def _create_visits(count):
+    """Создаёт врача, пациента и count визитов с убывающими датами."""
+    from datetime import datetime, timedelta
+    from app import Doctor, Patient, Visit
+
+    doctor = Doctor(
+        first_name="Test", middle_name="T", last_name="Doctor",
+        position="Терапевт", login="feed_doctor", phone="+70000000000",
+        password_hash="x",
+    )
+    patient = Patient(
+        first_name="Test", last_name="Patient", gender="M",
+        date_of_birth=datetime(1990, 1, 1), login="feed_patient",
+        password_hash="x",
+    )
+    db.session.add_all([doctor, patient])
+    db.session.flush()
+
+    start = datetime(2030, 1, 1, 12, 0)
+    visits = [
+        Visit(
+            patient_id=patient.id, doctor_id=doctor.id,
+            date=start - timedelta(hours=i // 2),  # пары визитов с одной датой
+            location="Кабинет 1", diagnosis=f"feed-diagnosis-{i}",
+        )
+        for i in range(count)
+    ]
+    db.session.add_all(visits)
+    db.session.commit()
+    return doctor, patient, visits
+
+
+def test_admin_visit_feed_keyset_pages(login_as_admin):
+    """Лента визитов отдаётся страницами без пропусков и повторов."""
+    _, _, visits = _create_visits(5)
+    created_ids = {visit.id for visit in visits}
+
+    seen = []
+    cursor = None
+    while True:
+        url = "/admin/visits/feed?limit=2"
+        if cursor:
+            url += f"&cursor={cursor}"
+        data = login_as_admin.get(url).get_json()
+        seen.extend(v["id"] for v in data["visits"] if v["id"] in created_ids)
+        cursor = data["next_cursor"]
+        if not cursor:
+            break
+
+    assert len(seen) == len(set(seen)) == 5
+    # Порядок: дата по убыванию, при равной дате — id по убыванию
+    expected = sorted(visits, key=lambda v: (v.date, v.id), reverse=True)
+    assert seen == [v.id for v in expected]
+
+
+def test_admin_visit_feed_bad_cursor(login_as_admin):
+    """Некорректный курсор возвращает 400."""
+    response = login_as_admin.get("/admin/visits/feed?cursor=bad")
+    assert response.status_code == 400
+
+
+# ---------------------------
+#   STAT COUNTERS
+# ---------------------------
+
+def test_counters_follow_inserts_and_deletes(client):
+    """Счётчики обновляются при добавлении и удалении записей."""
+    from app import get_counters
+
+    before = get_counters()
+    _, patient, visits = _create_visits(3)
+    after = get_counters()
+    assert after["visits"] == before["visits"] + 3
+    assert after["patients"] == before["patients"] + 1
+    assert after["doctors"] == before["doctors"] + 1
+
+    db.session.delete(visits[0])
+    db.session.commit()
+    assert get_counters()["visits"] == before["visits"] + 2
+
+
+def test_reconcile_stats_command(client):
+    """Команда reconcile-stats восстанавливает рассинхронизированные счётчики."""
+    from app import Visit, get_counters
+    from models import StatCounter
+
+    _create_visits(2)
+    # Значение счётчика — сумма шардов "visits", "visits#1", ...
+    db.session.merge(StatCounter(name="visits#3", value=999))
+    db.session.commit()
+    assert get_counters()["visits"] >= 999
+
+    result = app.test_cli_runner().invoke(args=["reconcile-stats"])
+    assert result.exit_code == 0
+    assert get_counters()["visits"] == Visit.query.count()
+
+
+# ---------------------------
+#   STATS ENDPOINTS
+# ---------------------------
+
+def test_stats_visits_by_date(login_as_admin):
+    """Число визитов за дату берётся из дневного агрегата."""
+    _create_visits(4)  # 2030-01-01 12:00 и 11:00 — все в один день
+    response = login_as_admin.post(
+        "/admin/stats/visits-by-date", json={"date": "2030-01-01"}
+    )
+    assert response.get_json()["visit_count"] == 4
+
+
+def test_stats_patients_by_diagnosis(login_as_admin):
+    """Пациенты считаются по нормализованному диагнозу, а удаление визита уменьшает агрегат."""
+    _, _, visits = _create_visits(2)
+    response = login_as_admin.post(
+        "/admin/stats/patients-by-diagnosis", json={"diagnosis": "  FEED-diagnosis-1 "}
+    )
+    assert response.get_json()["patient_count"] == 1
+
+    db.session.delete(visits[1])
+    db.session.commit()
+    response = login_as_admin.post(
+        "/admin/stats/patients-by-diagnosis", json={"diagnosis": "feed-diagnosis-1"}
+    )
+    assert response.get_json()["patient_count"] == 0
+
+
+def test_stats_medicine_side_effects(login_as_admin):
+    """Побочные эффекты лекарства ищутся по названию."""
+    from app import Medicine
+
+    db.session.add(Medicine(name="Stat-Medicine", side_effects="Сонливость"))
+    db.session.commit()
+    response = login_as_admin.post(
+        "/admin/stats/medicine-side-effects", json={"medicine_name": "stat-medicine"}
+    )
+    assert response.get_json() == {
+        "medicine_name": "Stat-Medicine",
+        "side_effects": "Сонливость",
+    }
+
+
+def test_stats_results_escaped_in_dashboard(login_as_admin):
+    """Разметка из справочника (например, из импорта) выводится на панели как текст."""
+    import re
+    from app import Medicine
+
+    payload = '<img src=x onerror="alert(1)">'
+    db.session.add(Medicine(name="Xss-Medicine", side_effects=payload))
+    db.session.commit()
+    response = login_as_admin.post(
+        "/admin/stats/medicine-side-effects", json={"medicine_name": "xss-medicine"}
+    )
+    assert response.get_json()["side_effects"] == payload
+
+    # Ответы JSON вставляются через .html(): каждое поле обязано пройти escapeHtml
+    html = login_as_admin.get("/admin/dashboard").get_data(as_text=True)
+    for handler in ("showVisitDetails", "getVisitsByDate",
+                    "getPatientsByDiagnosis", "getMedicineSideEffects"):
+        body = re.search(rf"function {handler}\(.*?\n    }}\n", html, re.S).group(0)
+        fields = re.findall(r"\$\{([^}]*(?:data|med)\.[^}]*)\}", body)
+        assert fields, handler
+        # Дата и пол выводятся уже преобразованными, а не как пришли
+        safe = ("escapeHtml(", "formatDate(", "new Date(", "data.gender === ")
+        assert all(field.startswith(safe) for field in fields), handler
+
+
+# ---------------------------
+#   PATIENT SEARCH
+# ---------------------------
+
+def _search(client, search_type, query, **extra):
+    return client.post("/admin/search-patients", json={
+        "search_type": search_type, "search_query": query, **extra,
+    }).get_json()
+
+
+def test_search_patients_by_diagnosis(login_as_admin):
+    """Поиск по подстроке диагноза (FTS5 trigram на SQLite)."""
+    _, patient, _ = _create_visits(3)
+    data = _search(login_as_admin, "diagnosis", "DIAGNOSIS-2")
+    assert [p["id"] for p in data["patients"]] == [patient.id]
+    assert _search(login_as_admin, "diagnosis", "no-such-diagnosis")["patients"] == []
+
+
+def test_search_patients_by_side_effects_and_date(login_as_admin):
+    """Поиск по побочным эффектам лекарства и по дате визита."""
+    from app import Medicine, VisitMedicine
+
+    _, patient, visits = _create_visits(1)
+    medicine = Medicine(name="Search-Medicine", side_effects="Головокружение, тошнота")
+    db.session.add(medicine)
+    db.session.flush()
+    db.session.add(VisitMedicine(visit_id=visits[0].id, medicine_id=medicine.id))
+    db.session.commit()
+
+    data = _search(login_as_admin, "side_effects", "тошнота")
+    assert [p["id"] for p in data["patients"]] == [patient.id]
+
+    data = _search(login_as_admin, "visit_date", "2030-01-01")
+    assert patient.id in [p["id"] for p in data["patients"]]
+    assert "error" in _search(login_as_admin, "visit_date", "01.01.2030")
+
+
+def test_search_patients_cursor_paging(login_as_admin):
+    """Результаты поиска отдаются страницами по курсору."""
+    from datetime import datetime
+    from app import Doctor, Patient, Visit
+
+    doctor = Doctor(first_name="D", middle_name="D", last_name="D", position="P",
+                    login="search_doctor", phone="+71111111111", password_hash="x")
+    patients = [
+        Patient(first_name=f"P{i}", last_name="Paged", gender="F",
+                date_of_birth=datetime(1990, 1, 1), login=f"paged_{i}",
+                password_hash="x")
+        for i in range(3)
+    ]
+    db.session.add_all([doctor, *patients])
+    db.session.flush()
+    db.session.add_all(
+        Visit(patient_id=p.id, doctor_id=doctor.id, date=datetime(2031, 5, 5),
+              diagnosis="paged-search-diagnosis")
+        for p in patients
+    )
+    db.session.commit()
+
+    first = _search(login_as_admin, "diagnosis", "paged-search", limit=2)
+    second = _search(login_as_admin, "diagnosis", "paged-search",
+                     cursor=first["next_cursor"], limit=2)
+    ids = [p["id"] for p in first["patients"] + second["patients"]]
+    assert ids == sorted(p.id for p in patients)
+    assert second["next_cursor"] is None
+
+
+# ---------------------------
+#   SEARCH SUGGESTIONS
+# ---------------------------
+
+def test_search_suggestions_from_memory_index(login_as_admin):
+    """Подсказки строятся по началу любого слова, побочные эффекты — по отдельности."""
+    from app import Medicine
+    from search import suggestion_indexes
+
+    db.session.add(Medicine(name="Suggest-Medicine", side_effects="Сухость во рту, Сонливость"))
+    db.session.commit()
+    _create_visits(1)
+    for index in suggestion_indexes.values():
+        index.invalidate()
+
+    def suggest(search_type, query):
+        response = login_as_admin.post("/admin/search-suggestions", json={
+            "search_type": search_type, "search_query": query,
+        })
+        return [item["suggestion"] for item in response.get_json()]
+
+    assert suggest("side_effects", "сон") == ["Сонливость"]
+    assert "Сухость во рту" in suggest("side_effects", "рту")
+    assert suggest("diagnosis", "feed-diag") == ["feed-diagnosis-0"]
+    assert suggest("visit_date", "2030") == []
+
+
+def test_doctor_patient_lookup_by_prefix(login_as_doctor):
+    """Typeahead пациентов: префикс фамилии (и имени), без учёта регистра, с лимитом."""
+    from datetime import date
+    from app import Patient
+
+    for i, first_name in enumerate(["Анна", "Борис", "Алексей"]):
+        db.session.add(Patient(
+            first_name=first_name, last_name="Лукапова" if i == 0 else "Лукапов",
+            gender="M", date_of_birth=date(1990, 1, 1),
+            login=f"lookup_{i}", password_hash="x",
+        ))
+    db.session.commit()
+
+    def lookup(query, **extra):
+        response = login_as_doctor.get(
+            "/doctor/patients/lookup", query_string={"q": query, **extra}
+        )
+        return [f"{p['last_name']} {p['first_name']}" for p in response.get_json()]
+
+    assert lookup("лукап") == ["Лукапов Алексей", "Лукапов Борис", "Лукапова Анна"]
+    assert lookup("Лукапов б") == ["Лукапов Борис"]
+    assert lookup("лукап", limit=1) == ["Лукапов Алексей"]
+    assert lookup("%") == []
+    assert "Лукапов" not in login_as_doctor.get("/doctor/add-visit").get_data(as_text=True)
+
+
+def test_doctor_patient_lookup_keeps_query_case(login_as_doctor):
+    """Запрос не переписывается в «Заглавную»: McDonald и двойные фамилии находятся."""
+    from datetime import date
+    from app import Patient
+
+    for i, last_name in enumerate(["McDonald", "Петрова-Водкина"]):
+        db.session.add(Patient(
+            first_name="Тест", last_name=last_name, gender="F",
+            date_of_birth=date(1990, 1, 1), login=f"case_{i}", password_hash="x",
+        ))
+    db.session.commit()
+
+    def lookup(query):
+        response = login_as_doctor.get("/doctor/patients/lookup", query_string={"q": query})
+        return [p["last_name"] for p in response.get_json()]
+
+    assert lookup("McDonald") == lookup("mcdonald") == ["McDonald"]
+    assert lookup("петрова-вод") == lookup("Петрова-Водкина") == ["Петрова-Водкина"]
+
+
+# ---------------------------
+#   SESSION PRINCIPAL
+# ---------------------------
+
+def test_load_user_from_session_principal(client):
+    """load_user берёт принципал из сессии без запроса в БД и учитывает отзыв."""
+    from app import load_user, principals_version
+    from auth import remember_principal, revoke_principal, revoked_principals
+
+    with app.test_request_context():
+        # Такого врача в БД нет — значит, пользователь восстановлен из сессии
+        remember_principal(User(999, "ghost", "doctor"), version=principals_version())
+        user = load_user("doctor_999")
+        assert (user.id, user.login, user.role) == (999, "ghost", "doctor")
+
+        revoke_principal("doctor_999")
+        assert load_user("doctor_999") is None
+        assert "principal" not in session
+    revoked_principals.clear()
+
+
+def test_load_user_revalidates_expired_principal(client, monkeypatch):
+    """После истечения TTL принципал перепроверяется через БД."""
+    import auth
+    from app import load_user
+
+    monkeypatch.setattr(auth, "PRINCIPAL_TTL", 0)
+    with app.test_request_context():
+        auth.remember_principal(User(999, "ghost", "doctor"))
+        auth.principal_cache.clear()
+        assert load_user("doctor_999") is None
+
+
+def test_principal_cache_hit_keeps_check_time(client):
+    """Попадание в кеш принципалов не продлевает срок с последней проверки в БД."""
+    import auth
+    from app import load_user, principals_version
+
+    with app.test_request_context():
+        auth.remember_principal(User(999, "ghost", "doctor"), version=principals_version())
+        checked_at = session["principal"]["ts"]
+        session.pop("principal")
+        expires_at = auth.principal_cache._data["doctor_999"][1]
+        assert load_user("doctor_999").login == "ghost"
+        assert session["principal"]["ts"] == checked_at
+        assert auth.principal_cache._data["doctor_999"][1] == expires_at
+
+
+def test_deleted_doctor_revoked_in_other_workers(client, monkeypatch):
+    """Удаление врача меняет общую версию принципалов: сессии перепроверяются через БД."""
+    import auth
+    from app import Doctor, load_user
+
+    monkeypatch.setattr(auth, "PRINCIPAL_VERSION_CHECK_INTERVAL", 0)
+    doctor, _, _ = _create_visits(0)
+    key = f"doctor_{doctor.id}"
+    with app.test_request_context():
+        assert load_user(key).id == doctor.id
+        assert load_user(key).id == doctor.id
+
+        # Удаление «в другом воркере»: без локального revoke_principal
+        db.session.delete(db.session.get(Doctor, doctor.id))
+        db.session.commit()
+        assert load_user(key) is None
+
+
+# ---------------------------
+#   ACCOUNTS
+# ---------------------------
+
+def test_authenticate_uses_accounts_registry(client):
+    """Вход по реестру accounts работает для любой роли."""
+    import hashlib
+    from datetime import datetime
+    from app import Patient
+
+    patient = Patient(
+        first_name="A", last_name="B", gender="F", date_of_birth=datetime(1990, 1, 1),
+        login="acc_patient", password_hash=hashlib.sha256(b"secret").hexdigest(),
+    )
+    db.session.add(patient)
+    db.session.commit()
+
+    user = User.authenticate("acc_patient", "secret")
+    assert (user.id, user.role) == (patient.id, "patient")
+    assert User.authenticate("acc_patient", "wrong") is None
+
+
+def test_login_unique_across_roles(client):
+    """Один логин не может принадлежать разным ролям."""
+    from sqlalchemy.exc import IntegrityError
+    from app import Admin, Doctor
+
+    db.session.add(Admin(login="shared_login", password_hash="x"))
+    db.session.commit()
+
+    db.session.add(Doctor(
+        first_name="D", middle_name="D", last_name="D", position="P",
+        login="shared_login", phone="+72222222222", password_hash="x",
+    ))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+# ---------------------------
+#   PASSWORD HASHING
+# ---------------------------
+
+def test_legacy_hash_upgraded_on_login(client):
+    """Старый sha256-хеш заменяется на scrypt при успешном входе."""
+    import hashlib
+    from app import Admin
+
+    admin = Admin(login="legacy_admin", password_hash=hashlib.sha256(b"pw").hexdigest())
+    db.session.add(admin)
+    db.session.commit()
+
+    assert User.authenticate("legacy_admin", "pw").role == "admin"
+    db.session.refresh(admin)
+    assert admin.password_hash.startswith("scrypt$")
+    assert User.authenticate("legacy_admin", "pw").id == admin.id
+    assert User.authenticate("legacy_admin", "bad") is None
+
+
+def test_password_pool_rejects_when_full():
+    """Переполненный пул отклоняет задачи, а не копит их."""
+    import threading
+    from auth import PasswordWorkerPool, PasswordPoolBusy
+
+    pool = PasswordWorkerPool(max_workers=1, max_queue=0, timeout=5)
+    release = threading.Event()
+    worker = threading.Thread(target=pool.run, args=(release.wait,))
+    worker.start()
+    while pool.stats()["running"] == 0:
+        pass
+
+    with pytest.raises(PasswordPoolBusy):
+        pool.run(lambda: None)
+    release.set()
+    worker.join()
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["completed"] == 1
+
+
+def test_password_pool_timeout_is_not_bad_password(client, monkeypatch):
+    """Таймаут пула — 503 «повторите позже», а не «неверные учётные данные»."""
+    import threading
+    import models
+    from auth import PasswordWorkerPool, PasswordPoolBusy
+
+    pool = PasswordWorkerPool(max_workers=1, max_queue=1, timeout=0.05)
+    release = threading.Event()
+    with pytest.raises(PasswordPoolBusy):
+        pool.run(release.wait)
+    release.set()
+    assert pool.stats()["timed_out"] == 1
+
+    slow = PasswordWorkerPool(max_workers=1, max_queue=1, timeout=0.05)
+    monkeypatch.setattr(models, "password_pool", slow)
+    monkeypatch.setattr(models, "verify_password", lambda *args: (release.wait(), False))
+    release.clear()
+    response = client.post("/login", data={"login": "admin", "password": "admin123"})
+    release.set()
+    assert response.status_code == 503
+    assert "Неверные учетные данные" not in response.get_data(as_text=True)
+
+
+# ---------------------------
+#   VISIT DETAILS
+# ---------------------------
+
+def _login_as(monkeypatch, role, user_id):
+    user = DummyUser(role)
+    user.id = user_id
+    monkeypatch.setattr("flask_login.utils._get_user", lambda: user)
+
+
+def test_visit_detail_role_fields_and_scoping(client, monkeypatch):
+    """Одна карточка визита, разные наборы полей и доступ по ролям."""
+    from app import Medicine, VisitMedicine
+
+    doctor, patient, visits = _create_visits(1)
+    visit = visits[0]
+    medicine = Medicine(name="Detail-Medicine", side_effects="Нет")
+    db.session.add(medicine)
+    db.session.flush()
+    db.session.add(VisitMedicine(visit_id=visit.id, medicine_id=medicine.id,
+                                 doctor_instructions="2 раза в день"))
+    db.session.commit()
+
+    _login_as(monkeypatch, "admin", 1)
+    data = client.get(f"/admin/visits/{visit.id}").get_json()
+    assert data["patient_id"] == patient.id
+    assert data["medicines"][0]["doctor_instructions"] == "2 раза в день"
+
+    _login_as(monkeypatch, "doctor", doctor.id)
+    data = client.get(f"/doctor/visits/{visit.id}").get_json()
+    assert "patient_id" not in data and data["gender"] == "M"
+
+    _login_as(monkeypatch, "patient", patient.id)
+    data = client.get(f"/patient/visits/{visit.id}").get_json()
+    assert "gender" not in data and data["diagnosis"] == "feed-diagnosis-0"
+
+    _login_as(monkeypatch, "patient", patient.id + 1000)
+    assert client.get(f"/patient/visits/{visit.id}").status_code == 404
+
+
+def test_visit_detail_cache_invalidated_on_write(login_as_admin):
+    """Изменение визита сбрасывает закешированную карточку."""
+    _, _, visits = _create_visits(1)
+    visit = visits[0]
+    assert login_as_admin.get(f"/admin/visits/{visit.id}").get_json()["location"] == "Кабинет 1"
+
+    visit.location = "Кабинет 2"
+    db.session.commit()
+    assert login_as_admin.get(f"/admin/visits/{visit.id}").get_json()["location"] == "Кабинет 2"
+
+    db.session.delete(visit)
+    db.session.commit()
+    assert login_as_admin.get(f"/admin/visits/{visit.id}").status_code == 404
+
+
+def test_visit_detail_not_cached_if_invalidated_during_load(client, monkeypatch):
+    """Карточка, загруженная до параллельного коммита, не попадает в кеш после него."""
+    import visit_details
+
+    _, _, visits = _create_visits(1)
+    visit_id = visits[0].id
+    load = visit_details._load_visit_details
+
+    def load_racing_commit(ids):
+        loaded = load(ids)
+        # Другой поток закоммитил правку, пока эта загрузка шла
+        visit_details.invalidate_visit_detail(visit_id)
+        return loaded
+
+    monkeypatch.setattr(visit_details, "_load_visit_details", load_racing_commit)
+    assert visit_details.get_visit_detail(visit_id)["id"] == visit_id
+    assert visit_details.get_visit_details([visit_id])
+    assert visit_details._details.get(visit_id) is None
+
+
+def test_visit_batch_scoped_and_ordered(client, monkeypatch):
+    """Batch-запрос отдаёт карточки в порядке ids, чужие и несуществующие — в missing."""
+    doctor, patient, visits = _create_visits(3)
+    ids = [visits[2].id, visits[0].id, 999999]
+
+    _login_as(monkeypatch, "doctor", doctor.id)
+    data = client.get("/doctor/visits/batch?ids=" + ",".join(map(str, ids))).get_json()
+    assert [v["id"] for v in data["visits"]] == ids[:2]
+    assert data["missing"] == [999999]
+    assert "patient_id" not in data["visits"][0]
+
+    _login_as(monkeypatch, "patient", patient.id + 1000)
+    data = client.post("/patient/visits/batch", json={"ids": ids}).get_json()
+    assert data["visits"] == [] and data["missing"] == ids
+
+    assert client.post("/patient/visits/batch", json={"ids": []}).status_code == 400
+    too_many = list(range(1, 102))
+    assert client.post("/patient/visits/batch", json={"ids": too_many}).status_code == 400
+
+
+def test_refdata_snapshot_shared_and_invalidated(login_as_admin, monkeypatch):
+    """Справочник читается из снимка без БД и обновляется после записи."""
+    import refdata
+    from app import Medicine
+
+    db.session.add(Medicine(name="Refdata-A", description="", side_effects="",
+                            usage_method=""))
+    db.session.commit()
+    assert "Refdata-A" in login_as_admin.get("/admin/medicines").get_data(as_text=True)
+
+    # Другой воркер: пустая память процесса, но снимок уже на диске
+    with monkeypatch.context() as m:
+        m.setitem(refdata._local, "generation", None)
+        m.setattr(refdata, "_load_snapshot", lambda: pytest.fail("запрос к БД"))
+        assert "Refdata-A" in [med.name for med in refdata.get_medicines()]
+
+    db.session.add(Medicine(name="Refdata-B", description="", side_effects="",
+                            usage_method=""))
+    db.session.commit()
+    assert "Refdata-B" in login_as_admin.get("/admin/medicines").get_data(as_text=True)
+
+
+def test_refdata_snapshot_not_left_behind_after_race(client, monkeypatch):
+    """Снимок, построенный под сменившимся поколением, не остаётся на диске."""
+    import glob
+    import refdata
+
+    load_snapshot = refdata._load_snapshot
+
+    def load_during_write():
+        refdata.invalidate_refdata()  # запись справочника во время построения
+        return load_snapshot()
+
+    refdata.invalidate_refdata()
+    monkeypatch.setattr(refdata, "_load_snapshot", load_during_write)
+    refdata.get_medicines()
+
+    pattern = os.path.join(refdata.REFDATA_CACHE_DIR, f"{refdata._namespace()}-*.json")
+    current = refdata._snapshot_path(refdata._read_generation())
+    assert [path for path in glob.glob(pattern) if path != current] == []
+
+
+def test_add_visit_medicine_options_rendered_once(login_as_doctor):
+    """Список лекарств в форме визита — один фрагмент, обновляемый с каталогом."""
+    from app import Medicine
+
+    def page():
+        return login_as_doctor.get("/doctor/add-visit").get_data(as_text=True)
+
+    db.session.add(Medicine(name="Fragment-A", side_effects="a & b"))
+    db.session.commit()
+    html = page()
+    assert html.count("Fragment-A") == 1
+    assert 'data-side-effects="a &amp; b"' in html
+
+    db.session.add(Medicine(name="Fragment-B"))
+    db.session.commit()
+    assert "Fragment-B" in page()
+
+
+def test_add_visit_bulk_medicines_and_validation(client, monkeypatch):
+    """Визит с назначениями создаётся одной транзакцией, неизвестное лекарство — ошибка."""
+    from app import Medicine, Visit, VisitMedicine
+
+    doctor, patient, _ = _create_visits(0)
+    first, second = Medicine(name="Bulk-A"), Medicine(name="Bulk-B")
+    db.session.add_all([first, second])
+    db.session.commit()
+    _login_as(monkeypatch, "doctor", doctor.id)
+
+    def post(medicines, instructions):
+        return client.post("/doctor/add-visit", data={
+            "patient_id": patient.id, "date": "2030-03-01T10:00", "location": "Кабинет 5",
+            "symptoms": "", "diagnosis": "bulk", "prescriptions": "",
+            "medicines[]": medicines, "instructions[]": instructions,
+        }, follow_redirects=True)
+
+    assert "Визит успешно добавлен" in post(
+        [str(first.id), "", str(second.id)], ["утром", "", "вечером"]
+    ).get_data(as_text=True)
+    visit = Visit.query.filter_by(diagnosis="bulk").one()
+    rows = VisitMedicine.query.filter_by(visit_id=visit.id).order_by(VisitMedicine.id).all()
+    assert [(r.medicine_id, r.doctor_instructions) for r in rows] == [
+        (first.id, "утром"), (second.id, "вечером"),
+    ]
+
+    html = post([str(first.id), "999999"], ["", ""]).get_data(as_text=True)
+    assert "не найдено" in html
+    assert Visit.query.filter_by(diagnosis="bulk").count() == 1
+
+
+# ---------------------------
+#   BULK IMPORT
+# ---------------------------
+
+def test_import_patients_csv_reports_conflicts(login_as_admin):
+    """CSV-импорт: валидные строки вставляются, конфликты и ошибки — в отчёте."""
+    from app import Account, Patient, User, get_counters
+
+    _create_visits(0)  # занимает логин feed_patient
+    before = get_counters()["patients"]
+    body = (
+        "first_name,last_name,gender,date_of_birth,login,password\n"
+        "Иван,Импортов,M,1980-05-01,import_1,secret\n"
+        "Пётр,Импортов,M,1981-05-01,feed_patient,secret\n"
+        "Анна,Импортова,F,01.05.1982,import_2,secret\n"
+        "Олег,Импортов,M,1983-05-01,import_1,secret\n"
+        "Мария,Импортова,F,1984-05-01,import_3,secret\n"
+    )
+    response = login_as_admin.post(
+        "/admin/import/patients", data=body.encode(), content_type="text/csv"
+    )
+    report = response.get_json()
+
+    assert report["processed"] == 5 and report["inserted"] == 2
+    assert report["conflicts"] == 2 and report["failed"] == 1
+    assert sorted(e["row"] for e in report["errors"]) == [2, 3, 4]
+
+    assert Patient.query.filter_by(last_name="Импортов").count() == 1
+    assert db.session.get(Account, "import_3").role == "patient"
+    assert get_counters()["patients"] == before + 2
+    assert User.authenticate("import_1", "secret") is not None
+
+
+def test_import_doctors_ndjson_upload(login_as_admin):
+    """NDJSON-файл из формы; повтор телефона — конфликт, битая строка — ошибка."""
+    import io
+    from app import Doctor
+
+    lines = [
+        '{"first_name": "Д", "middle_name": "Д", "last_name": "Импорт", "position": "Хирург", '
+        '"login": "import_doc_1", "phone": "+79990000001", "password": "x"}',
+        '{"first_name": "Е", "middle_name": "Е", "last_name": "Импорт", "position": "Хирург", '
+        '"login": "import_doc_2", "phone": "+79990000001", "password": "x"}',
+        "{not json",
+    ]
+    data = {"file": (io.BytesIO("\n".join(lines).encode()), "doctors.ndjson")}
+    report = login_as_admin.post(
+        "/admin/import/doctors", data=data, content_type="multipart/form-data"
+    ).get_json()
+
+    assert report["inserted"] == 1 and report["conflicts"] == 1 and report["failed"] == 1
+    assert Doctor.query.filter_by(login="import_doc_1").count() == 1
+
+
+def test_import_race_reports_only_inserted_rows(login_as_admin, monkeypatch):
+    """Логин, занятый после проверки (другой ролью или той же), — конфликт, не вставка."""
+    import importer
+    from app import Account, Patient, get_counters
+
+    _create_visits(0)  # feed_doctor — врач, feed_patient — пациент
+    before = get_counters()["patients"]
+    # Параллельная запись между проверкой занятости и вставкой
+    monkeypatch.setattr(importer, "_existing_values", lambda *args: set())
+    body = (
+        "first_name,last_name,gender,date_of_birth,login,password_hash\n"
+        "Иван,Гонкин,M,1980-05-01,feed_doctor,hash\n"
+        "Пётр,Гонкин,M,1981-05-01,feed_patient,hash\n"
+        "Анна,Гонкина,F,1982-05-01,race_new,hash\n"
+    )
+    report = login_as_admin.post(
+        "/admin/import/patients", data=body.encode(), content_type="text/csv"
+    ).get_json()
+
+    assert report["inserted"] == 1 and report["conflicts"] == 2
+    assert sorted(e["row"] for e in report["errors"]) == [1, 2]
+    assert Patient.query.filter_by(login="feed_doctor").count() == 0
+    assert db.session.get(Account, "feed_doctor").role == "doctor"
+    assert get_counters()["patients"] == before + 1
+
+
+def test_web_import_hashes_through_password_pool(login_as_admin, monkeypatch):
+    """Веб-импорт хеширует в общем пуле паролей и не больше лимита за запрос."""
+    import importer
+    from auth import password_pool
+
+    monkeypatch.setattr(importer, "IMPORT_WEB_MAX_PASSWORDS", 1)
+    submitted = password_pool.stats()["submitted"]
+    body = (
+        "first_name,last_name,gender,date_of_birth,login,password\n"
+        "Иван,Лимитов,M,1980-05-01,limit_1,secret\n"
+        "Пётр,Лимитов,M,1981-05-01,limit_2,secret\n"
+    )
+    report = login_as_admin.post(
+        "/admin/import/patients", data=body.encode(), content_type="text/csv"
+    ).get_json()
+
+    assert report["inserted"] == 1 and report["failed"] == 1
+    assert "flask import-data" in report["errors"][0]["error"]
+    assert password_pool.stats()["submitted"] == submitted + 1
+
+
+# ---------------------------
+#   EXPORT
+# ---------------------------
+
+def test_export_visits_csv_ndjson_gzip(login_as_admin, monkeypatch):
+    """Выгрузка визитов потоком: CSV, NDJSON с лекарствами и gzip на лету."""
+    import csv
+    import gzip
+    import json
+    import exporter
+    from app import Medicine, VisitMedicine
+
+    doctor, _, visits = _create_visits(3)
+    medicine = Medicine(name="Export-Medicine")
+    db.session.add(medicine)
+    db.session.flush()
+    db.session.add(VisitMedicine(visit_id=visits[0].id, medicine_id=medicine.id,
+                                 doctor_instructions="на ночь"))
+    db.session.commit()
+    monkeypatch.setattr(exporter, "EXPORT_CHUNK_SIZE", 100)
+
+    query = f"doctor_id={doctor.id}"
+    response = login_as_admin.get(f"/admin/export/visits?{query}")
+    assert response.is_streamed
+    rows = list(csv.DictReader(response.get_data(as_text=True).splitlines()))
+    assert [int(r["id"]) for r in rows] == sorted(v.id for v in visits)
+    assert rows[0]["medicines"] == "Export-Medicine (на ночь)"
+
+    response = login_as_admin.get(f"/admin/export/visits?{query}&format=ndjson&compress=gzip")
+    assert response.mimetype == "application/gzip"
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    first = json.loads(lines[0])
+    assert len(lines) == 3 and first["doctor_last_name"] == "Doctor"
+    assert first["medicines"] == [{"name": "Export-Medicine", "instructions": "на ночь"}]
+
+    assert login_as_admin.get("/admin/export/visits?date_from=bad").status_code == 400
+
+
+# ---------------------------
+#   QUERY PLANS
+# ---------------------------
+
+HOT_TABLES = ("visits", "visit_medicines", "patients")
+
+
+def _query_plans(fn):
+    """Выполняет fn и возвращает [(sql, план)] для каждого SELECT по горячим таблицам."""
+    import re
+    from sqlalchemy import event
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    plans = []
+    connection = db.session.connection()
+    for statement, parameters in statements:
+        if not re.search(r"\b(%s)\b" % "|".join(HOT_TABLES), statement):
+            continue
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        plans.append((statement, "\n".join(row[-1] for row in rows)))
+    return plans
+
+
+def test_hot_queries_use_indexes(client, monkeypatch):
+    """Кабинеты, карточки визитов, лента и подбор пациента не сканируют таблицы целиком."""
+    import re
+
+    doctor, patient, visits = _create_visits(3)
+    ids = ",".join(str(v.id) for v in visits)
+
+    def doctor_requests():
+        _login_as(monkeypatch, "doctor", doctor.id)
+        client.get("/doctor/dashboard")
+        client.get(f"/doctor/visits/batch?ids={ids}")
+        client.get("/doctor/patients/lookup?q=Pat")
+
+    def patient_requests():
+        _login_as(monkeypatch, "patient", patient.id)
+        client.get("/patient/dashboard")
+        client.get(f"/patient/visits/{visits[1].id}")
+
+    def admin_requests():
+        _login_as(monkeypatch, "admin", 1)
+        client.get("/admin/visits/feed?limit=2")
+
+    plans = _query_plans(doctor_requests) + _query_plans(patient_requests)
+    plans += _query_plans(admin_requests)
+    assert plans
+
+    full_scan = re.compile(r"SCAN (%s)\b(?! USING (COVERING )?INDEX)" % "|".join(HOT_TABLES))
+    for statement, plan in plans:
+        assert not full_scan.search(plan), f"{plan}\n{statement}"
+        # Досортировка лекарств внутри одного визита (RIGHT PART) допустима,
+        # сортировка всей выборки — нет
+        assert "TEMP B-TREE FOR ORDER BY" not in plan, f"{plan}\n{statement}"
+
+    all_plans = "\n".join(plan for _, plan in plans)
+    assert "ix_visits_doctor_id_date" in all_plans
+    assert "ix_visits_patient_id_date" in all_plans
+
+
+# ---------------------------
+#   PARTITIONS
+# ---------------------------
+
+def test_visit_medicines_follow_visit_date(client):
+    """Назначение хранит дату визита (ключ секции) при любом способе записи."""
+    from datetime import date, datetime
+    from app import Medicine, VisitMedicine, create_visit
+    from partitions import ensure_visit_partitions, month_starts, partition_name
+
+    doctor, patient, visits = _create_visits(1)
+    first, second = Medicine(name="Part-1"), Medicine(name="Part-2")
+    db.session.add_all([first, second])
+    db.session.flush()
+    db.session.add(VisitMedicine(visit_id=visits[0].id, medicine_id=first.id))
+    db.session.commit()
+
+    visit = create_visit(
+        doctor_id=doctor.id, patient_id=patient.id, date=datetime(2031, 5, 1, 9, 0),
+        location="", symptoms="", diagnosis="", prescriptions="",
+        medicines=[(second.id, "")],
+    )
+    rows = VisitMedicine.query.filter(
+        VisitMedicine.visit_id.in_([visits[0].id, visit.id])
+    ).order_by(VisitMedicine.id).all()
+    assert [r.visit_date for r in rows] == [visits[0].date, visit.date]
+
+    visit.date = datetime(2031, 7, 1, 9, 0)
+    db.session.commit()
+    db.session.refresh(rows[1])
+    assert rows[1].visit_date == visit.date
+
+    assert month_starts(date(2031, 11, 15), date(2032, 2, 1)) == [
+        date(2031, 11, 1), date(2031, 12, 1), date(2032, 1, 1), date(2032, 2, 1),
+    ]
+    assert partition_name("visits", date(2032, 2, 1)) == "visits_y2032m02"
+    # Без секционированной схемы (SQLite) создавать нечего
+    assert ensure_visit_partitions() == []
+
+
+@pytest.mark.skipif(
+    not os.getenv("TEST_POSTGRES_URL"),
+    reason="нужен пустой Postgres 15+ в TEST_POSTGRES_URL",
+)
+def test_partition_migration_postgres(monkeypatch):
+    """Миграция a7e4c1d9f203 на Postgres: секции, ключи, каскад даты и откат.
+
+    Таблицы в базе TEST_POSTGRES_URL пересоздаются — только для тестовой базы.
+    """
+    import argparse
+    from datetime import datetime
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import create_engine, inspect, text
+    from app import Doctor, Medicine, Patient, Visit, VisitMedicine
+    from partitions import is_partitioned
+
+    url = os.environ["TEST_POSTGRES_URL"]
+    engine = create_engine(url)
+    if engine.dialect.name != "postgresql":
+        pytest.skip("TEST_POSTGRES_URL должен указывать на Postgres")
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    config = Config(
+        "alembic.ini",
+        cmd_opts=argparse.Namespace(x=[f"db_url={url}", "partition_visits=1"]),
+    )
+    created = datetime(2025, 1, 1)
+
+    with engine.begin() as connection:
+        if connection.dialect.server_version_info < (15,):
+            pytest.skip("секционирование визитов требует Postgres 15+")
+        db.metadata.drop_all(connection)
+        db.metadata.create_all(connection)
+        doctor_id = connection.execute(Doctor.__table__.insert().returning(Doctor.id), {
+            "first_name": "П", "middle_name": "П", "last_name": "Секция",
+            "position": "Терапевт", "login": "pg_doctor", "phone": "+70000000009",
+            "password_hash": "x", "created_at": created,
+        }).scalar()
+        patient_id = connection.execute(Patient.__table__.insert().returning(Patient.id), {
+            "first_name": "П", "last_name": "Секция", "gender": "M",
+            "date_of_birth": datetime(1990, 1, 1).date(), "login": "pg_patient",
+            "password_hash": "x", "created_at": created,
+        }).scalar()
+        medicine_id = connection.execute(Medicine.__table__.insert().returning(Medicine.id), {
+            "name": "PG-Medicine", "created_at": created,
+        }).scalar()
+        visit_id = connection.execute(Visit.__table__.insert().returning(Visit.id), {
+            "doctor_id": doctor_id, "patient_id": patient_id,
+            "date": datetime(2025, 3, 10, 9, 0), "created_at": created,
+        }).scalar()
+        connection.execute(VisitMedicine.__table__.insert(), {
+            "visit_id": visit_id, "medicine_id": medicine_id,
+            "visit_date": datetime(2025, 3, 10, 9, 0), "created_at": created,
+        })
+
+    try:
+        command.stamp(config, "3c9d2f7a1b64")
+        command.upgrade(config, "a7e4c1d9f203")
+
+        with engine.begin() as connection:
+            assert is_partitioned(connection, "visits")
+            assert is_partitioned(connection, "visit_medicines")
+            schema = inspect(connection)
+            assert schema.get_pk_constraint("visits")["constrained_columns"] == ["id", "date"]
+            assert connection.execute(
+                text("SELECT to_regclass('visits_default') IS NOT NULL")
+            ).scalar()
+            assert connection.execute(
+                text("SELECT count(*) FROM visits_y2025m03")
+            ).scalar() == 1
+
+            # Диапазон по дате читает только секцию своего месяца
+            plan = "\n".join(connection.execute(text(
+                "EXPLAIN SELECT id FROM visits "
+                "WHERE date >= '2025-03-01' AND date < '2025-04-01'"
+            )).scalars())
+            assert "visits_y2025m03" in plan and "visits_default" not in plan
+
+            # Смена даты переносит визит и его назначения в секцию нового месяца
+            connection.execute(
+                text("UPDATE visits SET date = '2025-04-10 09:00' WHERE id = :id"),
+                {"id": visit_id},
+            )
+            assert connection.execute(
+                text("SELECT count(*) FROM visit_medicines_y2025m04 WHERE visit_id = :id"),
+                {"id": visit_id},
+            ).scalar() == 1
+
+            # Дата вне созданных секций попадает в DEFAULT, а не в ошибку
+            connection.execute(Visit.__table__.insert(), {
+                "doctor_id": doctor_id, "patient_id": patient_id,
+                "date": datetime(2090, 1, 1), "created_at": created,
+            })
+            assert connection.execute(
+                text("SELECT count(*) FROM visits_default")
+            ).scalar() == 1
+
+        command.downgrade(config, "3c9d2f7a1b64")
+        with engine.begin() as connection:
+            assert not is_partitioned(connection, "visits")
+            assert connection.execute(text("SELECT count(*) FROM visits")).scalar() == 2
+            assert connection.execute(text("SELECT count(*) FROM visit_medicines")).scalar() == 1
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text("DROP TABLE IF EXISTS alembic_version"))
+            connection.execute(text("DROP TABLE IF EXISTS visit_medicines CASCADE"))
+            connection.execute(text("DROP TABLE IF EXISTS visits CASCADE"))
+            db.metadata.drop_all(connection)
+        engine.dispose()
+
+
+# ---------------------------
+#   READ REPLICA
+# ---------------------------
+
+def test_reads_routed_to_replica_until_write(client, monkeypatch):
+    """GET читает с реплики; после записи и при отставании реплики — основную БД."""
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import StaticPool
+    import replica
+
+    # Пустая реплика: по ответу видно, откуда прочитаны данные
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    db.metadata.create_all(engine)
+    monkeypatch.setattr(replica, "get_replica_engine", lambda: engine)
+    replica.reset_replica_status()
+    reads = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: reads.append(statement))
+
+    doctor, patient, visits = _create_visits(1)
+    _login_as(monkeypatch, "doctor", doctor.id)
+    url = f"/doctor/visits/{visits[0].id}"
+    assert client.get(url).status_code == 404
+    assert any("visits" in statement for statement in reads)
+
+    # Снимок справочников строится по основной БД, даже когда GET читает реплику
+    from app import Medicine, Visit
+    db.session.add(Medicine(name="Replica-Medicine"))
+    db.session.commit()
+    assert "Replica-Medicine" in client.get("/doctor/add-visit").get_data(as_text=True)
+
+    response = client.post("/doctor/add-visit", data={
+        "patient_id": patient.id, "date": "2031-01-01T10:00", "location": "",
+        "symptoms": "", "diagnosis": "replica-write", "prescriptions": "",
+    })
+    assert response.status_code == 302
+    assert Visit.query.filter_by(diagnosis="replica-write").count() == 1
+    reads.clear()
+    assert client.get(url).status_code == 200
+    assert reads == []
+
+    # Окно «читаю свои записи» прошло, но реплика отстаёт
+    with client.session_transaction() as flask_session:
+        flask_session.pop(replica.STICKY_SESSION_KEY)
+    monkeypatch.setattr(replica, "REPLICA_MAX_LAG", -1)
+    replica.reset_replica_status()
+    assert client.get(url).status_code == 200
+    assert not any("visits" in statement for statement in reads)
+    replica.reset_replica_status()
+
+
+def test_read_only_post_uses_replica_without_sticking(client, monkeypatch):
+    """POST пакетного чтения идёт на реплику и не привязывает к основной БД."""
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import StaticPool
+    import replica
+
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    db.metadata.create_all(engine)
+    monkeypatch.setattr(replica, "get_replica_engine", lambda: engine)
+    replica.reset_replica_status()
+    reads = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: reads.append(statement))
+
+    doctor, _, visits = _create_visits(2)
+    _login_as(monkeypatch, "doctor", doctor.id)
+    client.post("/doctor/visits/batch", json={"ids": [v.id for v in visits]})
+    assert any("visits" in statement for statement in reads)
+    with client.session_transaction() as flask_session:
+        assert replica.STICKY_SESSION_KEY not in flask_session
+    replica.reset_replica_status()
+
+
+# ---------------------------
+#   DB POOL
+# ---------------------------
+
+def test_db_pool_profile_and_metrics(login_as_admin, monkeypatch, tmp_path):
+    """Пул по числу потоков gunicorn, счётчики ожидания и таймаутов, эндпоинт метрик."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import TimeoutError as PoolTimeout
+    import dbpool
+
+    monkeypatch.setenv("GUNICORN_THREADS", "4")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "0")
+    options = dbpool.engine_options("postgresql://db/clinic")
+    assert options["pool_size"] == 4 and options["max_overflow"] == 4
+    assert options["pool_pre_ping"] is False
+    assert "pool_size" not in dbpool.engine_options("sqlite://")
+
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", poolclass=dbpool.InstrumentedQueuePool,
+        pool_size=1, max_overflow=0, pool_timeout=0.01,
+    )
+    monkeypatch.setattr(dbpool, "_pools", dict(dbpool._pools))
+    metrics = dbpool.instrument_engine("test", engine)
+    with engine.connect():
+        with pytest.raises(PoolTimeout):
+            engine.connect()
+    stats = metrics.snapshot()
+    assert stats["checkouts"] == 1 and stats["timeouts"] == 1
+    assert stats["checked_out_peak"] == 1
+
+    response = login_as_admin.get("/admin/metrics/db-pool")
+    pools = response.get_json()["pools"]
+    assert pools["primary"]["checkouts"] > 0
+    assert pools["test"]["size"] == 1 and pools["test"]["checked_out"] == 0
+    engine.dispose()
+
+
+# ---------------------------
+#   METRICS
+# ---------------------------
+
+def test_metrics_endpoint_prometheus_format(login_as_admin):
+    """/metrics: запросы по view и статусу, SQL на запрос и время рендера шаблонов."""
+    login_as_admin.get("/health")
+    login_as_admin.get("/admin/medicines")
+
+    response = login_as_admin.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert 'http_requests_total{endpoint="health_check",method="GET",status="200"}' in text
+    assert 'http_request_duration_seconds_bucket{endpoint="health_check"' in text
+    assert 'db_queries_per_request_count{endpoint="admin_medicines_list"}' in text
+    assert 'template_render_seconds_count{template="admin/medicines_list.html"}' in text
+    assert "http_requests_in_progress" in text
+    assert 'endpoint="metrics"' not in text
+
+
+def test_metrics_endpoint_requires_token_or_localhost(client, monkeypatch):
+    """/metrics: без токена — только с localhost, с токеном — только по Bearer."""
+    import metrics
+
+    remote = {"REMOTE_ADDR": "203.0.113.7"}
+    assert client.get("/metrics", environ_base=remote).status_code == 403
+
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+    assert client.get("/metrics").status_code == 403
+    assert client.get(
+        "/metrics", headers={"Authorization": "Bearer wrong"}, environ_base=remote
+    ).status_code == 403
+    assert client.get(
+        "/metrics", headers={"Authorization": "Bearer s3cret"}, environ_base=remote
+    ).status_code == 200
+
+
+# ---------------------------
+#   QUERY BUDGET
+# ---------------------------
+
+def test_query_budget_and_n_plus_one(client, monkeypatch, capsys):
+    """Превышение бюджета маршрута в тестах — исключение, в работе — предупреждение."""
+    from collections import Counter
+    from querybudget import QueryBudgetExceeded, check_query_budget
+
+    statement = "SELECT patients.id FROM patients WHERE patients.id = ?"
+    lazy = Counter({repr((i,)): 1 for i in range(6)})
+    problems = check_query_budget({statement: lazy, "SELECT 1": Counter({"()": 1})}, 10, True)
+    assert problems == [f"N+1: 6× {statement}"]
+    assert check_query_budget({statement: lazy}, None, False) == []
+    # Тот же SQL с теми же параметрами — не N+1, но идёт в общий бюджет
+    same = {statement: Counter({"(1,)": 6})}
+    assert check_query_budget(same, 10, True) == []
+    assert check_query_budget(same, 5, True) == ["6 SQL-запросов при бюджете 5"]
+
+    doctor, _, _ = _create_visits(2)
+    _login_as(monkeypatch, "doctor", doctor.id)
+    view = app.view_functions["doctor_dashboard"]
+    assert view.query_budget == (4, True)
+    monkeypatch.setattr(view, "query_budget", (0, True))
+    with pytest.raises(QueryBudgetExceeded, match="doctor_dashboard"):
+        client.get("/doctor/dashboard")
+
+    monkeypatch.setitem(app.config, "QUERY_BUDGET_RAISE", False)
+    assert client.get("/doctor/dashboard").status_code == 200
+    assert "при бюджете 0" in capsys.readouterr().out
+
+
+# ---------------------------
+#   DATAGEN
+# ---------------------------
+
+def test_generate_dataset_is_deterministic(client):
+    """Один seed даёт те же визиты, счётчики сходятся после пакетной записи."""
+    from datetime import datetime
+    from app import Doctor, Patient, Visit, get_counters
+    from datagen import DATAGEN_PASSWORD, generate_dataset
+
+    def generate(prefix):
+        base = (db.session.query(db.func.max(Doctor.id)).scalar() or 0,
+                db.session.query(db.func.max(Patient.id)).scalar() or 0,
+                db.session.query(db.func.max(Visit.id)).scalar() or 0)
+        written = generate_dataset(2, 5, 20, 3, seed=7, prefix=prefix, end=datetime(2030, 1, 1))
+        assert written["visits"] == 20
+        visits = Visit.query.filter(Visit.id > base[2]).order_by(Visit.id)
+        return [(v.doctor_id - base[0], v.patient_id - base[1], v.date, v.diagnosis)
+                for v in visits]
+
+    assert generate("a") == generate("b")
+    assert get_counters()["visits"] == Visit.query.count()
+
+    doctor = Doctor.query.filter(Doctor.login.like("a_doctor%")).first()
+    response = client.post("/login", data={"login": doctor.login, "password": DATAGEN_PASSWORD})
+    assert response.status_code == 302
+
+
+def test_generate_dataset_skew(client):
+    """Частые диагнозы, будни и первые пациенты встречаются чаще, даты идут по порядку id."""
+    from collections import Counter
+    from datetime import datetime
+    from app import Visit
+    from datagen import DIAGNOSES, generate_dataset
+
+    first_id = (db.session.query(db.func.max(Visit.id)).scalar() or 0) + 1
+    generate_dataset(3, 100, 3000, 10, prefix="skew", days=364, end=datetime(2030, 1, 1))
+    visits = Visit.query.filter(Visit.id >= first_id).order_by(Visit.id).all()
+    assert len(visits) == 3000
+
+    dates = [v.date for v in visits]
+    assert dates == sorted(dates)
+    diagnoses = Counter(v.diagnosis for v in visits)
+    assert diagnoses.most_common(1)[0][0] == DIAGNOSES[0]
+    weekdays = Counter(v.date.weekday() for v in visits)
+    assert weekdays[0] > 3 * weekdays[5] > 0 and weekdays[6] < weekdays[5]
+    patients = Counter(v.patient_id for v in visits)
+    first_patient = min(patients)
+    assert patients[first_patient] > 10 * patients.get(first_patient + 99, 1)
+
+
+def test_populate_db_demo_accounts(client):
+    """Пустая база получает учётки со страницы входа и визиты демо-врача."""
+    from app import Doctor, Visit, populate_db
+
+    populate_db()
+    belov = Doctor.query.filter_by(login="belov").one()
+    assert Visit.query.filter_by(doctor_id=belov.id).count() > 0
+
+    response = client.post("/login", data={"login": "belov", "password": "doctor123"})
+    assert response.status_code == 302
+    assert "/login" not in response.location
+
+
+# ---------------------------
+#   CONDITIONAL RESPONSES
+# ---------------------------
+
+def test_dashboard_etag_not_modified(client, monkeypatch):
+    """Повторный запрос с тем же ETag получает 304, новый визит меняет ETag."""
+    from datetime import datetime
+    from app import Visit
+
+    doctor, patient, _ = _create_visits(1)
+    _login_as(monkeypatch, "patient", patient.id)
+
+    first = client.get("/patient/dashboard")
+    assert first.status_code == 200
+    assert "private" in first.headers["Cache-Control"]
+    etag = first.headers["ETag"]
+
+    second = client.get("/patient/dashboard", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+
+    db.session.add(Visit(patient_id=patient.id, doctor_id=doctor.id,
+                         date=datetime(2030, 2, 1), diagnosis="new"))
+    db.session.commit()
+    third = client.get("/patient/dashboard", headers={"If-None-Match": etag})
+    assert third.status_code == 200
+    assert third.headers["ETag"] != etag
+
+
+def test_visit_detail_etag(login_as_admin):
+    """JSON карточки визита тоже отвечает 304 при совпадении ETag."""
+    _, _, visits = _create_visits(1)
+    url = f"/admin/visits/{visits[0].id}"
+    etag = login_as_admin.get(url).headers["ETag"]
+    assert login_as_admin.get(url, headers={"If-None-Match": etag}).status_code == 304
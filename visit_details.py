@@ -0,0 +1,293 @@
+import threading
+import time
+
+from flask import json
+from sqlalchemy import and_, event, select
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from models import (
+    db,
+    Visit,
+    Patient,
+    Doctor,
+    Medicine,
+    VisitMedicine,
+    get_data_versions,
+)
+
+VISIT_DETAIL_CACHE_TTL = 300
+VISIT_DETAIL_CACHE_SIZE = 5000
+
+# Как часто сверять версию "visit_details" с БД, чтобы увидеть изменения,
+# сделанные другими воркерами
+VISIT_DETAIL_VERSION_CHECK_INTERVAL = 1.0
+
+# Поля карточки визита, которые видит каждая роль
+_COMMON_FIELDS = (
+    "id",
+    "date",
+    "location",
+    "symptoms",
+    "diagnosis",
+    "prescriptions",
+    "patient_first_name",
+    "patient_last_name",
+    "doctor_first_name",
+    "doctor_last_name",
+    "position",
+    "medicines",
+)
+_PATIENT_PROFILE_FIELDS = ("date_of_birth", "gender", "address")
+
+ROLE_FIELDS = {
+    "admin": ("patient_id", "doctor_id") + _COMMON_FIELDS + _PATIENT_PROFILE_FIELDS,
+    "doctor": _COMMON_FIELDS + _PATIENT_PROFILE_FIELDS,
+    "patient": _COMMON_FIELDS,
+}
+
+# visit_id -> полная карточка; (visit_id, role) -> готовый JSON
+_details = TTLCache(VISIT_DETAIL_CACHE_SIZE, VISIT_DETAIL_CACHE_TTL)
+_rendered = TTLCache(VISIT_DETAIL_CACHE_SIZE * len(ROLE_FIELDS), VISIT_DETAIL_CACHE_TTL)
+
+_version_lock = threading.Lock()
+_version = {"value": None, "checked_at": 0.0}
+
+# Поколение кеша: растёт при каждой инвалидации. Карточка, загруженная до
+# инвалидации, не кладётся в кеш после неё (иначе жила бы весь TTL)
+_cache_lock = threading.Lock()
+_generation = {"value": 0}
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _load_visit_details(visit_ids):
+    """Карточки визитов одним запросом: визит + пациент + врач + лекарства."""
+    rows = db.session.execute(
+        select(
+            Visit.id,
+            Visit.patient_id,
+            Visit.doctor_id,
+            Visit.date,
+            Visit.location,
+            Visit.symptoms,
+            Visit.diagnosis,
+            Visit.prescriptions,
+            Patient.first_name.label("patient_first_name"),
+            Patient.last_name.label("patient_last_name"),
+            Patient.date_of_birth,
+            Patient.gender,
+            Patient.address,
+            Doctor.first_name.label("doctor_first_name"),
+            Doctor.last_name.label("doctor_last_name"),
+            Doctor.position,
+            Medicine.id.label("medicine_id"),
+            Medicine.name.label("medicine_name"),
+            Medicine.description.label("medicine_description"),
+            Medicine.side_effects.label("medicine_side_effects"),
+            Medicine.usage_method.label("medicine_usage_method"),
+            VisitMedicine.doctor_instructions,
+        )
+        .join(Patient, Visit.patient_id == Patient.id)
+        .join(Doctor, Visit.doctor_id == Doctor.id)
+        .outerjoin(
+            VisitMedicine,
+            and_(VisitMedicine.visit_id == Visit.id, VisitMedicine.visit_date == Visit.date),
+        )
+        .outerjoin(Medicine, VisitMedicine.medicine_id == Medicine.id)
+        .where(Visit.id.in_(visit_ids))
+        .order_by(Visit.id, VisitMedicine.id)
+    )
+
+    details = {}
+    for row in rows:
+        detail = details.get(row.id)
+        if detail is None:
+            detail = details[row.id] = {
+                "id": row.id,
+                "patient_id": row.patient_id,
+                "doctor_id": row.doctor_id,
+                "date": _isoformat(row.date),
+                "location": row.location,
+                "symptoms": row.symptoms,
+                "diagnosis": row.diagnosis,
+                "prescriptions": row.prescriptions,
+                "patient_first_name": row.patient_first_name,
+                "patient_last_name": row.patient_last_name,
+                "date_of_birth": _isoformat(row.date_of_birth),
+                "gender": row.gender,
+                "address": row.address,
+                "doctor_first_name": row.doctor_first_name,
+                "doctor_last_name": row.doctor_last_name,
+                "position": row.position,
+                "medicines": [],
+            }
+        if row.medicine_id is not None:
+            detail["medicines"].append(
+                {
+                    "name": row.medicine_name,
+                    "description": row.medicine_description,
+                    "side_effects": row.medicine_side_effects,
+                    "usage_method": row.medicine_usage_method,
+                    "doctor_instructions": row.doctor_instructions,
+                }
+            )
+    return details
+
+
+def _check_version():
+    now = time.monotonic()
+    if now - _version["checked_at"] < VISIT_DETAIL_VERSION_CHECK_INTERVAL:
+        return
+    with _version_lock:
+        if now - _version["checked_at"] < VISIT_DETAIL_VERSION_CHECK_INTERVAL:
+            return
+        value = get_data_versions("visit_details")["visit_details"]
+        if value != _version["value"]:
+            invalidate_all_visit_details()
+            _version["value"] = value
+        _version["checked_at"] = now
+
+
+def visit_details_version():
+    """Версия карточек визитов, известная этому воркеру (без лишних запросов)."""
+    _check_version()
+    return _version["value"]
+
+
+def get_visit_detail(visit_id):
+    """Полная карточка визита (без фильтрации по роли) или None."""
+    _check_version()
+    detail = _details.get(visit_id)
+    if detail is None:
+        generation = _generation["value"]
+        detail = _load_visit_details([visit_id]).get(visit_id)
+        if detail is not None:
+            _store_details(generation, {visit_id: detail})
+    return detail
+
+
+def get_visit_details(visit_ids):
+    """Карточки нескольких визитов: кеш + один запрос для промахов.
+
+    Возвращает {visit_id: detail} только для найденных визитов.
+    """
+    _check_version()
+    details, misses = {}, []
+    for visit_id in visit_ids:
+        detail = _details.get(visit_id)
+        if detail is None:
+            misses.append(visit_id)
+        else:
+            details[visit_id] = detail
+
+    if misses:
+        generation = _generation["value"]
+        loaded = _load_visit_details(misses)
+        _store_details(generation, loaded)
+        details.update(loaded)
+    return details
+
+
+def _store_details(generation, loaded):
+    """Кладёт загруженные карточки в кеш, если с начала загрузки не было инвалидаций."""
+    with _cache_lock:
+        if generation != _generation["value"]:
+            return
+        for visit_id, detail in loaded.items():
+            _details.set(visit_id, detail)
+
+
+def can_view(detail, user):
+    """Доступ к карточке: админ — к любой, врач и пациент — только к своим."""
+    if user.role == "admin":
+        return True
+    if user.role == "doctor":
+        return detail["doctor_id"] == user.id
+    if user.role == "patient":
+        return detail["patient_id"] == user.id
+    return False
+
+
+def filter_for_role(detail, role):
+    return {field: detail[field] for field in ROLE_FIELDS[role]}
+
+
+def render_visit_detail(detail, role):
+    """JSON карточки для роли; сериализуется один раз и кешируется."""
+    key = (detail["id"], role)
+    body = _rendered.get(key)
+    if body is None:
+        body = json.dumps(filter_for_role(detail, role))
+        with _cache_lock:
+            # Карточку уже сбросили — её JSON тоже не кешируем
+            if _details.get(detail["id"]) is detail:
+                _rendered.set(key, body)
+    return body
+
+
+def invalidate_visit_detail(visit_id):
+    with _cache_lock:
+        _generation["value"] += 1
+        _details.pop(visit_id)
+        for role in ROLE_FIELDS:
+            _rendered.pop((visit_id, role))
+
+
+def invalidate_all_visit_details():
+    with _cache_lock:
+        _generation["value"] += 1
+        _details.clear()
+        _rendered.clear()
+
+
+# ---------- ИНВАЛИДАЦИЯ ПРИ ЗАПИСИ ----------
+# В своём воркере карточки сбрасываются сразу после коммита, в остальных —
+# по изменению версии "visit_details" (см. _check_version).
+
+
+def _mark_visit(visit_id_attr):
+    def listener(mapper, connection, target):
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault("stale_visit_details", set()).add(
+                getattr(target, visit_id_attr)
+            )
+
+    return listener
+
+
+def _mark_all(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["stale_all_visit_details"] = True
+
+
+for _event_name in ("after_update", "after_delete"):
+    event.listen(Visit, _event_name, _mark_visit("id"))
+    event.listen(VisitMedicine, _event_name, _mark_visit("visit_id"))
+    for _model in (Patient, Doctor, Medicine):
+        event.listen(_model, _event_name, _mark_all)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("stale_all_visit_details", False):
+        invalidate_all_visit_details()
+    for visit_id in session.info.pop("stale_visit_details", ()):
+        invalidate_visit_detail(visit_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("stale_all_visit_details", None)
+    session.info.pop("stale_visit_details", None)
+
+
+@event.listens_for(Visit.__table__, "after_drop")
+def _invalidate_after_drop(target, connection, **kw):
+    # Таблица пересоздаётся (тесты, восстановление из дампа) — id начнутся заново
+    invalidate_all_visit_details()
+    _version["value"] = None